@@ -8,11 +8,19 @@ import torch
 from version import SPLATOON_VERSION
 from error import *
 from log import Logger 
+from utils import MovieReader, OCRCache, FrameRequestPlanner
+from movie_stream import MovieStream
 from prediction.ikalamp_detection_process import run_ikalamp_detection, SharedIkalampDetectionResult, IkalampDetectionResult
 from prediction.ika_player_detection_process import run_ika_player_detection, SharedIkaPlayerDetectionResult, IkaPlayerDetectionResult
 from prediction.notification_detection_process import run_notification_detection, SharedNotificationDetectionResult, NotificationDetectionResult
 from prediction.battle_indicator_detection_process import run_battle_indicator_detection, SharedBattleIndicatorDetectionResult, BattleIndicatorDetectionResult
 from prediction.match_detection_process import run_match_detection, SharedMatchDetectionResult, MatchDetectionResult 
+from prediction.scene_classification_process import run_scene_classification, SharedSceneClassificationResult, find_battle_spans
+from prediction.frame_bus import FrameBus, run_frame_decoder
+from prediction.crop_store import CropStore
+from prediction.model_registry import ModelRegistry
+from prediction.batch_broker import ModelBroker
+from prediction.detector_pool import DetectorPool
 from prediction.splash_font_ocr import SplashFontOCR
 from prediction.plate_frame_analyzer import PlateFrameAnalyzer
 from prediction.stage_frame_classifier import StageFrameClassifier
@@ -37,6 +45,7 @@ from events.special_weapon_event import SpecialWeaponEventCreator, SpecialWeapon
 
 @dataclass
 class ModelPaths:
+    # .pt models run on torch, .onnx models exported by tools/export_onnx.py run on ONNX Runtime
     ikalamp_model_path: str
     ika_player_model_path: str
     notification_model_path: str
@@ -56,6 +65,8 @@ class ModelPaths:
     sp_weapon_model_path : str
     weapon_gauge_model_path: str
     ink_tank_model_path : str
+    # frame type classifier for the battle span pass. the pass is skipped when not set
+    scene_model_path: str = None
 
 @dataclass
 class BattlePreprocessParams:
@@ -66,6 +77,21 @@ class BattlePreprocessParams:
     analysis_per_second: int = 10
     process_id: int = 0
     batch_size: int = 1
+    shared_decode: bool = True
+    store_crops: bool = True
+    # the notification pass decodes the movie while it downloads. later stages wait for the complete file,
+    # and mp4 with the moov atom at the end is decoded only after the download
+    streaming: bool = False
+    # notification pre-scan rate while no battle notification is visible, e.g. 1. None scans at analysis_per_second.
+    # off by default until adaptive results are verified against full scans
+    idle_analysis_per_second: int = None
+    active_window_seconds: int = 30
+    scene_analysis_per_second: int = 1
+    battle_span_padding_seconds: int = 10
+    # base rate of coarse-to-fine detection of lamps, indicators and notifications. None runs them at analysis_per_second
+    coarse_analysis_per_second: int = None
+    # run detection on long-lived workers that keep models loaded instead of a process per call
+    persistent_detectors: bool = True
 
 @dataclass
 class BattlePreprocessResult:
@@ -111,6 +137,7 @@ class BattleAnalyzer:
         self.device = device
         self.logger = Logger(log_name)
         self.preprocess_params: BattlePreprocessParams = None
+        self.preprocess_result: BattlePreprocessResult = None
         self.ikalamp_result: IkalampDetectionResult = None
         self.ika_player_result: IkaPlayerDetectionResult = None
         self.notification_result: NotificationDetectionResult = None
@@ -118,6 +145,10 @@ class BattleAnalyzer:
         self.frame_rate = None
         self.frame_interval = None
         self.prev_result: BattleAnalysisResult = None
+        self.crop_stores: dict[str, CropStore] = {}
+        self.crop_store_paths: set[str] = set()
+        self.battle_spans: list[tuple[int, int]] = None
+        self.ocr_cache: OCRCache = None
 
     def preprocess(self, params: BattlePreprocessParams) -> None:
         if not os.path.exists(params.battle_movie_path):
@@ -134,32 +165,62 @@ class BattleAnalyzer:
             SharedNotificationDetectionResult.reset()
             SharedBattleIndicatorDetectionResult.set_id(params.process_id)
             SharedBattleIndicatorDetectionResult.reset()
+            SharedSceneClassificationResult.set_id(params.process_id)
+            SharedSceneClassificationResult.reset()
             
-            cap = cv2.VideoCapture(self.preprocess_params.battle_movie_path)
-            self.frame_rate = int(cap.get(cv2.CAP_PROP_FPS))
+            if self.preprocess_params.streaming:
+                # the movie is still downloading. it is complete once the notification process consumed the stream
+                self.frame_rate = round(MovieStream(self.preprocess_params.battle_movie_path).frame_rate)
+            else:
+                cap = cv2.VideoCapture(self.preprocess_params.battle_movie_path)
+                # round so 29.97 fps is handled as 30, not truncated to 29
+                self.frame_rate = round(cap.get(cv2.CAP_PROP_FPS))
             analysis_per_second = self.preprocess_params.analysis_per_second or self.frame_rate
             self.frame_interval = int(self.frame_rate / analysis_per_second)
 
+            # find battles with the light classifier first so notifications are detected only there
+            self.battle_spans = None
+            if self.model_paths.scene_model_path is not None and not self.preprocess_params.streaming:
+                scene_classifier = self._create_scene_process(self.preprocess_params.batch_size)
+                scene_classifier.start()
+                scene_classifier.join()
+                scene_result = SharedSceneClassificationResult.read()
+                if scene_result is None:
+                    raise InternalError('scene classification failed')
+                padding = self.frame_rate * self.preprocess_params.battle_span_padding_seconds
+                self.battle_spans = find_battle_spans(scene_result, padding=padding, merge_gap=padding, min_frames=self.frame_rate * 30)
+                self.logger.info(f'scene process completed. processing time: {scene_result.processing_time}, battle spans: {self.battle_spans}')
+                if len(self.battle_spans) == 0:
+                    # nothing looked like a battle. fall back to the full scan rather than failing on a classifier miss
+                    self.battle_spans = None
+
             notification_detecotr = self._create_notification_process(self.frame_interval, self.preprocess_params.batch_size, 0, None)
             notification_detecotr.start()
             notification_detecotr.join()
             self.notification_result = SharedNotificationDetectionResult.read()
+            self._attach_crop_store('notification')
             
             if self.notification_result is None:
                 raise InternalError('prepress frames failed')
             
             self.logger.info(f'notification process completed. processing time: {self.notification_result.processing_time}')
             
+            if self.preprocess_params.streaming:
+                cap = cv2.VideoCapture(self.preprocess_params.battle_movie_path)
             width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
             height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            # exact count from the keyframe index. CAP_PROP_FRAME_COUNT is estimated from the container
+            reader = MovieReader(self.preprocess_params.battle_movie_path)
+            frame_count = reader.frame_count
+            reader.release()
 
-            return BattlePreprocessResult(
+            self.preprocess_result = BattlePreprocessResult(
                 movie_width=width,
                 movie_height=height,
                 movie_frames=frame_count,
                 frame_rate=self.frame_rate
             )
+            return self.preprocess_result
         except InternalError as e:
             raise e
         except Exception as e:
@@ -172,24 +233,31 @@ class BattleAnalyzer:
         self.logger.info(f'analysis started. frame {params.start_frame} to {params.end_frame}')
 
         # create analysis stuffs
+        # texts read repeatedly over the battle are shared by all OCR users of this analysis
+        self.ocr_cache = OCRCache(int(os.environ.get('OCR_CACHE_ENTRIES', 4096)), parent=SplashFontOCR.shared_cache)
         ocr = self._create_ocr()
+        # frames read by the stages after detection. requests made before a run are read in one pass
+        frame_planner = FrameRequestPlanner(self.preprocess_params.battle_movie_path)
         plate_analyzer = PlateFrameAnalyzer(
             plate_model_path=self.model_paths.plate_model_path,
             battle_movie_path=self.preprocess_params.battle_movie_path,
             device=self.device,
-            ocr=ocr
+            ocr=ocr,
+            planner=frame_planner
         )
 
         stage_classifier = StageFrameClassifier(
             battle_movie_path=self.preprocess_params.battle_movie_path,
             model_path=self.model_paths.stage_model_path,
-            device=self.device
+            device=self.device,
+            planner=frame_planner
         )
         
         buki_classifier = BukiFrameClassifier(
             battle_movie_path=self.preprocess_params.battle_movie_path,
             model_path=self.model_paths.buki_model_path,
-            device=self.device
+            device=self.device,
+            planner=frame_planner
         )
         
         sub_weapon_classifier = SubWeaponFrameClassifier(
@@ -246,24 +314,51 @@ class BattleAnalyzer:
         battle_start_frame = pre_open_event.end_frame
         battle_end_frame = end_event.start_frame
         result_end_frame = battle_end_frame + self.frame_rate * 30 # result view displays at most within 30s after battle end
+        if self.battle_spans is not None:
+            # the result view is inside the span of the battle
+            span_end = next((end for start, end in self.battle_spans if start <= battle_end_frame <= end), None)
+            if span_end is not None and battle_end_frame < span_end:
+                result_end_frame = min(result_end_frame, span_end)
         
-        ikalamp_detector = self._create_ikalamp_process(self.frame_interval, self.preprocess_params.batch_size, battle_start_frame, battle_end_frame)
+        # decode battle frames once and share them with all detectors
+        # refined detectors read only the frames they infer and do not consume the bus
+        refined = self._coarse_frame_interval() is not None
+        frame_bus = None
+        frame_decoder = None
+        if self.preprocess_params.shared_decode:
+            frame_bus = FrameBus.create(
+                bus_id=self.preprocess_params.process_id,
+                width=self.preprocess_result.movie_width,
+                height=self.preprocess_result.movie_height,
+                total_frames=self.preprocess_result.movie_frames,
+                consumers=1 if refined else 3
+            )
+            frame_decoder = self._create_frame_decoder_process(self.frame_interval, battle_start_frame, battle_end_frame if refined else result_end_frame)
+            frame_decoder.start()
+
+        ikalamp_detector = self._create_ikalamp_process(self.frame_interval, self.preprocess_params.batch_size, battle_start_frame, battle_end_frame, 1 if frame_bus and not refined else None)
         ikalamp_detector.start()
 
-        ika_player_detecotr = self._create_ika_player_process(self.frame_interval, self.preprocess_params.batch_size, battle_start_frame, battle_end_frame)
+        ika_player_detecotr = self._create_ika_player_process(self.frame_interval, self.preprocess_params.batch_size, battle_start_frame, battle_end_frame, 0 if frame_bus else None)
         ika_player_detecotr.start()
         
-        indicator_detector = self._create_battle_indicator_process(self.frame_interval, self.preprocess_params.batch_size, battle_start_frame, result_end_frame)
+        indicator_detector = self._create_battle_indicator_process(self.frame_interval, self.preprocess_params.batch_size, battle_start_frame, result_end_frame, 2 if frame_bus and not refined else None)
         indicator_detector.start()
             
         ikalamp_detector.join()
         self.ikalamp_result = SharedIkalampDetectionResult.read()
+        self._attach_crop_store('ikalamp')
 
         ika_player_detecotr.join()
         self.ika_player_result = SharedIkaPlayerDetectionResult.read()
+        self._attach_crop_store('ika_player')
         
         indicator_detector.join()
         self.indicator_result = SharedBattleIndicatorDetectionResult.read()
+
+        if frame_bus is not None:
+            frame_decoder.join()
+            frame_bus.unlink()
         
         if self.ikalamp_result is None or self.ika_player_result is None or self.indicator_result is None:
             raise InternalError('battle frame analysis failed')
@@ -299,6 +394,7 @@ class BattleAnalyzer:
             ikalamp_result=self.ikalamp_result,
             ika_player_result=self.ika_player_result,
             indicator_result=self.indicator_result,
+            planner=frame_planner,
             logger=self.logger
         )
         battle_info.build(
@@ -381,7 +477,8 @@ class BattleAnalyzer:
         ink_tank_analyzer = InkTankFrameAnalyzer(
             battle_movie_path=self.preprocess_params.battle_movie_path,
             ink_tank_model_path=self.model_paths.ink_tank_model_path,
-            device=self.device
+            device=self.device,
+            planner=frame_planner
         )
         ink_tank_analyzer.analyze(position_analysis_result)
         
@@ -434,6 +531,17 @@ class BattleAnalyzer:
         if self.device.startswith('cuda'):
             torch.cuda.empty_cache()
 
+        cache_stats = MovieReader.cache.stats()
+        self.logger.info(f'frame cache hits: {cache_stats["hits"]}, misses: {cache_stats["misses"]}, hit rate: {cache_stats["hit_rate"]:.2f}, evictions: {cache_stats["evictions"]}, bytes: {cache_stats["bytes"]}')
+        ocr_stats = self.ocr_cache.stats()
+        self.logger.info(f'ocr cache hits: {ocr_stats["hits"]}, misses: {ocr_stats["misses"]}, hit rate: {ocr_stats["hit_rate"]:.2f}, evictions: {ocr_stats["evictions"]}, entries: {ocr_stats["entries"]}')
+        model_stats = ModelRegistry.report()
+        self.logger.info(f'model registry models: {len(model_stats)}, load time: {sum(m.load_time for m in model_stats):.2f}, parameter bytes: {sum(m.parameter_bytes for m in model_stats)}, rss bytes: {sum(m.rss_bytes for m in model_stats)}, handles: {sum(m.handles for m in model_stats)}')
+        for broker_stats in ModelBroker.report():
+            self.logger.info(f'model broker {broker_stats.name} batches: {broker_stats.batches}, items: {broker_stats.items}, batch sizes: {broker_stats.batch_size_histogram}, latency ms: {broker_stats.latency_ms_histogram}')
+        if SplashFontOCR.shared_cache is not None:
+            shared_stats = SplashFontOCR.shared_cache.stats()
+            self.logger.info(f'shared ocr cache hits: {shared_stats["hits"]}, misses: {shared_stats["misses"]}, hit rate: {shared_stats["hit_rate"]:.2f}, entries: {shared_stats["entries"]}')
         self.logger.info('analysis completed')
         
         self.prev_result = BattleAnalysisResult(
@@ -453,11 +561,24 @@ class BattleAnalyzer:
         )
 
         return self.prev_result, None
+
+    def release(self) -> None:
+        """
+        Close and delete the crop stores of the movie. Called after the last analysis of the movie.
+        """
+        if self.preprocess_params is None:
+            return
+        CropStore.detach_all(self.preprocess_params.battle_movie_path)
+        for path in self.crop_store_paths:
+            CropStore.remove(path)
+        self.crop_stores = {}
+        self.crop_store_paths = set()
     
-    def _create_ikalamp_process(self, frame_interval: int, batch_size: int, start_frame: int, end_frame: int) -> Process:
-        return Process(
-            target=run_ikalamp_detection,
-            args=[
+    def _create_ikalamp_process(self, frame_interval: int, batch_size: int, start_frame: int, end_frame: int, frame_bus_consumer: int=None) -> Process:
+        return self._create_detector(
+            'ikalamp',
+            run_ikalamp_detection,
+            [
                 self.preprocess_params.battle_movie_path,
                 self.model_paths.ikalamp_model_path,
                 frame_interval,
@@ -466,13 +587,20 @@ class BattleAnalyzer:
                 batch_size,
                 start_frame,
                 end_frame
-            ]
+            ],
+            {
+                'frame_bus_id': self.preprocess_params.process_id if frame_bus_consumer is not None else None,
+                'frame_bus_consumer': frame_bus_consumer,
+                'crop_store_path': self._crop_store_path('ikalamp'),
+                'coarse_frame_interval': self._coarse_frame_interval()
+            }
         )
     
-    def _create_ika_player_process(self, frame_interval: int, batch_size: int, start_frame: int, end_frame: int) -> Process:
-        return Process(
-            target=run_ika_player_detection,
-            args=[
+    def _create_ika_player_process(self, frame_interval: int, batch_size: int, start_frame: int, end_frame: int, frame_bus_consumer: int=None) -> Process:
+        return self._create_detector(
+            'ika_player',
+            run_ika_player_detection,
+            [
                 self.preprocess_params.battle_movie_path,
                 self.model_paths.ika_player_model_path,
                 frame_interval,
@@ -481,13 +609,19 @@ class BattleAnalyzer:
                 batch_size,
                 start_frame,
                 end_frame
-            ]
+            ],
+            {
+                'frame_bus_id': self.preprocess_params.process_id if frame_bus_consumer is not None else None,
+                'frame_bus_consumer': frame_bus_consumer,
+                'crop_store_path': self._crop_store_path('ika_player')
+            }
         )
     
     def _create_notification_process(self, frame_interval: int, batch_size: int, start_frame: int, end_frame: int) -> Process:
-        return Process(
-            target=run_notification_detection,
-            args=[
+        return self._create_detector(
+            'notification',
+            run_notification_detection,
+            [
                 self.preprocess_params.battle_movie_path,
                 self.model_paths.notification_model_path,
                 frame_interval,
@@ -496,13 +630,37 @@ class BattleAnalyzer:
                 batch_size,
                 start_frame,
                 end_frame
+            ],
+            {
+                'crop_store_path': self._crop_store_path('notification'),
+                'streaming': self.preprocess_params.streaming,
+                'idle_frame_interval': self._idle_frame_interval(frame_interval),
+                'active_window': self.frame_rate * self.preprocess_params.active_window_seconds,
+                'spans': self.battle_spans,
+                'coarse_frame_interval': self._coarse_frame_interval()
+            }
+        )
+
+    def _create_scene_process(self, batch_size: int) -> Process:
+        scene_per_second = min(self.preprocess_params.scene_analysis_per_second, self.frame_rate)
+        return self._create_detector(
+            'scene',
+            run_scene_classification,
+            [
+                self.preprocess_params.battle_movie_path,
+                self.model_paths.scene_model_path,
+                self.frame_rate // scene_per_second,
+                self.device,
+                self.preprocess_params.process_id,
+                batch_size
             ]
         )
     
-    def _create_battle_indicator_process(self, frame_interval: int, batch_size: int, start_frame: int, end_frame: int) -> Process:
-        return Process(
-            target=run_battle_indicator_detection,
-            args=[
+    def _create_battle_indicator_process(self, frame_interval: int, batch_size: int, start_frame: int, end_frame: int, frame_bus_consumer: int=None) -> Process:
+        return self._create_detector(
+            'battle_indicator',
+            run_battle_indicator_detection,
+            [
                 self.preprocess_params.battle_movie_path,
                 self.model_paths.battle_indicator_model_path,
                 frame_interval,
@@ -511,6 +669,60 @@ class BattleAnalyzer:
                 batch_size,
                 start_frame,
                 end_frame
+            ],
+            {
+                'frame_bus_id': self.preprocess_params.process_id if frame_bus_consumer is not None else None,
+                'frame_bus_consumer': frame_bus_consumer,
+                'coarse_frame_interval': self._coarse_frame_interval()
+            }
+        )
+    
+    def _create_detector(self, name: str, target, args: list, kwargs: dict | None = None):
+        kwargs = kwargs or {}
+        if self.preprocess_params.persistent_detectors:
+            # warm worker of the model. reused across battles and jobs in this process
+            return DetectorPool.job(name, target, args, kwargs)
+        return Process(target=target, args=args, kwargs=kwargs)
+
+    def _idle_frame_interval(self, frame_interval: int) -> int:
+        if not self.preprocess_params.idle_analysis_per_second:
+            return None
+        idle_frame_interval = self.frame_rate // self.preprocess_params.idle_analysis_per_second
+        return idle_frame_interval if frame_interval < idle_frame_interval else None
+
+    def _coarse_frame_interval(self) -> int:
+        if not self.preprocess_params.coarse_analysis_per_second:
+            return None
+        coarse_frame_interval = self.frame_rate // self.preprocess_params.coarse_analysis_per_second
+        return coarse_frame_interval if self.frame_interval < coarse_frame_interval else None
+
+    def _crop_store_path(self, name: str) -> str:
+        if not self.preprocess_params.store_crops:
+            return None
+        # a store is rewritten by the next detection pass. close the previous one first
+        if name in self.crop_stores:
+            CropStore.detach(self.preprocess_params.battle_movie_path, self.crop_stores.pop(name))
+        path = CropStore.unique_path(name, self.preprocess_params.process_id)
+        CropStore.remove(path)
+        self.crop_store_paths.add(path)
+        return path
+
+    def _attach_crop_store(self, name: str):
+        if not self.preprocess_params.store_crops:
+            return
+        store = CropStore.attach(self.preprocess_params.battle_movie_path, CropStore.unique_path(name, self.preprocess_params.process_id))
+        if store is not None:
+            self.crop_stores[name] = store
+
+    def _create_frame_decoder_process(self, frame_interval: int, start_frame: int, end_frame: int) -> Process:
+        return Process(
+            target=run_frame_decoder,
+            args=[
+                self.preprocess_params.battle_movie_path,
+                self.preprocess_params.process_id,
+                frame_interval,
+                start_frame,
+                end_frame
             ]
         )
     
@@ -523,5 +735,6 @@ class BattleAnalyzer:
             alphabet_model_path=self.model_paths.alphabet_model_path,
             symbol_model_path=self.model_paths.symbol_model_path,
             char_model_path=self.model_paths.char_model_path,
-            device=self.device
+            device=self.device,
+            cache=self.ocr_cache
         )
\ No newline at end of file
@@ -2,7 +2,7 @@ from dataclasses import dataclass
 from models.battle import BattleRule
 from models.notification import NotificationType, Notification
 from prediction.notification_detection_process import NotificationDetectionFrame, NotificationDetectionResult
-from events.util import find_target_frames, TestResult
+from events.util import find_target_runs, to_test_results
 
 @dataclass
 class BattleEndEvent:
@@ -12,17 +12,15 @@ class BattleEndEvent:
 
 class BattleEndEventCreator:
     def create(self, notif_result: NotificationDetectionResult) -> BattleEndEvent:
-        notify_frames = notif_result.get_sliced_frames()
-        start_idx, end_idx = find_target_frames(notify_frames, self._is_ending_frame, exit_test_frame_count=30)
-        if start_idx is None:
+        frame_numbers = notif_result.get_sliced_frame_numbers()
+        is_ending_frame = notif_result.sliced_counts(NotificationType.NOTIFICATION_BATTLE_END) > 10
+        runs = find_target_runs(to_test_results(is_ending_frame), exit_test_frame_count=30)
+        if len(runs) == 0:
             return None
+        start_idx, end_idx = runs[0]
         
         return BattleEndEvent(
-            start_frame=notify_frames[start_idx].frame,
-            end_frame=notify_frames[end_idx].frame,
+            start_frame=int(frame_numbers[start_idx]),
+            end_frame=int(frame_numbers[end_idx]),
             rule=BattleRule.UNKNOWN
         )
-
-    def _is_ending_frame(self, frame: NotificationDetectionFrame, in_target_frame: bool) -> TestResult:
-        end_notifs = list(filter(lambda n: n.type == NotificationType.NOTIFICATION_BATTLE_END, frame.notifications))
-        return TestResult.TARGET if len(end_notifs) > 10 else TestResult.NOT_TARGET
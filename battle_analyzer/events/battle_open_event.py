@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+import numpy as np
 from models.battle import BattleRule, BattleSide, BattleStage
 from models.ika_player import IkaPlayer
 from models.ikalamp import IkalampState
@@ -8,7 +9,7 @@ from prediction.frame import Frame
 from prediction.notification_detection_process import NotificationDetectionFrame, NotificationDetectionResult
 from prediction.ikalamp_detection_process import IkalampDetectionFrame, IkalampDetectionResult
 from prediction.plate_frame_analyzer import PlateFrameAnalyzer
-from events.util import taget_frames_generator, TestResult
+from events.util import find_target_runs, to_test_results
 from utils import likely_value
 
 @dataclass
@@ -20,6 +21,14 @@ class BattleOpenEvent:
     end_frame: int
 
 class BattleOpenEventCreator:
+    rule_notification_types = [
+        NotificationType.NOTIFICATION_RULE_NAWABARI,
+        NotificationType.NOTIFICATION_RULE_HOKO,
+        NotificationType.NOTIFICATION_RULE_YAGURA,
+        NotificationType.NOTIFICATION_RULE_ASARI,
+        NotificationType.NOTIFICATION_RULE_AREA
+    ]
+
     def __init__(self, frame_rate: int) -> None:
         self.frame_rate = frame_rate
 
@@ -29,10 +38,8 @@ class BattleOpenEventCreator:
         plate_analyzer: PlateFrameAnalyzer,
         player_detection_enabled: bool=True) -> BattleOpenEvent:
         notif_frames = notif_result.get_sliced_frames()
-        generator = taget_frames_generator(notif_frames, self._is_opening_frame, exit_test_frame_count=30)
-        for open_frames, _, end_idx in generator:
-            if len(open_frames) == 0:
-                continue
+        for start_idx, end_idx in find_target_runs(to_test_results(self._opening_frames(notif_result)), exit_test_frame_count=30):
+            open_frames = notif_frames[start_idx:end_idx + 1]
             
             start_frame = open_frames[0].frame
             end_frame = open_frames[-1].frame
@@ -68,9 +75,10 @@ class BattleOpenEventCreator:
         
         return None
     
-    def _is_opening_frame(self, frame: NotificationDetectionFrame, in_target_frame: bool) -> TestResult:
-        is_target = self._find_rule_notification(frame) and len(self._find_plate_notifications(frame)) >= 2
-        return TestResult.TARGET if is_target else TestResult.NOT_TARGET
+    def _opening_frames(self, notif_result: NotificationDetectionResult) -> np.ndarray:
+        # frames with a rule notification and at least two plates
+        rule_counts = sum(notif_result.sliced_counts(rule_type) for rule_type in self.rule_notification_types)
+        return (rule_counts > 0) & (notif_result.sliced_counts(NotificationType.NOTIFICATION_PLAYER_PLATE) >= 2)
     
     def _count_players(self, ikalamp_result: IkalampDetectionResult) -> (int, int):
         def _to_team_value(frame: IkalampDetectionFrame) -> int:
@@ -191,13 +199,7 @@ class BattleOpenEventCreator:
 
     def _find_rule_notification(self, frame: NotificationDetectionFrame) -> Notification:
         for notif in frame.notifications:
-            if notif.type in [
-                NotificationType.NOTIFICATION_RULE_NAWABARI,
-                NotificationType.NOTIFICATION_RULE_HOKO,
-                NotificationType.NOTIFICATION_RULE_YAGURA,
-                NotificationType.NOTIFICATION_RULE_ASARI,
-                NotificationType.NOTIFICATION_RULE_AREA
-            ]:
+            if notif.type in self.rule_notification_types:
                 return notif
         return None
     
@@ -8,13 +8,14 @@ from models.ikalamp import IkalampState
 from models.battle import BattleSide
 from models.battle_info import BattleInfo
 from models.notification import NotificationType, Notification
-from models.text import to_str, likely_text
-from prediction.ikalamp_detection_process import IkalampDetectionResult, IkalampDetectionFrame
+from models.text import to_str, likely_text, Char
+from prediction.ikalamp_detection_process import IkalampDetectionResult
 from prediction.notification_detection_process import NotificationDetectionResult, NotificationDetectionFrame
 from prediction.splash_font_ocr import SplashFontOCR
 from prediction.plate_frame_analyzer import PlateFrameAnalyzer
 from utils import MovieReader
-from events.util import taget_frames_generator, TestResult
+from events.util import find_target_runs, to_test_results, TestResult
+from events.lamp_state_matrix import LampStateMatrix
 from error import InternalError
 
 class DeathReasonType(Enum):
@@ -49,15 +50,16 @@ class DeathMonitor:
         self.drop_frame_start = drop_frame_start
         self.drop_frame_false_range = 30
 
-    def is_death_frame(self, frame: IkalampDetectionFrame, in_target_frame: bool) -> TestResult:
-        if (self.side == BattleSide.TEAM and frame.team is None) or (self.side == BattleSide.ENEMY and frame.enemy is None):
-            return TestResult.TARGET if in_target_frame else TestResult.NOT_TARGET # assume that death frame continues until non-death frames found
-        
-        if self.drop_frame_start and self.drop_frame_start - self.drop_frame_false_range <= frame.frame:
-            return TestResult.NOT_TARGET
-
-        lamp = frame.team[self.ord] if self.side == BattleSide.TEAM else frame.enemy[self.ord]
-        return TestResult.TARGET if lamp.state == IkalampState.DEATH else TestResult.NOT_TARGET
+    def find_death_runs(self, lamp_states: LampStateMatrix) -> np.ndarray:
+        # frames without lamps continue the current run. frames from just before the lamp drop are not deaths
+        return lamp_states.find_runs(
+            self.side,
+            self.ord,
+            IkalampState.DEATH,
+            exit_test_frame_count=2,
+            missing_result=TestResult.CONTINUE,
+            not_target_from=self.drop_frame_start - self.drop_frame_false_range if self.drop_frame_start else None
+        )
 
 
 class DeathEventCreator(Thread):
@@ -89,19 +91,20 @@ class DeathEventCreator(Thread):
         death_notifications = self._detect_death_notifications(self.notif_result)
         
         ikalamp_frames = self.ikalamp_result.slice(self.ikalamp_result.start_frame, self.battle_info.end_event.start_frame).get_sliced_frames()
+        lamp_states = LampStateMatrix.from_frames(ikalamp_frames)
+        drop_frames = self._find_drop_frames()
         players = self.battle_info.team_players + self.battle_info.enemy_players
         events = []
         for player in players:
-            monitor = DeathMonitor(player.side, player.lamp_ord, self._find_drop_frame(player))
-            generator = taget_frames_generator(ikalamp_frames, monitor.is_death_frame, exit_test_frame_count=2)
-            for death_frames, _, _ in generator:
-                if len(death_frames) < 2: # at least two consecutive frames
+            monitor = DeathMonitor(player.side, player.lamp_ord, drop_frames.get((player.side, player.lamp_ord)))
+            for start_idx, end_idx in monitor.find_death_runs(lamp_states):
+                if end_idx - start_idx + 1 < 2: # at least two consecutive frames
                     continue
                         
                 events.append(self._make_death_event(
                     player,
-                    death_frames[0].frame,
-                    death_frames[-1].frame,
+                    int(lamp_states.frame_numbers[start_idx]),
+                    int(lamp_states.frame_numbers[end_idx]),
                     death_notifications
                 ))
 
@@ -111,26 +114,29 @@ class DeathEventCreator(Thread):
         main_deaths = []
         notif_frames = notif_result.get_sliced_frames()
         
-        generator = taget_frames_generator(notif_frames, self._is_death_frame, exit_test_frame_count=30)
-        for death_frames, _, _ in generator:
+        # a death shows exactly one reason, killer plate and gear
+        is_death_frame = (
+            (notif_result.sliced_counts(NotificationType.NOTIFICATION_DEATH_REASON) == 1) &
+            (notif_result.sliced_counts(NotificationType.NOTIFICATION_PLAYER_PLATE) == 1) &
+            (notif_result.sliced_counts(NotificationType.NOTIFICATION_PLAYER_GEAR) == 1)
+        )
+        for start_idx, end_idx in find_target_runs(to_test_results(is_death_frame), exit_test_frame_count=30):
+            death_frames = notif_frames[start_idx:end_idx + 1]
             start_frame = death_frames[0].frame
             end_frame = death_frames[-1].frame
-            death_reason_texts = []
-            kill_player_names = []
+            reason_notif_frames = []
+            plate_frames = []
             for death_frame in death_frames:
                 reason_notif = self._get_reason_notifs(death_frame)
                 plate_notif = self._get_plate_notifs(death_frame)
                 if len(reason_notif) != 1 or len(plate_notif) != 1:
                     continue
                 
-                reason_text = self._detect_death_reason(reason_notif[0], death_frame.frame)
-                if reason_text != '':
-                    death_reason_texts.append(reason_text)
-
-                killer_name = self._detect_killer_name(death_frame)
-                if killer_name != '':
-                    kill_player_names.append(killer_name)
+                reason_notif_frames.append((reason_notif[0], death_frame.frame))
+                plate_frames.append(death_frame)
 
+            kill_player_names = [name for name in self._detect_killer_names(plate_frames) if name != '']
+            death_reason_texts = [t for t in self._detect_death_reasons(reason_notif_frames) if t != '']
             reason_text_likely = likely_text(death_reason_texts)
             kill_player = self.battle_info.find_likely_player(kill_player_names, BattleSide.ENEMY, 0.3)
             main_death = self._make_death_notification(
@@ -144,25 +150,18 @@ class DeathEventCreator(Thread):
         
         return main_deaths
     
-    def _is_death_frame(self, frame: NotificationDetectionFrame, in_target_frame: bool) -> TestResult:
-        reason_count = len(self._get_reason_notifs(frame))
-        killer_count = len(self._get_plate_notifs(frame))
-        gear_count = len(self._get_gear_notifs(frame))
-        return TestResult.TARGET if reason_count == 1 and killer_count == 1 and gear_count == 1 else TestResult.NOT_TARGET
-    
     def _get_reason_notifs(self, frame: NotificationDetectionFrame) -> list[Notification]:
         return list(filter(lambda n: n.type == NotificationType.NOTIFICATION_DEATH_REASON, frame.notifications))
     
     def _get_plate_notifs(self, frame: NotificationDetectionFrame) -> list[Notification]:
         return list(filter(lambda n: n.type == NotificationType.NOTIFICATION_PLAYER_PLATE, frame.notifications))
-    
-    def _get_gear_notifs(self, frame: NotificationDetectionFrame) -> list[Notification]:
-        return list(filter(lambda n: n.type == NotificationType.NOTIFICATION_PLAYER_GEAR, frame.notifications))
 
-    def _detect_death_reason(self, reason_notif: Notification, frame_number: int) -> str:
-        img = self.reader.read(frame_number)
-        reason_img = img[reason_notif.xyxy[1]:reason_notif.xyxy[3],reason_notif.xyxy[0]:reason_notif.xyxy[2]]
-        lines = self.ocr.get_text(reason_img, line_break=True)
+    def _detect_death_reasons(self, reason_notif_frames: list[(Notification, int)]) -> list[str]:
+        # reasons of all frames of a death are read in one OCR batch
+        reason_imgs = [self.reader.read_crop(frame_number, reason_notif.xyxy) for reason_notif, frame_number in reason_notif_frames]
+        return [self._parse_death_reason(lines) for lines in self.ocr.get_texts(reason_imgs, line_break=True)]
+
+    def _parse_death_reason(self, lines: list[list[Char]]) -> str:
         lines = list(filter(lambda l: len(l) >= 4, lines))
         if len(lines) < 2:
             return ''
@@ -171,12 +170,17 @@ class DeathEventCreator(Thread):
             reason_line = reason_line[:-2]
         return reason_line
     
-    def _detect_killer_name(self, frame: NotificationDetectionFrame) -> str:
-        plate_result = self.plate_analyzer.analyze([frame], ignore_nickname=True, ignore_id=True, ignore_badge=True)
-        if len(plate_result.frames[0].plates) == 0:
-            return ''
-        plate = plate_result.frames[0].plates[0]
-        return plate.player_name.text if plate.player_name is not None else ''
+    def _detect_killer_names(self, frames: list[NotificationDetectionFrame]) -> list[str]:
+        # plates of all frames are analyzed together so their names are read in one OCR batch
+        plate_result = self.plate_analyzer.analyze(frames, ignore_nickname=True, ignore_id=True, ignore_badge=True)
+        names = []
+        for plate_frame in plate_result.frames:
+            if len(plate_frame.plates) == 0:
+                names.append('')
+                continue
+            plate = plate_frame.plates[0]
+            names.append(plate.player_name.text if plate.player_name is not None else '')
+        return names
     
     def _make_death_notification(self,
         reason_text: str,
@@ -251,16 +255,13 @@ class DeathEventCreator(Thread):
                 end_frame=end_frame
             )
         
-    def _find_drop_frame(self, player: IkaPlayer) -> int:
-        def _is_drop_frame(frame: IkalampDetectionFrame, in_target_frame: bool) -> TestResult:
-            if (player.side == BattleSide.TEAM and frame.team is None) or (player.side == BattleSide.ENEMY and frame.enemy is None):
-                return TestResult.PENDING
-            lamp = frame.team[player.lamp_ord] if player.side == BattleSide.TEAM else frame.enemy[player.lamp_ord]
-            return TestResult.TARGET if lamp.state == IkalampState.DROP else TestResult.NOT_TARGET
-        
-        generator = taget_frames_generator(self.ikalamp_result.frames, _is_drop_frame, exit_test_frame_count=30)
-        for drop_frames, _, _ in generator:
-            if len(drop_frames) > 10:
-                return drop_frames[0].frame
-
-        return None
\ No newline at end of file
+    def _find_drop_frames(self) -> dict[tuple[BattleSide, int], int]:
+        # first frame of a drop longer than 10 frames for each lamp
+        lamp_states = LampStateMatrix.from_frames(self.ikalamp_result.frames)
+        drop_frames = {}
+        for key, runs in lamp_states.find_all_runs(IkalampState.DROP, exit_test_frame_count=30).items():
+            for start_idx, end_idx in runs:
+                if end_idx - start_idx + 1 > 10:
+                    drop_frames[key] = int(lamp_states.frame_numbers[start_idx])
+                    break
+        return drop_frames
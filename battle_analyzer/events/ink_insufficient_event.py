@@ -8,7 +8,7 @@ from models.text import to_str, likely_text
 from prediction.notification_detection_process import NotificationDetectionResult, NotificationDetectionFrame
 from prediction.splash_font_ocr import SplashFontOCR
 from utils import MovieReader
-from events.util import taget_frames_generator, TestResult
+from events.util import find_target_runs, to_test_results
 
 @dataclass
 class InkInsufficientEvent:
@@ -21,18 +21,15 @@ class InkInsufficientEventCreator:
 
     def create(self, notif_result: NotificationDetectionResult) -> list[InkInsufficientEvent]:
         events = []
-        notif_frames = notif_result.get_sliced_frames()
+        frame_numbers = notif_result.get_sliced_frame_numbers()
 
-        generator = taget_frames_generator(notif_frames, self._is_kill_frame, exit_test_frame_count=30)
-        for kill_frames, _, _ in generator:
-            start_frame = kill_frames[0].frame
-            end_frame = kill_frames[-1].frame
+        is_kill_frame = notif_result.sliced_counts(NotificationType.NOTIFICATION_KILL) == 1
+        for start_idx, end_idx in find_target_runs(to_test_results(is_kill_frame), exit_test_frame_count=30):
+            start_frame = int(frame_numbers[start_idx])
+            end_frame = int(frame_numbers[end_idx])
             if end_frame - start_frame < 60:
                 continue
         
         return events
+
     
-    def _is_kill_frame(self, frame: NotificationDetectionFrame, in_target_frame: bool) -> TestResult:
-        kill_notif = list(filter(lambda n: n.type == NotificationType.NOTIFICATION_KILL, frame.notifications))
-        return TestResult.TARGET if len(kill_notif) == 1 else TestResult.NOT_TARGET
-    
\ No newline at end of file
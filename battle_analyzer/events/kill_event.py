@@ -5,13 +5,13 @@ from models.ika_player import IkaPlayer
 from models.battle import BattleSide
 from models.battle_info import BattleInfo
 from models.notification import NotificationType, Notification
-from models.text import to_str
+from models.text import to_str, Char
 from models.ikalamp import IkalampState
 from prediction.notification_detection_process import NotificationDetectionResult, NotificationDetectionFrame
 from prediction.ikalamp_detection_process import IkalampDetectionResult
 from prediction.splash_font_ocr import SplashFontOCR
 from utils import MovieReader, find_one, likely_value
-from events.util import taget_frames_generator, TestResult
+from events.util import find_target_runs, to_test_results
 from error import InternalError
 
 @dataclass
@@ -44,19 +44,18 @@ class KillEventCreator(Thread):
         events = []
         notif_frames = self.notif_result.get_sliced_frames()
 
-        generator = taget_frames_generator(notif_frames, self._is_kill_frame, exit_test_frame_count=5)
-        for kill_frames, _, _ in generator:
-            if len(kill_frames) == 0:
-                continue
+        # only frames of kill runs are visited
+        is_kill_frame = self.notif_result.sliced_counts(NotificationType.NOTIFICATION_KILL) >= 1
+        for start_idx, end_idx in find_target_runs(to_test_results(is_kill_frame), exit_test_frame_count=5):
+            kill_frames = notif_frames[start_idx:end_idx + 1]
             
             # gather death player names with same track id
-            death_player_name_frames = []
+            kill_notif_frames = []
             for kill_frame in kill_frames:
                 kill_notifs = list(filter(lambda n: n.type == NotificationType.NOTIFICATION_KILL, kill_frame.notifications))
-                for kill_notif in kill_notifs:
-                    death_player_name = self._detect_death_player_name(kill_notif, kill_frame.frame)
-                    if death_player_name != '':
-                        death_player_name_frames.append((death_player_name, kill_frame.frame))
+                kill_notif_frames += [(kill_notif, kill_frame.frame) for kill_notif in kill_notifs]
+            death_player_names = self._detect_death_player_names(kill_notif_frames)
+            death_player_name_frames = [(name, frame) for name, (_, frame) in zip(death_player_names, kill_notif_frames) if name != '']
 
             # merge death player names which are tied to same player even though diffrent track id 
             evt_candidates = []
@@ -100,16 +99,16 @@ class KillEventCreator(Thread):
         
         self.events = events
     
-    def _is_kill_frame(self, frame: NotificationDetectionFrame, in_target_frame: bool) -> TestResult:
-        kill_notif = list(filter(lambda n: n.type == NotificationType.NOTIFICATION_KILL, frame.notifications))
-        return TestResult.TARGET if len(kill_notif) >= 1 else TestResult.NOT_TARGET
-    
-    def _detect_death_player_name(self, kill_notif: Notification, frame_number: int) -> str:
-        if kill_notif.conf < 0.8:
-            return ''
-        img = self.reader.read(frame_number)
-        kill_img = img[kill_notif.xyxy[1]:kill_notif.xyxy[3],kill_notif.xyxy[0]:kill_notif.xyxy[2]]
-        kill_text = self.ocr.get_text(kill_img)
+    def _detect_death_player_names(self, kill_notif_frames: list[(Notification, int)]) -> list[str]:
+        # all kill notifications of the group are read in one OCR batch
+        targets = [idx for idx, (kill_notif, _) in enumerate(kill_notif_frames) if 0.8 <= kill_notif.conf]
+        kill_texts = self.ocr.get_texts([self.reader.read_crop(kill_notif_frames[idx][1], kill_notif_frames[idx][0].xyxy) for idx in targets])
+        names = [''] * len(kill_notif_frames)
+        for idx, kill_text in zip(targets, kill_texts):
+            names[idx] = self._parse_death_player_name(kill_text)
+        return names
+
+    def _parse_death_player_name(self, kill_text: list[Char]) -> str:
         if len(kill_text) == 0:
             return ''
         first = kill_text[0]
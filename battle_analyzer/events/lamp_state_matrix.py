@@ -0,0 +1,86 @@
+import numpy as np
+from models.battle import BattleSide
+from models.ikalamp import IkalampState
+from prediction.ikalamp_detection_process import IkalampDetectionFrame
+from events.util import find_target_runs, TestResult
+
+class LampStateMatrix:
+    """
+    Lamp states of all players as a (frames x 8) matrix, team lamps first.
+    Built once from ikalamp frames so DEATH, SP and DROP runs of every player are found without walking the frames again.
+    """
+    team_member_count = 4
+    enemy_member_count = 4
+
+    def __init__(self, frame_numbers: np.ndarray, states: np.ndarray, missing: np.ndarray) -> None:
+        self.frame_numbers = frame_numbers
+        self.states = states
+        # frames where the lamps were not detected
+        self.missing = missing
+
+    @classmethod
+    def from_frames(cls, frames: list[IkalampDetectionFrame]) -> 'LampStateMatrix':
+        player_count = cls.team_member_count + cls.enemy_member_count
+        frame_numbers = np.zeros(len(frames), dtype=np.int64)
+        states = np.full((len(frames), player_count), -1, dtype=np.int8)
+        missing = np.ones(len(frames), dtype=bool)
+        for idx, frame in enumerate(frames):
+            if frame is None:
+                continue
+            frame_numbers[idx] = frame.frame
+            if frame.team is None or frame.enemy is None:
+                continue
+            states[idx] = [lamp.state.value for lamp in frame.team + frame.enemy]
+            missing[idx] = False
+        return cls(frame_numbers, states, missing)
+
+    def __len__(self) -> int:
+        return len(self.frame_numbers)
+
+    def column(self, side: BattleSide, ord: int) -> int:
+        return ord if side == BattleSide.TEAM else self.team_member_count + ord
+
+    def test_results(self,
+        side: BattleSide,
+        ord: int,
+        state: IkalampState,
+        missing_result: TestResult=TestResult.PENDING,
+        not_target_from: int=None
+    ) -> np.ndarray:
+        """
+        TestResult values of each frame like a predicate passed to taget_frames_generator would return.
+        Frames at or after not_target_from are not target unless the lamps are missing.
+        """
+        is_target = self.states[:, self.column(side, ord)] == state.value
+        if not_target_from is not None:
+            is_target &= self.frame_numbers < not_target_from
+        results = np.where(is_target, TestResult.TARGET.value, TestResult.NOT_TARGET.value)
+        results[self.missing] = missing_result.value
+        return results
+
+    def find_runs(self,
+        side: BattleSide,
+        ord: int,
+        state: IkalampState,
+        exit_test_frame_count: int,
+        missing_result: TestResult=TestResult.PENDING,
+        not_target_from: int=None
+    ) -> np.ndarray:
+        """
+        (start index, end index) of the frames where the lamp of a player is in the state.
+        """
+        return find_target_runs(self.test_results(side, ord, state, missing_result, not_target_from), exit_test_frame_count)
+
+    def find_all_runs(self, state: IkalampState, exit_test_frame_count: int, missing_result: TestResult=TestResult.PENDING) -> dict[tuple[BattleSide, int], np.ndarray]:
+        runs = {}
+        for side, count in [(BattleSide.TEAM, self.team_member_count), (BattleSide.ENEMY, self.enemy_member_count)]:
+            for ord in range(count):
+                runs[(side, ord)] = self.find_runs(side, ord, state, exit_test_frame_count, missing_result)
+        return runs
+
+    def next_detected_index(self, idx: int) -> int:
+        """
+        Index of the first frame after idx where the lamps are detected, None if there is none.
+        """
+        detected = np.flatnonzero(~self.missing[idx + 1:])
+        return idx + 1 + int(detected[0]) if len(detected) > 0 else None
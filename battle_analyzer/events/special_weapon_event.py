@@ -6,8 +6,8 @@ from models.ika_player import IkaPlayer
 from models.battle import BattleSide
 from models.battle_info import BattleInfo
 from models.ikalamp import IkalampState
-from prediction.ikalamp_detection_process import IkalampDetectionResult, IkalampDetectionFrame, run_ikalamp_detection
-from events.util import taget_frames_generator, find_target_frames, TestResult
+from prediction.ikalamp_detection_process import IkalampDetectionResult, run_ikalamp_detection
+from events.lamp_state_matrix import LampStateMatrix
 from error import InternalError
 
 class SpecialWeaponEventType(Enum):
@@ -42,74 +42,54 @@ class SpecialWeaponEventCreator(Thread):
             raise InternalError('run must be called via create')
         events = []
         ikalamp_frames = self.ikalamp_result.slice(self.ikalamp_result.start_frame, self.battle_info.end_event.start_frame).get_sliced_frames()
+        lamp_states = LampStateMatrix.from_frames(ikalamp_frames)
+        sp_runs = lamp_states.find_all_runs(IkalampState.SP, exit_test_frame_count=5)
         players = self.battle_info.team_players + self.battle_info.enemy_players
         for player in players:
-            generator = taget_frames_generator(ikalamp_frames, self._make_test_func(player.side, player.lamp_ord), exit_test_frame_count=5)
-            for sp_frames, _, end_idx in generator:
-                if len(sp_frames) == 0:
-                    continue
-                if len(sp_frames) < self.sp_frames_thresh: # at least two consecutive frames
+            for start_idx, end_idx in sp_runs[(player.side, player.lamp_ord)]:
+                sp_start_frame = int(lamp_states.frame_numbers[start_idx])
+                sp_end_frame = int(lamp_states.frame_numbers[end_idx])
+                if end_idx - start_idx + 1 < self.sp_frames_thresh: # at least two consecutive frames
                     # inspect frames that skipped analysis
                     if (
-                        not self._is_sp_period(sp_frames[0].frame - self.sp_frames_thresh + 1, sp_frames[0].frame - 1, player.side, player.lamp_ord) and
-                        not self._is_sp_period(sp_frames[-1].frame + 1, sp_frames[-1].frame + self.sp_frames_thresh - 1, player.side, player.lamp_ord)
+                        not self._is_sp_period(sp_start_frame - self.sp_frames_thresh + 1, sp_start_frame - 1, player.side, player.lamp_ord) and
+                        not self._is_sp_period(sp_end_frame + 1, sp_end_frame + self.sp_frames_thresh - 1, player.side, player.lamp_ord)
                         ):
                         continue
-                event = self._make_fully_charted(player, sp_frames[0])
+                event = self._make_fully_charted(player, sp_start_frame)
                 events.append(event)
-                event = self._make_triggered_or_spoiled(player, sp_frames[-1], end_idx, ikalamp_frames)
+                event = self._make_triggered_or_spoiled(player, sp_end_frame, end_idx, lamp_states)
                 if event is not None:
                     events.append(event)
 
         self.events = events
     
-    def _is_sp_frame(self, frame: IkalampDetectionFrame, in_target_frame: bool, side: BattleSide, ord: int) -> TestResult:
-        if frame.team is None or frame.enemy is None:
-            return TestResult.PENDING
-        if side == BattleSide.TEAM:
-            return TestResult.TARGET if frame.team[ord].state == IkalampState.SP else TestResult.NOT_TARGET
-        else:
-            return TestResult.TARGET if frame.enemy[ord].state == IkalampState.SP else TestResult.NOT_TARGET
-        
-    def _make_test_func(self, side: BattleSide, ord: int):
-        return lambda frame, in_target_frame: self._is_sp_frame(frame, in_target_frame, side, ord)
-    
-    def _make_fully_charted(self, player: IkaPlayer, sp_start_frame: IkalampDetectionFrame) -> SpecialWeaponEvent:
+    def _make_fully_charted(self, player: IkaPlayer, sp_start_frame: int) -> SpecialWeaponEvent:
         return SpecialWeaponEvent(
             type=SpecialWeaponEventType.FULLY_CHARGED,
             player=player,
-            start_frame=sp_start_frame.frame,
-            end_frame=sp_start_frame.frame
+            start_frame=sp_start_frame,
+            end_frame=sp_start_frame
         )
     
     def _make_triggered_or_spoiled(self,
         player: IkaPlayer,
-        sp_end_frame: IkalampDetectionFrame,
+        sp_end_frame: int,
         sp_end_index: int,
-        frames: list[IkalampDetectionFrame]
+        lamp_states: LampStateMatrix
     ) -> SpecialWeaponEvent:
-        next_frame_idx = sp_end_index + 1
-        if len(frames) <= next_frame_idx:
+        # the lamp state of the first frame with lamps after sp tells whether sp was used
+        next_idx = lamp_states.next_detected_index(sp_end_index)
+        if next_idx is None:
             return None # battle is over
-
-        evt_type = None
-        evt_frame = sp_end_frame.frame
-        for lamp_frame in frames[next_frame_idx:]:
-            if player.side == BattleSide.TEAM and lamp_frame.team is not None:
-                if lamp_frame.team[player.lamp_ord].state == IkalampState.LIVE:
-                    evt_type = SpecialWeaponEventType.TRIGGERED
-                else:
-                    evt_type = SpecialWeaponEventType.SPOILED
-                break
-            elif player.side == BattleSide.ENEMY and lamp_frame.enemy is not None:
-                if lamp_frame.enemy[player.lamp_ord].state == IkalampState.LIVE:
-                    evt_type = SpecialWeaponEventType.TRIGGERED
-                else:
-                    evt_type = SpecialWeaponEventType.SPOILED
-                break
-            evt_frame = lamp_frame.frame
-        if evt_type is None:
-            return None
+        if next_idx == sp_end_index + 1:
+            evt_frame = sp_end_frame
+        else:
+            evt_frame = int(lamp_states.frame_numbers[next_idx - 1])
+        if lamp_states.states[next_idx, lamp_states.column(player.side, player.lamp_ord)] == IkalampState.LIVE.value:
+            evt_type = SpecialWeaponEventType.TRIGGERED
+        else:
+            evt_type = SpecialWeaponEventType.SPOILED
         
         return SpecialWeaponEvent(
             type=evt_type,
@@ -133,7 +113,8 @@ class SpecialWeaponEventCreator(Thread):
         if result is None:
             return False
         
-        start_idx, end_idx = find_target_frames(result.frames, self._make_test_func(side, ord), exit_test_frame_count=1)
-        if start_idx is None or end_idx is None:
+        runs = LampStateMatrix.from_frames(result.frames).find_runs(side, ord, IkalampState.SP, exit_test_frame_count=1)
+        if len(runs) == 0:
             return False
+        start_idx, end_idx = runs[0]
         return (end_idx - start_idx) == (end_frame - start_frame)
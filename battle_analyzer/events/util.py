@@ -1,50 +1,133 @@
 from enum import Enum
+import numpy as np
 from prediction.frame import Frame
 
 class TestResult(Enum):
     TARGET = 0
     NOT_TARGET = 1
     PENDING = 2
+    CONTINUE = 3 # target only within target frames
 
-def find_target_frames(frames: list[Frame], is_target_frame, exit_test_frame_count: int, interval: int=1) -> (int, int):
-    start_index = None
-    end_index = None
-    exit_frame_count = exit_test_frame_count
-    for idx, frame in enumerate(frames):
-        if idx % interval != 0:
-            if start_index is not None:
-                end_index = idx
-            continue
-        result = is_target_frame(frame, start_index is not None)
+class TargetFrameScan:
+    """
+    State of one search for target frames, fed one frame at a time from origin.
+    """
+    def __init__(self, is_target_frame, exit_test_frame_count: int, interval: int=1, origin: int=0) -> None:
+        self.is_target_frame = is_target_frame
+        self.exit_test_frame_count = exit_test_frame_count
+        self.interval = interval
+        self.restart(origin)
+
+    def restart(self, origin: int):
+        self.origin = origin
+        self.start_index = None
+        self.end_index = None
+        self.exit_frame_count = self.exit_test_frame_count
+
+    def feed(self, idx: int, frame: Frame) -> bool:
+        # True when the target frames ended at this frame
+        if (idx - self.origin) % self.interval != 0:
+            if self.start_index is not None:
+                self.end_index = idx
+            return False
+        result = self.is_target_frame(frame, self.start_index is not None)
         if result == TestResult.TARGET:
-            if start_index is None:
-                start_index = idx
+            if self.start_index is None:
+                self.start_index = idx
             else:
-                end_index = idx
-                exit_frame_count = exit_test_frame_count # reset count
+                self.end_index = idx
+                self.exit_frame_count = self.exit_test_frame_count # reset count
         elif result == TestResult.NOT_TARGET:
-            if start_index is not None:
+            if self.start_index is not None:
                 # count down for finidng opening end frame
-                exit_frame_count -= 1
-                if exit_frame_count <= 0:
-                    break
+                self.exit_frame_count -= 1
+                if self.exit_frame_count <= 0:
+                    return True
+        elif result == TestResult.CONTINUE:
+            if self.start_index is not None:
+                self.end_index = idx
+                self.exit_frame_count = self.exit_test_frame_count
         elif result == TestResult.PENDING:
             pass
+        return False
 
-    if start_index is not None and end_index is None:
-        end_index = start_index # just 1 opening frame is included in the video
-    return start_index, end_index
+    def result(self) -> (int, int):
+        if self.start_index is not None and self.end_index is None:
+            return self.start_index, self.start_index # just 1 opening frame is included in the video
+        return self.start_index, self.end_index
 
-def taget_frames_generator(frames: list[Frame], is_target_frame, exit_test_frame_count: int, interval: int=1):
+def find_target_frames(frames: list[Frame], is_target_frame, exit_test_frame_count: int, interval: int=1, start: int=0) -> (int, int):
+    """
+    First target frames at or after start. Indices are of frames, not relative to start.
+    """
+    scan = TargetFrameScan(is_target_frame, exit_test_frame_count, interval, start)
+    for idx in range(start, len(frames)):
+        if scan.feed(idx, frames[idx]):
+            break
+    return scan.result()
+
+def target_ranges_generator(frames: list[Frame], is_target_frame, exit_test_frame_count: int, interval: int=1):
+    """
+    (start index, end index) of each target frames. The frames are not copied.
+    """
     length = len(frames)
     cur_pos = 0
     while cur_pos < length:
-        start_idx, end_idx = find_target_frames(frames[cur_pos:], is_target_frame, exit_test_frame_count, interval)
-        if start_idx is None and end_idx is None:
+        start_idx, end_idx = find_target_frames(frames, is_target_frame, exit_test_frame_count, interval, cur_pos)
+        if start_idx is None:
             break
-        else:
-            start_pos = start_idx + cur_pos
-            end_pos = end_idx + cur_pos
-            yield frames[start_pos:end_pos + 1], start_pos, end_pos
-            cur_pos = end_pos + 1
-#            frames = frames[cur_pos:]
+        yield start_idx, end_idx
+        cur_pos = end_idx + 1
+
+def taget_frames_generator(frames: list[Frame], is_target_frame, exit_test_frame_count: int, interval: int=1):
+    for start_pos, end_pos in target_ranges_generator(frames, is_target_frame, exit_test_frame_count, interval):
+        yield frames[start_pos:end_pos + 1], start_pos, end_pos
+
+def find_target_ranges(frames: list[Frame], tests: dict) -> dict[any, list[(int, int)]]:
+    """
+    Target frame ranges of several predicates in one pass over the frames.
+    tests maps a key to (is_target_frame, exit_test_frame_count). The ranges are the same as target_ranges_generator
+    for predicates that do not keep state between calls, since a search restarts after the frame that ended it
+    instead of testing the frames after the end index again.
+    """
+    scans = {key: TargetFrameScan(is_target_frame, exit_test_frame_count) for key, (is_target_frame, exit_test_frame_count) in tests.items()}
+    ranges = {key: [] for key in tests}
+    for idx, frame in enumerate(frames):
+        for key, scan in scans.items():
+            if scan.feed(idx, frame):
+                ranges[key].append(scan.result())
+                scan.restart(idx + 1)
+    for key, scan in scans.items():
+        if scan.start_index is not None:
+            ranges[key].append(scan.result())
+    return ranges
+
+def to_test_results(is_target: np.ndarray) -> np.ndarray:
+    # TestResult values of frames whose target test is already evaluated for all frames
+    return np.where(is_target, TestResult.TARGET.value, TestResult.NOT_TARGET.value)
+
+def find_target_runs(results: np.ndarray, exit_test_frame_count: int) -> np.ndarray:
+    """
+    Same runs as target_ranges_generator with interval 1, found from an array of TestResult values instead of a predicate.
+    Returns (start index, end index) pairs as an (N, 2) array.
+    """
+    results = np.asarray(results)
+    tested = np.flatnonzero(results != TestResult.PENDING.value)
+    codes = results[tested]
+    is_target = (codes == TestResult.TARGET.value) | (codes == TestResult.CONTINUE.value)
+    target_pos = np.flatnonzero(is_target)
+    if len(target_pos) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+
+    # a run ends after exit_test_frame_count non target frames in a row. pending frames do not count
+    not_target_count = np.cumsum(~is_target)
+    gaps = not_target_count[target_pos[1:]] - not_target_count[target_pos[:-1]]
+    groups = np.concatenate([[0], np.cumsum(gaps >= max(exit_test_frame_count, 1))])
+
+    # a run starts at a target frame. continue frames before it are not target
+    starts = np.flatnonzero(codes[target_pos] == TestResult.TARGET.value)
+    run_groups, first = np.unique(groups[starts], return_index=True)
+    last = np.flatnonzero(np.concatenate([groups[1:] != groups[:-1], [True]]))
+    start_idx = tested[target_pos[starts[first]]]
+    end_idx = tested[target_pos[last[run_groups]]]
+    return np.stack([start_idx, end_idx], axis=1)
@@ -24,9 +24,11 @@ def create_file_logger(file_name, root_name='ikavision', level=DEBUG):
 def create_prod_logger(root_name='ikavision'):
     logger = getLogger(root_name)
     logger.setLevel(DEBUG)
-    stream_hamdler = StreamHandler(sys.stdout)
-    stream_hamdler.setLevel(INFO)
-    logger.addHandler(stream_hamdler)
+    # called for every job in a long-lived worker process. add the handler only once
+    if not any(isinstance(h, StreamHandler) for h in logger.handlers):
+        stream_hamdler = StreamHandler(sys.stdout)
+        stream_hamdler.setLevel(INFO)
+        logger.addHandler(stream_hamdler)
     logger.propagate = False
     return Logger(root_name)
 
@@ -4,9 +4,9 @@ import Levenshtein
 from error import INVALID_BATTLE_ERROR, InternalError
 from events.battle_open_event import BattleOpenEvent
 from events.battle_end_event import BattleEndEvent
-from events.util import taget_frames_generator, TestResult
+from events.lamp_state_matrix import LampStateMatrix
 from prediction.notification_detection_process import NotificationDetectionResult
-from prediction.ikalamp_detection_process import IkalampDetectionResult, IkalampDetectionFrame
+from prediction.ikalamp_detection_process import IkalampDetectionResult
 from prediction.battle_indicator_detection_process import BattleIndicatorDetectionResult
 from prediction.stage_frame_classifier import StageFrameClassifier
 from prediction.buki_frame_classifier import BukiFrameClassifier
@@ -19,7 +19,7 @@ from models.ikalamp import IkalampState
 from models.ink_color import InkColor
 from models.buki import Buki, SubWeapon, SpecialWeapon
 from models.notification import NotificationType
-from utils import choice_frames, normalized_levenshtein_distance, likely_value
+from utils import choice_frames, normalized_levenshtein_distance, likely_value, FrameRequestPlanner
 from log import Logger
 
 class BattleInfo:
@@ -33,9 +33,11 @@ class BattleInfo:
         ikalamp_result: IkalampDetectionResult,
         ika_player_result: IkalampDetectionResult,
         indicator_result: BattleIndicatorDetectionResult,
+        planner: FrameRequestPlanner,
         logger: Logger
     ) -> None:
         self.battle_movie_path = battle_movie_path
+        self.planner = planner
         self.movie_date = movie_date
         self.frame_rate = frame_rate
         self.open_event = open_event
@@ -54,19 +56,28 @@ class BattleInfo:
         weapon_gauge_classifier: WeaponGaugeFrameAnalyzer,
         ocr: SplashFontOCR
     ) -> None:
+        # frames of the first try of stage, color and buki are read in one pass
+        self.logger.info(f'frame read process started.')
+        processing_time = time.time()
+        stage_requests = self._request_stage(stage_classifier)
+        color_requests = self._request_color()
+        buki_requests = self._request_buki(buki_classifier)
+        self.planner.run()
+        self.logger.info(f'frame read process completed. processing time: {time.time() - processing_time}')
+
         self.logger.info(f'stage process started.')
         processing_time = time.time()
-        self.stage = self._predict_stage(stage_classifier)
+        self.stage = self._predict_stage(stage_classifier, stage_requests)
         self.logger.info(f'stage process completed. processing time: {time.time() - processing_time}')
         
         self.logger.info(f'color process started.')
         processing_time = time.time()
-        self.team_color, self.enemy_color = self._predict_color()
+        self.team_color, self.enemy_color = self._predict_color(color_requests)
         self.logger.info(f'color process completed. processing time: {time.time() - processing_time}')
 
         self.logger.info(f'buki process started.')
         processing_time = time.time()
-        self.team_bukis, self.enemy_bukis = self._predict_buki(buki_classifier)
+        self.team_bukis, self.enemy_bukis = self._predict_buki(buki_classifier, buki_requests)
         self.logger.info(f'buki process completed. processing time: {time.time() - processing_time}')
 
         self.logger.info(f'main player process started.')
@@ -136,28 +147,16 @@ class BattleInfo:
         if len(same_weapons_ords) >= 2:
 
             # gather ikalamp sp chaged frames
+            lamp_states = LampStateMatrix.from_frames(lamp_frames)
             sp_charged_frames = { ord: [] for ord in same_weapons_ords }
             for ord in same_weapons_ords:
-                def _is_sp_frame(frame: IkalampDetectionFrame, in_target_frame: bool) -> TestResult:
-                    if frame.team is None:
-                        return TestResult.PENDING
-                    return TestResult.TARGET if frame.team[ord].state == IkalampState.SP else TestResult.NOT_TARGET
-   
-                for sp_frames, _, _ in taget_frames_generator(lamp_frames, _is_sp_frame, 5):
-                    if len(sp_frames) > 0:
-                        sp_charged_frames[ord].append(sp_frames[0].frame)
-
-            # gather weapon gauge sp chaged frames
-            sp_gauge_frames = []
-            is_gauge_charged = False
-            for notif_frame in self.notification.get_sliced_frames():
-                fullcharge_notifs = list(filter(lambda n: n.type == NotificationType.NOTIFICATION_SP_FULLCHARGE, notif_frame.notifications))
-                if len(fullcharge_notifs) == 1:
-                    if not is_gauge_charged:
-                        sp_gauge_frames.append(notif_frame.frame)
-                    is_gauge_charged = True
-                else:
-                    is_gauge_charged = False
+                for start_idx, _ in lamp_states.find_runs(BattleSide.TEAM, ord, IkalampState.SP, exit_test_frame_count=5):
+                    sp_charged_frames[ord].append(int(lamp_states.frame_numbers[start_idx]))
+
+            # gather weapon gauge sp chaged frames. first frames with one full charge notification
+            is_gauge_charged = self.notification.sliced_counts(NotificationType.NOTIFICATION_SP_FULLCHARGE) == 1
+            charge_starts = is_gauge_charged & ~np.concatenate([[False], is_gauge_charged[:-1]])
+            sp_gauge_frames = self.notification.get_sliced_frame_numbers()[charge_starts].tolist()
 
             # count frames where both lamp and gauge are fully charged at the same timing
             sp_common_frame_count = { ord: 0 for ord in same_weapons_ords }
@@ -209,38 +208,67 @@ class BattleInfo:
                     
         return None
     
-    def _predict_stage(self, stage_classifier: StageFrameClassifier) -> BattleStage:
+    def _request_stage(self, stage_classifier: StageFrameClassifier) -> list:
+        battle_frames = self.notification.get_sliced_frames()
+        if len(battle_frames) // 200 == 0:
+            return None
+        return stage_classifier.request(choice_frames(battle_frames, 100))
+
+    def _predict_stage(self, stage_classifier: StageFrameClassifier, requests: list) -> BattleStage:
         battle_frames = self.notification.get_sliced_frames()
         retry_count = len(battle_frames) // 200
         while retry_count > 0:
-            test_frames = choice_frames(battle_frames, 100)
-            stage = stage_classifier.classify(test_frames)
+            if requests is not None:
+                stage = stage_classifier.classify_requested(requests)
+                requests = None
+            else:
+                test_frames = choice_frames(battle_frames, 100)
+                stage = stage_classifier.classify(test_frames)
             if stage is not None:
                 return stage
             retry_count -=1
         
         raise INVALID_BATTLE_ERROR
+
+    def _request_color(self) -> (list, list):
+        frames = self.ikalamp.get_sliced_frames()
+        if len(frames) // 30 == 0:
+            return None
+        test_frames = choice_frames(frames, 30)
+        return (
+            InkColor.request_ikalamp(self.planner, test_frames, BattleSide.TEAM),
+            InkColor.request_ikalamp(self.planner, test_frames, BattleSide.ENEMY)
+        )
     
-    def _predict_color(self) -> (InkColor, InkColor):
+    def _predict_color(self, requests: (list, list)) -> (InkColor, InkColor):
         frames = self.ikalamp.get_sliced_frames()
         retry_count = len(frames) // 30
         while retry_count > 0:
-            test_frames = choice_frames(frames, 30)
-            team_color = InkColor.create_from_ikalamp(self.battle_movie_path, test_frames, BattleSide.TEAM)
-            enemy_color = InkColor.create_from_ikalamp(self.battle_movie_path, test_frames, BattleSide.ENEMY)
+            if requests is not None:
+                team_color = InkColor.create_from_requested(requests[0])
+                enemy_color = InkColor.create_from_requested(requests[1])
+                requests = None
+            else:
+                test_frames = choice_frames(frames, 30)
+                team_color = InkColor.create_from_ikalamp(self.planner, test_frames, BattleSide.TEAM)
+                enemy_color = InkColor.create_from_ikalamp(self.planner, test_frames, BattleSide.ENEMY)
             if team_color is not None and enemy_color is not None:
                 return team_color, enemy_color
             retry_count -=1
         
         raise InternalError('color prediction failed')
-    
-    def _predict_buki(self, buki_classifier: BukiFrameClassifier) -> (list[Buki], list[Buki]):
+
+    def _request_buki(self, buki_classifier: BukiFrameClassifier) -> list:
         battle_frames = self.ikalamp.get_sliced_frames()
         if len(battle_frames) == 0:
-            return BattleStage.UNKNOWN
+            return None
         test_count = 30 if self.rule != BattleRule.HOKO else 60
-        test_frames = choice_frames(battle_frames, test_count, lambda f: f.team is not None)
-        (team_mains, enemy_mains) = buki_classifier.classify_most_likely(test_frames)
+        return buki_classifier.request(choice_frames(battle_frames, test_count, lambda f: f.team is not None))
+    
+    def _predict_buki(self, buki_classifier: BukiFrameClassifier, requests: list) -> (list[Buki], list[Buki]):
+        if requests is None:
+            return BattleStage.UNKNOWN
+        (team_mains, enemy_mains) = buki_classifier.most_likely_requested(requests)
         team_bukis = [Buki.create(main, self.battle_date) for main in team_mains] 
         enemy_bukis = [Buki.create(main, self.battle_date) for main in enemy_mains]
         return (team_bukis, enemy_bukis)
\ No newline at end of file
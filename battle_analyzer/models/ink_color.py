@@ -1,9 +1,10 @@
+from concurrent.futures import Future
 import cv2
 import numpy as np
 from prediction.ikalamp_detection_process import IkalampDetectionFrame
 from models.ikalamp import Ikalamp, IkalampState
 from models.battle import BattleSide
-from utils import hstack, MovieReader
+from utils import hstack, FrameRequestPlanner
 from error import InternalError
 
 class InkColor:
@@ -18,11 +19,15 @@ class InkColor:
         return np.sum(np.abs(c1 - c2))
 
     @classmethod  
-    def create_from_ikalamp(cls, battle_movie_path: str, frames: list[IkalampDetectionFrame], side: BattleSide):
-        reader = MovieReader(battle_movie_path)
-        lamp_images = []
+    def create_from_ikalamp(cls, planner: FrameRequestPlanner, frames: list[IkalampDetectionFrame], side: BattleSide):
+        requests = cls.request_ikalamp(planner, frames, side)
+        planner.run()
+        return cls.create_from_requested(requests)
+
+    @classmethod
+    def request_ikalamp(cls, planner: FrameRequestPlanner, frames: list[IkalampDetectionFrame], side: BattleSide) -> list[Future]:
+        requests = []
         for frame in frames:
-            img = reader.read(frame.frame)
             lamps = []
             if side == BattleSide.TEAM and frame.team is not None:
                 lamps = frame.team
@@ -32,8 +37,14 @@ class InkColor:
             live_lamps = list(filter(lambda l: l.state == IkalampState.LIVE, lamps))
             if len(live_lamps) == 0:
                 continue
-            
-            stacked_img = hstack(img, live_lamps)
+            requests.append(planner.request(frame.frame, [l.xyxy for l in live_lamps]))
+        return requests
+
+    @classmethod
+    def create_from_requested(cls, requests: list[Future]):
+        lamp_images = []
+        for crops in requests:
+            stacked_img = hstack(images=crops.result())
             lamp_images.append(stacked_img)
 
         if len(lamp_images) == 0:
@@ -0,0 +1,182 @@
+from threading import Thread
+import os
+import time
+import json
+import subprocess
+import numpy as np
+import requests
+
+PART_SUFFIX = '.part'
+FAILED_SUFFIX = '.failed'
+
+def is_downloading(movie_path: str) -> bool:
+    return os.path.exists(movie_path + PART_SUFFIX)
+
+def is_download_failed(movie_path: str) -> bool:
+    return os.path.exists(movie_path + FAILED_SUFFIX)
+
+def is_cached_movie(movie_path: str) -> bool:
+    """
+    Whether a completely downloaded movie exists. Partial files of failed downloads are removed.
+    """
+    if is_download_failed(movie_path):
+        for path in [movie_path, movie_path + FAILED_SUFFIX]:
+            if os.path.exists(path):
+                os.remove(path)
+        return False
+    return os.path.exists(movie_path) and not is_downloading(movie_path)
+
+class StreamingDownload(Thread):
+    """
+    Downloads a movie over HTTP into file_path in the background.
+    <file_path>.part exists while bytes are still arriving so readers in other processes can follow the growing file.
+    """
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, url: str, file_path: str) -> None:
+        super().__init__()
+        self.url = url
+        self.file_path = file_path
+        self.bytes_written = 0
+        self.error: Exception = None
+        # markers are created before the thread starts so readers never see a complete looking empty file
+        open(file_path, 'wb').close()
+        open(file_path + PART_SUFFIX, 'w').close()
+        if is_download_failed(file_path):
+            os.remove(file_path + FAILED_SUFFIX)
+
+    def run(self):
+        try:
+            with requests.get(self.url, stream=True, timeout=30) as res:
+                res.raise_for_status()
+                with open(self.file_path, 'wb') as f:
+                    for chunk in res.iter_content(self.CHUNK_SIZE):
+                        f.write(chunk)
+                        f.flush()
+                        self.bytes_written += len(chunk)
+        except Exception as e:
+            self.error = e
+            open(self.file_path + FAILED_SUFFIX, 'w').close()
+        finally:
+            os.remove(self.file_path + PART_SUFFIX)
+
+def probe_movie(movie_path: str) -> (int, int, float):
+    try:
+        out = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=width,height,avg_frame_rate', '-of', 'json', movie_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True
+        ).stdout
+        stream = json.loads(out)['streams'][0]
+        num, den = stream['avg_frame_rate'].split('/')
+        return int(stream['width']), int(stream['height']), int(num) / int(den)
+    except Exception:
+        return None
+
+def is_moov_at_end(movie_path: str) -> bool:
+    """
+    Whether an mp4 has its moov atom after the media data. Such files can not be demuxed from a pipe.
+    """
+    with open(movie_path, 'rb') as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return False
+            size = int.from_bytes(header[:4], 'big')
+            kind = header[4:8]
+            if kind == b'moov':
+                return False
+            if kind == b'mdat':
+                return True
+            if size == 1:
+                # 64 bit size follows the type
+                large_size = f.read(8)
+                if len(large_size) < 8:
+                    return False
+                f.seek(int.from_bytes(large_size, 'big') - 16, os.SEEK_CUR)
+            elif size < 8:
+                return False # atom to the end of the file or not an mp4
+            else:
+                f.seek(size - 8, os.SEEK_CUR)
+
+class MovieStream:
+    """
+    Decodes a movie that may still be downloading.
+    The file is fed to ffmpeg through a pipe as bytes arrive, so decoding starts before the download completes.
+    Movies that can not be demuxed from a pipe, such as mp4 with the moov atom at the end,
+    are decoded from the completed file by path, so they gain nothing from streaming.
+    Only the notification pass reads a stream. Later stages open the movie by path after the download completes.
+    """
+    CHUNK_SIZE = 1024 * 1024
+    WAIT_INTERVAL = 0.5
+
+    def __init__(self, movie_path: str) -> None:
+        self.movie_path = movie_path
+        self.frame_count = None
+        while True:
+            downloading = is_downloading(movie_path)
+            info = probe_movie(movie_path)
+            if info is not None:
+                break
+            if not downloading:
+                raise Exception('failed to probe movie')
+            time.sleep(self.WAIT_INTERVAL)
+        self.width, self.height, self.frame_rate = info
+
+    def frames(self, start_frame: int=0, end_frame: int=None, frame_interval: int=1):
+        follow = is_downloading(self.movie_path) and not is_moov_at_end(self.movie_path)
+        if not follow:
+            while is_downloading(self.movie_path):
+                time.sleep(self.WAIT_INTERVAL)
+        proc = subprocess.Popen(
+            # passthrough keeps one output frame per decoded frame, same numbering as VideoCapture
+            ['ffmpeg', '-v', 'error', '-i', 'pipe:0' if follow else self.movie_path, '-vsync', '0', '-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1'],
+            stdin=subprocess.PIPE if follow else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        feeder = Thread(target=self._feed, args=[proc.stdin]) if follow else None
+        if feeder is not None:
+            feeder.start()
+        frame_size = self.width * self.height * 3
+        frame_number = 0
+        try:
+            while True:
+                buf = proc.stdout.read(frame_size)
+                if len(buf) < frame_size:
+                    break
+                if end_frame is not None and end_frame < frame_number:
+                    break
+                if start_frame <= frame_number and frame_number % frame_interval == 0:
+                    yield frame_number, np.frombuffer(buf, dtype=np.uint8).reshape(self.height, self.width, 3)
+                frame_number += 1
+        finally:
+            proc.kill()
+            proc.wait()
+            if feeder is not None:
+                feeder.join()
+        self.frame_count = frame_number
+        if is_download_failed(self.movie_path):
+            raise Exception('movie download failed')
+
+    def _feed(self, pipe):
+        try:
+            with open(self.movie_path, 'rb') as f:
+                while True:
+                    # check the marker before reading so bytes written just before completion are not missed
+                    downloading = is_downloading(self.movie_path)
+                    chunk = f.read(self.CHUNK_SIZE)
+                    if len(chunk) > 0:
+                        pipe.write(chunk)
+                    elif not downloading:
+                        break
+                    else:
+                        time.sleep(self.WAIT_INTERVAL)
+        except (BrokenPipeError, ValueError, OSError):
+            pass # decoder stopped
+        finally:
+            try:
+                pipe.close()
+            except OSError:
+                pass
@@ -0,0 +1,138 @@
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from threading import Lock, Thread
+import os
+import queue
+import time
+import numpy as np
+import torch
+from prediction.inference_backend import InferenceBackend
+from prediction.model_registry import ModelRegistry
+
+MAX_BATCH_SIZE = int(os.environ.get('BROKER_MAX_BATCH_SIZE', 32))
+MAX_WAIT_MS = float(os.environ.get('BROKER_MAX_WAIT_MS', 5))
+
+@dataclass
+class BatchStats:
+    name: str
+    batches: int = 0
+    items: int = 0
+    # batch size and request latency counts by power of two bucket
+    batch_size_histogram: dict[int, int] = field(default_factory=dict)
+    latency_ms_histogram: dict[int, int] = field(default_factory=dict)
+
+    def add(self, batch_size: int, latencies_ms: list[float]):
+        self.batches += 1
+        self.items += batch_size
+        bucket = _bucket(batch_size)
+        self.batch_size_histogram[bucket] = self.batch_size_histogram.get(bucket, 0) + 1
+        for latency in latencies_ms:
+            bucket = _bucket(latency)
+            self.latency_ms_histogram[bucket] = self.latency_ms_histogram.get(bucket, 0) + 1
+
+def _bucket(value: float) -> int:
+    bucket = 1
+    while bucket < value:
+        bucket *= 2
+    return bucket
+
+class BatchBroker:
+    """
+    Collects items submitted from any thread for up to max_wait_ms or max_batch_size items,
+    runs run_batch_func on them at once and resolves the future of each item.
+    """
+    def __init__(self, name: str, run_batch_func, max_batch_size: int=MAX_BATCH_SIZE, max_wait_ms: float=MAX_WAIT_MS) -> None:
+        self.name = name
+        self.run_batch_func = run_batch_func
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.stats = BatchStats(name)
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self.requests.put((item, future, time.time()))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.time()
+                try:
+                    batch.append(self.requests.get(timeout=timeout) if 0 < timeout else self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                results = self.run_batch_func([item for item, _, _ in batch])
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            now = time.time()
+            self.stats.add(len(batch), [(now - submitted) * 1000 for _, _, submitted in batch])
+
+class ModelBroker:
+    """
+    Same interface as InferenceBackend. forward() and predict() calls of all threads on one model
+    are merged into batched calls.
+    """
+    brokers: dict[tuple[str, str], 'ModelBroker'] = {}
+    lock = Lock()
+
+    def __init__(self, model: InferenceBackend, name: str) -> None:
+        self.model = model
+        self.task = model.task
+        self.names = model.names
+        self.imgsz = model.imgsz
+        self.device = model.device
+        self.forward_broker = BatchBroker(f'{name}:forward', self._forward_batch)
+        # tensors and images are preprocessed differently by ultralytics and never share a batch
+        self.tensor_broker = BatchBroker(f'{name}:predict', self._predict_tensor_batch)
+        self.image_broker = BatchBroker(f'{name}:predict_image', self._predict_image_batch)
+
+    @classmethod
+    def get(cls, model_path: str, device: str) -> 'ModelBroker':
+        key = (os.path.abspath(model_path), str(device))
+        with cls.lock:
+            if key not in cls.brokers:
+                cls.brokers[key] = ModelBroker(ModelRegistry.get(model_path, device), os.path.basename(os.path.dirname(model_path)) or model_path)
+            return cls.brokers[key]
+
+    @classmethod
+    def report(cls) -> list[BatchStats]:
+        with cls.lock:
+            brokers = list(cls.brokers.values())
+        stats = []
+        for broker in brokers:
+            stats.extend(b.stats for b in [broker.forward_broker, broker.tensor_broker, broker.image_broker] if 0 < b.stats.batches)
+        return stats
+
+    def forward(self, batch: torch.Tensor) -> torch.Tensor:
+        futures = [self.forward_broker.submit(input) for input in batch]
+        return torch.stack([f.result() for f in futures])
+
+    def predict(self, source, **kwargs) -> list:
+        return [f.result() for f in self.predict_async(source)]
+
+    def predict_async(self, source) -> list[Future]:
+        if isinstance(source, torch.Tensor):
+            return [self.tensor_broker.submit(input) for input in (source if source.dim() == 4 else [source])]
+        images = source if isinstance(source, list) else [source]
+        return [self.image_broker.submit(img) for img in images]
+
+    def _forward_batch(self, inputs: list[torch.Tensor]) -> list[torch.Tensor]:
+        preds = self.model.forward(torch.stack(inputs))
+        # postprocess only reads the inference output of a (output, features) pair
+        preds = preds[0] if isinstance(preds, (list, tuple)) else preds
+        return list(preds)
+
+    def _predict_tensor_batch(self, inputs: list[torch.Tensor]) -> list:
+        return self.model.predict(torch.stack(inputs), verbose=False)
+
+    def _predict_image_batch(self, images: list[np.ndarray]) -> list:
+        return self.model.predict(images, verbose=False)
@@ -2,7 +2,8 @@ from dataclasses import dataclass
 from multiprocessing import Value
 import numpy as np
 from prediction.shared_memory import SharedMemory
-from prediction.prediction_process import PredictionResultBase, run_prediction 
+from prediction.prediction_process import PredictionResultBase, run_prediction, to_items, sort_by_x
+from prediction.boundary_refinement import run_refined_prediction
 from prediction.frame import Frame
 from models.battle_indicator import BattleIndicator, BattleResult, ResultCount, IndicatorNotification, IndicatorNotificationType
 from models.detected_item import DetectedItem
@@ -56,15 +57,7 @@ def parse(pred) -> (BattleIndicator, BattleResult, list[IndicatorNotification]):
     nawabari_paint_point = None
     notifications = []
 
-    pred = sorted(pred, key=lambda p: p[0]) # sort with x
-    for *xyxy, conf, cls in pred:
-        x1 = int(xyxy[0].cpu().numpy().astype('uint'))
-        y1 = int(xyxy[1].cpu().numpy().astype('uint'))
-        x2 = int(xyxy[2].cpu().numpy().astype('uint'))
-        y2 = int(xyxy[3].cpu().numpy().astype('uint'))
-        conf = float(conf.cpu().numpy().astype('float'))
-        cls = int(cls.cpu().numpy().astype('uint'))
-        box = [x1, y1, x2, y2]
+    for box, conf, cls in to_items(sort_by_x(pred)):
         if cls == 0: # indicator_count
             counts.append(DetectedItem(xyxy=box, conf=conf, cls=cls))
         elif cls == 1: # indicator_area_occupancy
@@ -204,6 +197,20 @@ def make_frame_result(pred, frame: int, img: np.ndarray) -> BattleIndicatorDetec
         image=None
     )
     
+def frame_state(frame: BattleIndicatorDetectionFrame):
+    indicator = frame.indicator
+    return (
+        None if indicator is None else (
+            len(indicator.counts),
+            len(indicator.penalties),
+            len(indicator.team_asari_counts),
+            indicator.occupancy is not None,
+            indicator.lead_label is not None
+        ),
+        None if frame.result is None else frame.result.win_lose,
+        tuple(sorted(n.type.value for n in frame.notifications))
+    )
+
 def make_detection_completed(
     width: int,
     height: int,
@@ -235,23 +242,53 @@ def run_battle_indicator_detection(
     process_id: int,
     batch_size: int,
     start_frame: int=0,
-    end_frame: int=None
+    end_frame: int=None,
+    frame_bus_id: int=None,
+    frame_bus_consumer: int=None,
+    crop_store_path: str=None,
+    coarse_frame_interval: int=None
 ):
-    result = run_prediction(
-        name='battle_indicator',
-        battle_movie_path=battle_movie_path,
-        model_path=battle_indicator_model_path,
-        start_frame=start_frame,
-        end_frame=end_frame,
-        frame_interval=frame_interval,
-        device=device,
-        batch_size=batch_size,
-        iou_threshold=0.25,
-        conf_threshold=0.3,
-        max_detections=100,
-        make_frame_result_func=make_frame_result,
-        make_prediction_completed_func=make_detection_completed
-    )
+    if coarse_frame_interval is not None:
+        # indicator items appear and disappear a few times a battle. sample coarsely and bisect around changes
+        result = run_refined_prediction(
+            name='battle_indicator',
+            battle_movie_path=battle_movie_path,
+            model_path=battle_indicator_model_path,
+            start_frame=start_frame,
+            end_frame=end_frame,
+            frame_interval=frame_interval,
+            device=device,
+            batch_size=batch_size,
+            iou_threshold=0.25,
+            conf_threshold=0.3,
+            max_detections=100,
+            make_frame_result_func=make_frame_result,
+            make_prediction_completed_func=make_detection_completed,
+            columnar=True,
+            coarse_frame_interval=coarse_frame_interval,
+            state_func=frame_state,
+            crop_store_path=crop_store_path
+        )
+    else:
+        result = run_prediction(
+            name='battle_indicator',
+            battle_movie_path=battle_movie_path,
+            model_path=battle_indicator_model_path,
+            start_frame=start_frame,
+            end_frame=end_frame,
+            frame_interval=frame_interval,
+            device=device,
+            batch_size=batch_size,
+            iou_threshold=0.25,
+            conf_threshold=0.3,
+            max_detections=100,
+            make_frame_result_func=make_frame_result,
+            make_prediction_completed_func=make_detection_completed,
+            columnar=True,
+            frame_bus_id=frame_bus_id,
+            frame_bus_consumer=frame_bus_consumer,
+            crop_store_path=crop_store_path
+        )
     
     SharedBattleIndicatorDetectionResult.set_id(process_id)
     SharedBattleIndicatorDetectionResult.write(result)
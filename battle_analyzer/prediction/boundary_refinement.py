@@ -0,0 +1,200 @@
+import math
+import time
+import torch
+from utils import MovieReader
+from prediction.prediction_process import preprocess, postprocess, infer, pred_boxes, BatchPreprocessor
+from prediction.crop_store import CropStore
+from prediction.model_registry import ModelRegistry
+from prediction.columnar_frames import ColumnarFrames, detection_rows
+
+class BoundaryRefiner:
+    """
+    Coarse-to-fine sampling of a detector.
+    Frames on the frame_interval grid are inferred every coarse_frame_interval first. Wherever the state of two
+    neighboring samples differs, the gap is bisected with extra inferences until the change is located on the grid.
+    Frames left between samples of the same state get the detections of the previous sample, so the result
+    has the same frames as a full pass at frame_interval.
+    """
+    def __init__(self,
+        model,
+        reader: MovieReader,
+        device,
+        batch_size: int,
+        iou_threshold: float,
+        conf_threshold: float,
+        max_detections: int,
+        make_frame_result_func,
+        state_func,
+        preprocess_func=preprocess,
+        postprocesss_func=postprocess,
+        crop_store: CropStore=None,
+        crop_store_classes: list[int]=None
+    ) -> None:
+        self.model = model
+        self.reader = reader
+        self.device = device
+        self.batch_size = batch_size
+        self.iou_threshold = iou_threshold
+        self.conf_threshold = conf_threshold
+        self.max_detections = max_detections
+        self.make_frame_result_func = make_frame_result_func
+        self.state_func = state_func
+        self.preprocess_func = preprocess_func
+        self.postprocesss_func = postprocesss_func
+        self.crop_store = crop_store
+        self.crop_store_classes = crop_store_classes
+        # index rows of the crops of each inferred frame
+        self.crop_rows = {}
+        self.batch_preprocessor = BatchPreprocessor(model.imgsz, device, batch_size) if preprocess_func is preprocess else None
+        self.preds = {}
+        # prediction each grid frame was built from
+        self.frame_preds = []
+        self.frames = {}
+        self.states = {}
+
+    def refine(self, grid: list[int], coarse_step: int) -> (list, list[int]):
+        """
+        Return frame results for all grid frames and frame numbers whose detections were copied.
+        """
+        if len(grid) == 0:
+            return [], []
+        samples = list(range(0, len(grid), coarse_step))
+        if samples[-1] != len(grid) - 1:
+            samples.append(len(grid) - 1)
+        self._infer([grid[i] for i in samples])
+
+        gaps = [(a, b) for a, b in zip(samples, samples[1:]) if self._changed(grid[a], grid[b])]
+        while len(gaps) > 0:
+            gaps = [(a, b) for a, b in gaps if 1 < b - a]
+            # one level of all gaps at once keeps batches full
+            self._infer([grid[(a + b) // 2] for a, b in gaps])
+            next_gaps = []
+            for a, b in gaps:
+                m = (a + b) // 2
+                if self._changed(grid[a], grid[m]):
+                    next_gaps.append((a, m))
+                if self._changed(grid[m], grid[b]):
+                    next_gaps.append((m, b))
+            gaps = next_gaps
+
+        frame_results = []
+        copied_frames = []
+        last_pred = None
+        last_frame_number = None
+        self.frame_preds = []
+        for frame_number in grid:
+            if frame_number in self.frames:
+                frame_results.append(self.frames[frame_number])
+                last_pred = self.preds[frame_number]
+                last_frame_number = frame_number
+            else:
+                frame_results.append(self.make_frame_result_func(last_pred, frame_number, None))
+                copied_frames.append(frame_number)
+                if self.crop_store is not None:
+                    self.crop_store.alias(frame_number, self.crop_rows.get(last_frame_number, []))
+            self.frame_preds.append(last_pred)
+        return frame_results, copied_frames
+
+    def _changed(self, frame_a: int, frame_b: int) -> bool:
+        return self.states[frame_a] != self.states[frame_b]
+
+    def _infer(self, frame_numbers: list[int]):
+        frame_numbers = sorted(set(f for f in frame_numbers if f not in self.frames))
+        for i in range(0, len(frame_numbers), self.batch_size):
+            batch_frames = frame_numbers[i:i + self.batch_size]
+            images = [self.reader.read(f) for f in batch_frames]
+            if self.batch_preprocessor is not None:
+                for idx, img in enumerate(images):
+                    self.batch_preprocessor.put(idx, img)
+                batch = self.batch_preprocessor.tensor(len(images))
+            else:
+                batch = [self.preprocess_func(img, self.model.imgsz, self.device, to_4d=False) for img in images]
+            preds = infer(self.model, batch, images[0].shape, self.iou_threshold, self.conf_threshold, self.max_detections, self.postprocesss_func)
+            for frame_number, img, pred in zip(batch_frames, images, preds):
+                frame = self.make_frame_result_func(pred, frame_number, img)
+                self.preds[frame_number] = pred
+                self.frames[frame_number] = frame
+                self.states[frame_number] = self.state_func(frame)
+                if self.crop_store is not None:
+                    rows = [self.crop_store.append(frame_number, xyxy, img) for xyxy in pred_boxes(pred, self.crop_store_classes)]
+                    self.crop_rows[frame_number] = [row for row in rows if row is not None]
+
+def run_refined_prediction(
+    name: str,
+    battle_movie_path: str,
+    model_path: str,
+    start_frame: int,
+    end_frame: int,
+    frame_interval: int,
+    coarse_frame_interval: int,
+    device: str,
+    batch_size: int,
+    iou_threshold: float,
+    conf_threshold: float,
+    max_detections: int,
+    make_frame_result_func,
+    make_prediction_completed_func,
+    state_func,
+    preprocess_func=preprocess,
+    postprocesss_func=postprocess,
+    crop_store_path: str=None,
+    crop_store_classes: list[int]=None,
+    columnar: bool=False
+):
+    crop_store = CropStore.create(crop_store_path) if crop_store_path is not None else None
+    reader = None
+    try:
+        dev = torch.device(device)
+        model = ModelRegistry.get(model_path, device)
+        reader = MovieReader(battle_movie_path)
+        total_frames = reader.frame_count
+        if end_frame is None:
+            end_frame = total_frames - 1
+        height, width = reader.cur_img.shape[:2]
+
+        print(f'[{name}] refinement started. total frames: {total_frames}, start: {start_frame}, end: {end_frame}, coarse interval: {coarse_frame_interval}')
+        processing_time = time.time()
+
+        # same frames as a full pass at frame_interval
+        grid = list(range(math.ceil(start_frame / frame_interval) * frame_interval, end_frame + 1, frame_interval))
+        refiner = BoundaryRefiner(
+            model=model,
+            reader=reader,
+            device=dev,
+            batch_size=batch_size,
+            iou_threshold=iou_threshold,
+            conf_threshold=conf_threshold,
+            max_detections=max_detections,
+            make_frame_result_func=make_frame_result_func,
+            state_func=state_func,
+            preprocess_func=preprocess_func,
+            postprocesss_func=postprocesss_func,
+            crop_store=crop_store,
+            crop_store_classes=crop_store_classes
+        )
+        frame_results, copied_frames = refiner.refine(grid, max(1, coarse_frame_interval // frame_interval))
+        if columnar:
+            frame_results = ColumnarFrames.from_rows(grid, [detection_rows(pred) for pred in refiner.frame_preds], make_frame_result_func)
+
+        det_result = make_prediction_completed_func(
+            width,
+            height,
+            total_frames,
+            start_frame,
+            end_frame,
+            frame_interval,
+            frame_results,
+            round(time.time() - processing_time)
+        )
+        det_result.skipped_frames = copied_frames
+        print(f'[{name}] refinement ended. inferred {len(grid) - len(copied_frames)} of {len(grid)} frames')
+
+        return det_result
+    except Exception as e:
+        print(e)
+        return None
+    finally:
+        if reader is not None:
+            reader.release()
+        if crop_store is not None:
+            crop_store.close()
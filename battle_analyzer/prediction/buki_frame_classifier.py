@@ -1,12 +1,11 @@
 from dataclasses import dataclass
-import torch
 import numpy as np
-from ultralytics import YOLO
 from models.buki import MainWeapon
 from models.ikalamp import IkalampState, Ikalamp
 from prediction.frame import Frame
 from prediction.ika_player_detection_process import IkaPlayerDetectionFrame
-from utils import MovieReader
+from utils import FrameRequestPlanner
+from prediction.batch_broker import ModelBroker
 
 cls_buki_map = {
     'bold_marker': MainWeapon.BOLD_MARKER,
@@ -152,16 +151,26 @@ class BukiFrameClassifier:
     def __init__(self,
         battle_movie_path: str,
         model_path: str,
-        device: str) -> None:
-        dev = torch.device(device)
-        self.model = YOLO(model_path)
-        self.model.to(dev)
+        device: str,
+        planner: FrameRequestPlanner) -> None:
+        self.model = ModelBroker.get(model_path, device)
         self.battle_movie_path = battle_movie_path
-    
+        self.planner = planner
+
+    def request(self, frames: list[IkaPlayerDetectionFrame]) -> list:
+        return [(frame, self.planner.request(frame.frame, [lamp.xyxy for lamp in frame.team + frame.enemy])) for frame in frames]
+
     def classify_most_likely(self, frames: list[Frame]) -> (list[MainWeapon], list[MainWeapon]):
         if len(frames) == 0:
             return None
-        predicts = self.classify(frames)
+        requests = self.request(frames)
+        self.planner.run()
+        return self.most_likely_requested(requests)
+
+    def most_likely_requested(self, requests: list) -> (list[MainWeapon], list[MainWeapon]):
+        if len(requests) == 0:
+            return None
+        predicts = self.classify_requested(requests)
         team_main_counts: list[dict[MainWeapon,int]] = []
         enemy_main_counts: list[dict[MainWeapon,int]] = []
         for buki_frame in predicts.values():
@@ -195,33 +204,38 @@ class BukiFrameClassifier:
         return (team_mains_likely, enemy_mains_likely)
 
     def classify(self, frames: list[IkaPlayerDetectionFrame]) -> dict[int, BukClassificationFrame]:
-        reader = MovieReader(self.battle_movie_path)
-        def _predict(lamp: Ikalamp, img: np.ndarray) -> MainWeapon:
+        requests = self.request(frames)
+        self.planner.run()
+        return self.classify_requested(requests)
+
+    def classify_requested(self, requests: list) -> dict[int, BukClassificationFrame]:
+        def _submit(lamp: Ikalamp, lamp_img: np.ndarray):
             if lamp.state in [IkalampState.DEATH, IkalampState.DROP]:
+                return None
+            return self.model.predict_async(lamp_img)[0]
+
+        def _main(future) -> MainWeapon:
+            if future is None:
                 return MainWeapon.UNKNOWN
-            lamp_img = img[lamp.xyxy[1]:lamp.xyxy[3],lamp.xyxy[0]:lamp.xyxy[2]]
-            res = self.model.predict(lamp_img, verbose=False)[0]
+            res = future.result()
             cls = res.names[res.probs.top1]
             return cls_buki_map[cls] if cls in cls_buki_map else MainWeapon.UNKNOWN
 
+        # all lamps are submitted before waiting so the broker batches them
+        submitted = []
+        for frame, crops in requests:
+            lamp_imgs = crops.result()
+            team_futures = [_submit(lamp, lamp_img) for lamp, lamp_img in zip(frame.team, lamp_imgs[:len(frame.team)])]
+            enemy_futures = [_submit(lamp, lamp_img) for lamp, lamp_img in zip(frame.enemy, lamp_imgs[len(frame.team):])]
+            submitted.append((frame, team_futures, enemy_futures))
+
         buki_frames = {}
-        for frame in frames:
-            img = reader.read(frame.frame)
-            team_mains = []
-            for lamp in frame.team:
-                main = _predict(lamp, img)
-                team_mains.append(main)
-            enemy_mains = []
-            for lamp in frame.enemy:
-                main = _predict(lamp, img)
-                enemy_mains.append(main)
+        for frame, team_futures, enemy_futures in submitted:
             buki_frames[frame.frame] = BukClassificationFrame(
                 frame=frame.frame,
-                team_mains=team_mains,
-                enemy_mains=enemy_mains,
+                team_mains=[_main(f) for f in team_futures],
+                enemy_mains=[_main(f) for f in enemy_futures],
                 image=None
             )
 
-        reader.release()
-
         return buki_frames
\ No newline at end of file
@@ -0,0 +1,129 @@
+from collections.abc import Sequence
+import numpy as np
+
+# one detection row. frames are rebuilt from their rows, so derived fields such as lamp side, order and state
+# or notification types are not stored
+DETECTION_DTYPE = np.dtype([
+    ('frame', np.int32),
+    ('xyxy', np.int32, (4,)),
+    ('conf', np.float32),
+    ('cls', np.int16),
+    ('track_id', np.int32)
+])
+
+def detection_rows(pred) -> np.ndarray:
+    """
+    Detections of a frame as an (N, 7) array of x1, y1, x2, y2, conf, cls, track id. Track id is -1 when not tracked.
+    pred is an (N, 6) postprocess output, an (N, 7) array of this function or ultralytics Results.
+    """
+    if hasattr(pred, 'boxes'):
+        data = pred.boxes.data.cpu().numpy()
+        if pred.boxes.id is not None:
+            # x1, y1, x2, y2, id, conf, cls
+            return data[:, [0, 1, 2, 3, 5, 6, 4]]
+        pred = data
+    if pred.shape[1] == 7:
+        return pred
+    return np.hstack([pred, np.full((len(pred), 1), -1, dtype=pred.dtype)])
+
+class ColumnarFrames(Sequence):
+    """
+    Frames of a detection result held as one structured array of detection rows and per frame offsets.
+    Indexing builds the frame object from its rows with build_func(rows, frame_number) and keeps it,
+    so callers see the same frames as a list of frame objects. Pickling sends the arrays only.
+    """
+    __slots__ = ['detections', 'offsets', 'frame_numbers', 'build_func', 'start', 'stop', 'cache']
+
+    def __init__(self, detections: np.ndarray, offsets: np.ndarray, frame_numbers: np.ndarray, build_func, start: int=0, stop: int=None, cache: dict=None) -> None:
+        self.detections = detections
+        self.offsets = offsets
+        self.frame_numbers = frame_numbers
+        self.build_func = build_func
+        self.start = start
+        self.stop = stop if stop is not None else len(frame_numbers)
+        # built frames by absolute index. shared with slices so changes to a frame are kept
+        self.cache = cache if cache is not None else {}
+
+    @classmethod
+    def from_rows(cls, frame_numbers: list[int], rows: list[np.ndarray], build_func) -> 'ColumnarFrames':
+        counts = np.array([len(r) for r in rows], dtype=np.int64)
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        detections = np.empty(int(offsets[-1]), dtype=DETECTION_DTYPE)
+        if len(detections) > 0:
+            data = np.concatenate([r for r in rows if len(r) > 0])
+            detections['frame'] = np.repeat(np.array(frame_numbers, dtype=np.int32), counts)
+            detections['xyxy'] = data[:, :4]
+            detections['conf'] = data[:, 4]
+            detections['cls'] = data[:, 5]
+            detections['track_id'] = data[:, 6]
+        return cls(detections, offsets, np.array(frame_numbers, dtype=np.int32), build_func)
+
+    @classmethod
+    def concat(cls, frames_list: list['ColumnarFrames']) -> 'ColumnarFrames':
+        detections = []
+        offsets = [np.zeros(1, dtype=np.int64)]
+        frame_numbers = []
+        base = 0
+        for frames in frames_list:
+            lo = frames.offsets[frames.start]
+            hi = frames.offsets[frames.stop]
+            detections.append(frames.detections[lo:hi])
+            offsets.append(frames.offsets[frames.start + 1:frames.stop + 1] - lo + base)
+            frame_numbers.append(frames.frame_numbers[frames.start:frames.stop])
+            base += hi - lo
+        return cls(
+            np.concatenate(detections) if len(detections) > 0 else np.empty(0, dtype=DETECTION_DTYPE),
+            np.concatenate(offsets),
+            np.concatenate(frame_numbers) if len(frame_numbers) > 0 else np.empty(0, dtype=np.int32),
+            frames_list[0].build_func if len(frames_list) > 0 else None
+        )
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return ColumnarFrames(self.detections, self.offsets, self.frame_numbers, self.build_func, self.start + start, self.start + max(start, stop), self.cache)
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or len(self) <= idx:
+            raise IndexError('frame index out of range')
+        pos = self.start + idx
+        frame = self.cache.get(pos)
+        if frame is None:
+            frame = self.build_func(self.rows(idx), int(self.frame_numbers[pos]), None)
+            self.cache[pos] = frame
+        return frame
+
+    def frame_number(self, idx: int) -> int:
+        return int(self.frame_numbers[self.start + idx])
+
+    def detections_of(self, idx: int) -> np.ndarray:
+        # structured rows of a frame without building it
+        pos = self.start + idx
+        return self.detections[self.offsets[pos]:self.offsets[pos + 1]]
+
+    def rows(self, idx: int) -> np.ndarray:
+        d = self.detections_of(idx)
+        rows = np.empty((len(d), 7), dtype=np.float32)
+        rows[:, :4] = d['xyxy']
+        rows[:, 4] = d['conf']
+        rows[:, 5] = d['cls']
+        rows[:, 6] = d['track_id']
+        return rows
+
+    def __getstate__(self):
+        # built frames are rebuilt on the reading side
+        lo = self.offsets[self.start]
+        hi = self.offsets[self.stop]
+        return (self.detections[lo:hi], self.offsets[self.start:self.stop + 1] - lo, self.frame_numbers[self.start:self.stop], self.build_func)
+
+    def __setstate__(self, state):
+        self.detections, self.offsets, self.frame_numbers, self.build_func = state
+        self.start = 0
+        self.stop = len(self.frame_numbers)
+        self.cache = {}
@@ -0,0 +1,139 @@
+import os
+import tempfile
+import numpy as np
+
+class CropStore:
+    """
+    Append-only archive of detected box crops written during a detection pass.
+    <path>: raw uint8 crop pixels back to back. read through a memory map
+    <path>.idx: int64 rows of (frame, x1, y1, x2, y2, height, width, offset). read through a memory map
+    Crops are looked up by (frame, xyxy) so consumers can slice detected boxes without decoding the movie again.
+    Frames whose detections were copied from another frame, duplicates and frames between refinement samples,
+    get index rows pointing to the crops of the frame they were copied from.
+    """
+    INDEX_SUFFIX = '.idx'
+    INDEX_COLUMNS = 8
+    # stores attached to each movie in this process
+    stores: dict[str, list] = {}
+
+    def __init__(self, path: str, writable: bool=False) -> None:
+        self.path = path
+        self.writable = writable
+        self.data_file = None
+        self.index_file = None
+        self.offset = 0
+        self.data = None
+        self.rows = None
+        # frame column in ascending order and the row of each entry. order is None when rows are written in frame order
+        self.frames = None
+        self.order = None
+        if writable:
+            # appends so several passes over disjoint frame ranges share one store. remove() to start over
+            self.data_file = open(path, 'ab')
+            self.index_file = open(path + self.INDEX_SUFFIX, 'ab')
+            self.offset = self.data_file.tell()
+        else:
+            self._load()
+
+    @classmethod
+    def unique_path(cls, name: str, store_id: int) -> str:
+        store_dir = os.environ.get('CROP_STORE_DIR', tempfile.gettempdir())
+        return os.path.join(store_dir, f'crops_{name}_{store_id}')
+
+    @classmethod
+    def create(cls, path: str):
+        return cls(path, writable=True)
+
+    @classmethod
+    def open(cls, path: str):
+        return cls(path)
+
+    @classmethod
+    def remove(cls, path: str):
+        for file_path in [path, path + cls.INDEX_SUFFIX]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    @classmethod
+    def attach(cls, movie_path: str, path: str):
+        if not os.path.exists(path + cls.INDEX_SUFFIX):
+            return None
+        store = cls.open(path)
+        cls.stores.setdefault(os.path.abspath(movie_path), []).append(store)
+        return store
+
+    @classmethod
+    def detach(cls, movie_path: str, store):
+        stores = cls.stores.get(os.path.abspath(movie_path), [])
+        if store in stores:
+            stores.remove(store)
+        store.close()
+
+    @classmethod
+    def detach_all(cls, movie_path: str):
+        for store in cls.stores.pop(os.path.abspath(movie_path), []):
+            store.close()
+
+    @classmethod
+    def lookup(cls, movie_path: str, frame: int, xyxy: list[int]) -> np.ndarray:
+        for store in cls.stores.get(os.path.abspath(movie_path), []):
+            crop = store.get(frame, xyxy)
+            if crop is not None:
+                return crop
+        return None
+
+    def append(self, frame: int, xyxy: list[int], img: np.ndarray) -> np.ndarray:
+        """
+        Return the index row written for the crop, None for an empty box.
+        """
+        crop = np.ascontiguousarray(img[xyxy[1]:xyxy[3],xyxy[0]:xyxy[2]])
+        if crop.size == 0:
+            return None
+        self.data_file.write(crop.tobytes())
+        row = np.array([frame, *xyxy, crop.shape[0], crop.shape[1], self.offset], dtype=np.int64)
+        self.index_file.write(row.tobytes())
+        self.offset += crop.nbytes
+        return row
+
+    def alias(self, frame: int, rows: list[np.ndarray]):
+        # crops of the frame the detections were copied from. no pixels are written
+        for row in rows:
+            alias_row = row.copy()
+            alias_row[0] = frame
+            self.index_file.write(alias_row.tobytes())
+
+    def get(self, frame: int, xyxy: list[int]) -> np.ndarray:
+        if self.rows is None:
+            return None
+        start = np.searchsorted(self.frames, frame, side='left')
+        end = np.searchsorted(self.frames, frame, side='right')
+        for pos in range(start, end):
+            row = self.rows[pos if self.order is None else self.order[pos]]
+            if row[1:5].tolist() == list(xyxy):
+                height, width, offset = row[5:8].tolist()
+                # copy out of the map so crops stay valid after the store is closed or rewritten
+                return np.array(self.data[offset:offset + height * width * 3]).reshape(height, width, 3)
+        return None
+
+    def close(self):
+        if self.writable:
+            self.data_file.close()
+            self.index_file.close()
+        self.data = None
+        self.rows = None
+        self.frames = None
+        self.order = None
+
+    def _load(self):
+        row_count = os.path.getsize(self.path + self.INDEX_SUFFIX) // (self.INDEX_COLUMNS * 8)
+        if row_count == 0 or os.path.getsize(self.path) == 0:
+            return
+        self.rows = np.memmap(self.path + self.INDEX_SUFFIX, dtype=np.int64, mode='r', shape=(row_count, self.INDEX_COLUMNS))
+        self.data = np.memmap(self.path, dtype=np.uint8, mode='r')
+        frames = self.rows[:, 0]
+        if np.all(frames[:-1] <= frames[1:]):
+            self.frames = frames
+        else:
+            # idle frames inferred late, duplicates and several passes append out of frame order
+            self.order = np.argsort(frames, kind='stable')
+            self.frames = frames[self.order]
@@ -0,0 +1,118 @@
+import multiprocessing
+import multiprocessing.util
+import queue
+
+def run_detector_worker(name: str, jobs: multiprocessing.Queue, done: multiprocessing.Queue):
+    # models are loaded through ModelRegistry by the detection functions and stay warm across jobs
+    print(f'[{name}] detector worker started')
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            job = jobs.get(timeout=DetectorWorker.POLL_INTERVAL)
+        except queue.Empty:
+            # workers are not daemonic. do not outlive a parent that was killed before closing them
+            if parent is not None and not parent.is_alive():
+                break
+            continue
+        if job is None:
+            break
+        job_id, target, args, kwargs = job
+        try:
+            target(*args, **kwargs)
+            done.put((job_id, None))
+        except Exception as e:
+            done.put((job_id, str(e)))
+    print(f'[{name}] detector worker ended')
+
+class DetectorWorker:
+    """
+    Long-lived process running detection jobs of one model one by one.
+    Results are returned through the shared memory the detection functions already write.
+    """
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.process = None
+        self.jobs = None
+        self.done = None
+        self.next_job_id = 0
+        self.finished = set()
+
+    def submit(self, target, args: list, kwargs: dict) -> int:
+        if self.process is None or not self.process.is_alive():
+            self._start()
+        job_id = self.next_job_id
+        self.next_job_id += 1
+        self.jobs.put((job_id, target, args, kwargs))
+        return job_id
+
+    def wait(self, job_id: int):
+        while job_id not in self.finished:
+            try:
+                finished_id, error = self.done.get(timeout=self.POLL_INTERVAL)
+                if error is not None:
+                    print(f'[{self.name}] detector job failed: {error}')
+                self.finished.add(finished_id)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    # the job result is missing from shared memory and the caller fails on it. restart on next submit
+                    print(f'[{self.name}] detector worker exited unexpectedly')
+                    self.process = None
+                    return
+        self.finished.discard(job_id)
+
+    def close(self):
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.jobs.put(None)
+            self.process.join()
+        self.process = None
+
+    def _start(self):
+        ctx = multiprocessing.get_context('spawn')
+        self.jobs = ctx.Queue()
+        self.done = ctx.Queue()
+        self.finished = set()
+        # not daemonic so jobs can start their own processes, e.g. the process pool of run_parallel
+        self.process = ctx.Process(target=run_detector_worker, args=[self.name, self.jobs, self.done], daemon=False)
+        self.process.start()
+
+class DetectorJob:
+    """
+    A detection call on a pooled worker. start() and join() work like the Process they replace.
+    """
+    def __init__(self, worker: DetectorWorker, target, args: list, kwargs: dict) -> None:
+        self.worker = worker
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self.job_id = None
+
+    def start(self):
+        self.job_id = self.worker.submit(self.target, self.args, self.kwargs)
+
+    def join(self):
+        if self.job_id is not None:
+            self.worker.wait(self.job_id)
+
+class DetectorPool:
+    # one worker per model name in this process
+    workers: dict[str, DetectorWorker] = {}
+
+    @classmethod
+    def job(cls, name: str, target, args: list, kwargs: dict | None = None) -> DetectorJob:
+        if name not in cls.workers:
+            cls.workers[name] = DetectorWorker(name)
+        return DetectorJob(cls.workers[name], target, args, kwargs or {})
+
+    @classmethod
+    def close(cls):
+        for worker in cls.workers.values():
+            worker.close()
+        cls.workers = {}
+
+# runs before multiprocessing joins the non-daemonic workers at exit, in the main process and in child processes alike.
+# above the priority of the queue finalizers so the stop message is still sent
+multiprocessing.util.Finalize(None, DetectorPool.close, exitpriority=100)
@@ -0,0 +1,209 @@
+from multiprocessing import shared_memory
+import os
+import time
+import numpy as np
+import cv2
+
+class FrameBus:
+    """
+    Ring buffer of decoded frames on shared memory.
+    One decoder process publishes sampled frames and every detector process reads them without copying.
+    [header(int64 x (HEADER_ITEMS + consumers x 2))][slot frame numbers(int64 x capacity)][slot images(uint8 x capacity x h x w x 3)]
+    The header ends with the read sequence and the process id of each consumer.
+    """
+    SHM_NAME = 'frame_bus'
+    HEADER_ITEMS = 7
+    # header indices
+    WRITE_SEQ = 0
+    CLOSED = 1
+    WIDTH = 2
+    HEIGHT = 3
+    CAPACITY = 4
+    CONSUMERS = 5
+    TOTAL_FRAMES = 6
+    DETACHED = np.iinfo(np.int64).max
+    WAIT_INTERVAL = 0.001
+    # consumers blocking the decoder are checked for liveness at this interval
+    LIVENESS_INTERVAL = 1.0
+    # seconds the slowest live consumer may read nothing before the decoder gives up
+    STALL_TIMEOUT = 120
+
+    def __init__(self, shm: shared_memory.SharedMemory) -> None:
+        self.shm = shm
+        head = np.ndarray((self.HEADER_ITEMS,), dtype=np.int64, buffer=shm.buf)
+        self.width = int(head[self.WIDTH])
+        self.height = int(head[self.HEIGHT])
+        self.capacity = int(head[self.CAPACITY])
+        self.consumers = int(head[self.CONSUMERS])
+        self.total_frames = int(head[self.TOTAL_FRAMES])
+        header_size = (self.HEADER_ITEMS + self.consumers * 2) * 8
+        self.header = np.ndarray((self.HEADER_ITEMS + self.consumers * 2,), dtype=np.int64, buffer=shm.buf)
+        self.read_seqs = self.header[self.HEADER_ITEMS:self.HEADER_ITEMS + self.consumers]
+        self.pids = self.header[self.HEADER_ITEMS + self.consumers:]
+        self.slot_frames = np.ndarray((self.capacity,), dtype=np.int64, buffer=shm.buf, offset=header_size)
+        self.slots = np.ndarray(
+            (self.capacity, self.height, self.width, 3),
+            dtype=np.uint8,
+            buffer=shm.buf,
+            offset=header_size + self.capacity * 8
+        )
+
+    @classmethod
+    def unique_name(cls, bus_id: int) -> str:
+        return f'{cls.SHM_NAME}_{bus_id}'
+
+    @classmethod
+    def create(cls, bus_id: int, width: int, height: int, total_frames: int, consumers: int, capacity: int=64):
+        name = cls.unique_name(bus_id)
+        try:
+            shared_memory.SharedMemory(name=name).unlink()
+        except:
+            pass
+        header_size = (cls.HEADER_ITEMS + consumers * 2) * 8
+        size = header_size + capacity * 8 + capacity * height * width * 3
+        shm = shared_memory.SharedMemory(create=True, size=size, name=name)
+        header = np.ndarray((cls.HEADER_ITEMS + consumers * 2,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[cls.WIDTH] = width
+        header[cls.HEIGHT] = height
+        header[cls.CAPACITY] = capacity
+        header[cls.CONSUMERS] = consumers
+        header[cls.TOTAL_FRAMES] = total_frames
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, bus_id: int, consumer_id: int=None):
+        bus = cls(shared_memory.SharedMemory(name=cls.unique_name(bus_id)))
+        if consumer_id is not None:
+            # lets the decoder drop this consumer if the process dies without detaching
+            bus.pids[consumer_id] = os.getpid()
+        return bus
+
+    def release(self):
+        self.header = None
+        self.read_seqs = None
+        self.pids = None
+        self.slot_frames = None
+        self.slots = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass # a frame view is still referenced. closed on gc
+
+    def unlink(self):
+        self.release()
+        self.shm.unlink()
+
+    def publish(self, frame_number: int, img: np.ndarray):
+        seq = int(self.header[self.WRITE_SEQ])
+        # wait until the slowest consumer releases the slot to overwrite
+        slowest = None
+        waited = time.time()
+        checked = waited
+        while seq - int(np.min(self.read_seqs)) >= self.capacity:
+            now = time.time()
+            if slowest != int(np.min(self.read_seqs)):
+                slowest = int(np.min(self.read_seqs))
+                waited = now
+            elif self.STALL_TIMEOUT < now - waited:
+                raise Exception(f'frame bus consumers read nothing for {self.STALL_TIMEOUT} seconds')
+            if self.LIVENESS_INTERVAL <= now - checked:
+                self._detach_dead_consumers()
+                checked = now
+            time.sleep(self.WAIT_INTERVAL)
+        slot = seq % self.capacity
+        self.slots[slot] = img
+        self.slot_frames[slot] = frame_number
+        self.header[self.WRITE_SEQ] = seq + 1
+
+    def close(self):
+        self.header[self.CLOSED] = 1
+
+    def detach(self, consumer_id: int):
+        self.read_seqs[consumer_id] = self.DETACHED
+
+    def _detach_dead_consumers(self):
+        for consumer_id, pid in enumerate(self.pids.tolist()):
+            if self.read_seqs[consumer_id] != self.DETACHED and pid != 0 and not is_process_alive(pid):
+                print(f'[frame_bus] consumer {consumer_id} (pid {pid}) exited without detaching')
+                self.detach(consumer_id)
+
+    def frames(self, consumer_id: int, start_frame: int=0, end_frame: int=None):
+        """
+        Yield (frame_number, image view) published in [start_frame, end_frame].
+        The view is valid until the next item is requested. Copy it to keep it longer.
+        """
+        seq = int(self.read_seqs[consumer_id])
+        try:
+            while True:
+                while int(self.header[self.WRITE_SEQ]) <= seq:
+                    if self.header[self.CLOSED] and int(self.header[self.WRITE_SEQ]) <= seq:
+                        return
+                    time.sleep(self.WAIT_INTERVAL)
+                slot = seq % self.capacity
+                frame_number = int(self.slot_frames[slot])
+                if end_frame is not None and end_frame < frame_number:
+                    return
+                if start_frame <= frame_number:
+                    yield frame_number, self.slots[slot]
+                seq += 1
+                self.read_seqs[consumer_id] = seq
+        finally:
+            # never block the decoder after leaving the bus
+            if self.read_seqs is not None:
+                self.detach(consumer_id)
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        # a killed process stays as a zombie until its parent joins it
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return True
+
+def read_frames(cap: cv2.VideoCapture, start_frame: int, end_frame: int, frame_interval: int):
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    frame_number = start_frame
+    while True:
+        ret = cap.grab()
+        if not ret or end_frame < frame_number:
+            break
+
+        if frame_number % frame_interval != 0:
+            frame_number += 1
+            continue
+
+        ret, img = cap.retrieve()
+        if not ret:
+            break
+
+        yield frame_number, img
+        frame_number += 1
+
+def run_frame_decoder(
+    battle_movie_path: str,
+    bus_id: int,
+    frame_interval: int,
+    start_frame: int=0,
+    end_frame: int=None
+):
+    bus = FrameBus.attach(bus_id)
+    try:
+        cap = cv2.VideoCapture(battle_movie_path)
+        end_frame = end_frame or bus.total_frames - 1
+        print(f'[frame_bus] decoder started. start: {start_frame}, end: {end_frame}, consumers: {bus.consumers}')
+        for frame_number, img in read_frames(cap, start_frame, end_frame, frame_interval):
+            bus.publish(frame_number, img)
+        cap.release()
+        print(f'[frame_bus] decoder ended. start: {start_frame}, end: {end_frame}')
+    except Exception as e:
+        print(e)
+    finally:
+        bus.close()
+        bus.release()
@@ -1,9 +1,8 @@
 from dataclasses import dataclass
 from typing import TypeVar
-import torch
-from ultralytics import YOLO
 from prediction.frame import Frame
 from utils import MovieReader
+from prediction.batch_broker import ModelBroker
 
 T = TypeVar('T')
 
@@ -13,9 +12,7 @@ class FrameClassifier:
         model_path: str,
         device: str,
         cls_to_value_map: dict[str,T]) -> None:
-        dev = torch.device(device)
-        self.model = YOLO(model_path)
-        self.model.to(dev)
+        self.model = ModelBroker.get(model_path, device)
         self.battle_movie_path = battle_movie_path
         self.cls_to_value_map = cls_to_value_map
 
@@ -40,14 +37,17 @@ class FrameClassifier:
 
     def classify(self, frames: list[Frame]) -> dict[int,T]:
         reader = MovieReader(self.battle_movie_path)
-        values = {}
+        futures = {}
         for frame in frames:
             if frame.image is None:
                 img = reader.read(frame.frame)
             else:
                 img = frame.image
-            res = self.model.predict(img, verbose=False)[0]
-            cls = res.names[res.probs.top1]
-            values[frame.frame] = self.cls_to_value_map[cls]
+            futures[frame.frame] = self.model.predict_async(img)[0]
         reader.release()
+        values = {}
+        for frame_number, future in futures.items():
+            res = future.result()
+            cls = res.names[res.probs.top1]
+            values[frame_number] = self.cls_to_value_map[cls]
         return values
\ No newline at end of file
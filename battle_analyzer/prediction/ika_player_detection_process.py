@@ -1,8 +1,9 @@
 from dataclasses import dataclass
 from multiprocessing import Value
 from prediction.shared_memory import SharedMemory
-from prediction.prediction_process import PredictionResultBase, run_parallel
+from prediction.prediction_process import PredictionResultBase, run_parallel, run_prediction
 from prediction.frame import Frame
+from prediction.columnar_frames import detection_rows
 from models.ika_player import IkaPlayerPosition, IkaPlayerForm
 from models.detected_item import TrackableItem
 
@@ -35,11 +36,15 @@ class IkaPlayerDetectionResult(PredictionResultBase):
             frame_interval=j['frame_interval'],
             frames=[IkaPlayerDetectionFrame.from_json(i) if i is not None else None for i in j['frames']],
             processing_time=j['processing_time'],
+            skipped_frames=j.get('skipped_frames', [])
         )
 
 class SharedIkaPlayerDetectionResult(SharedMemory):
     SHM_NAME = 'shared_ika_player'
 
+# player positions read by ink tank analysis. names are not kept in the crop store
+CROP_POSITION_CLASSES = [0, 1, 2, 3, 4, 10, 11, 12]
+
 def to_form(cls) -> IkaPlayerForm:
     if cls == 0: # ika_hito
         return IkaPlayerForm.HITO
@@ -65,15 +70,13 @@ def to_form(cls) -> IkaPlayerForm:
 def make_positions(pred) -> (list[IkaPlayerPosition], list[TrackableItem]):
     positions = []
     names = []
-    for idx in range(len(pred.boxes.data)):
-        x1 = int(pred.boxes.data[idx][0].cpu().numpy().astype('uint'))
-        y1 = int(pred.boxes.data[idx][1].cpu().numpy().astype('uint'))
-        x2 = int(pred.boxes.data[idx][2].cpu().numpy().astype('uint'))
-        y2 = int(pred.boxes.data[idx][3].cpu().numpy().astype('uint'))
-        conf = float(pred.boxes.conf[idx].cpu().numpy().astype('float'))
-        cls = int(pred.boxes.cls[idx].cpu().numpy().astype('uint'))
-        box = [x1, y1, x2, y2]
-        track_id = int(pred.boxes.id[idx].cpu().numpy().astype('uint')) if pred.boxes.id is not None else None
+    # tracker results or rows of columnar frames
+    data = detection_rows(pred)
+    boxes = data[:, :4].astype('uint').tolist()
+    confs = data[:, 4].tolist()
+    classes = data[:, 5].astype('uint').tolist()
+    track_ids = [int(t) if 0 <= t else None for t in data[:, 6].tolist()]
+    for box, conf, cls, track_id in zip(boxes, confs, classes, track_ids):
         if cls in [5, 6, 7, 8, 9]: # ika_player_name, ika_player_name_death, ika_crown_fes_1, ika_crown_fes_2, ika_crown_x_1
             name = TrackableItem(xyxy=box, conf=conf, cls=cls, track_id=track_id)
             names.append(name)
@@ -123,25 +126,53 @@ def run_ika_player_detection(
     process_id: int,
     batch_size: int,
     start_frame: int=0,
-    end_frame: int=None
+    end_frame: int=None,
+    frame_bus_id: int=None,
+    frame_bus_consumer: int=None,
+    crop_store_path: str=None
 ):
-    result = run_parallel(
-        workers=4,
-        name='ikaplayer',
-        battle_movie_path=battle_movie_path,
-        model_path=ika_model_path,
-        start_frame=start_frame,
-        end_frame=end_frame,
-        frame_interval=frame_interval,
-        device=device,
-        batch_size=1,
-        iou_threshold=0.25,
-        conf_threshold=0.3,
-        max_detections=100,
-        make_frame_result_func=make_frame_result,
-        make_prediction_completed_func=make_detection_completed,
-        tracingEnabled=True
-    )
+    if frame_bus_id is not None:
+        # frames arrive in order from the frame bus, so track them on a single stream
+        result = run_prediction(
+            name='ikaplayer',
+            battle_movie_path=battle_movie_path,
+            model_path=ika_model_path,
+            start_frame=start_frame,
+            end_frame=end_frame,
+            frame_interval=frame_interval,
+            device=device,
+            batch_size=1,
+            iou_threshold=0.25,
+            conf_threshold=0.3,
+            max_detections=100,
+            make_frame_result_func=make_frame_result,
+            make_prediction_completed_func=make_detection_completed,
+            columnar=True,
+            tracingEnabled=True,
+            frame_bus_id=frame_bus_id,
+            frame_bus_consumer=frame_bus_consumer,
+            crop_store_path=crop_store_path,
+            crop_store_classes=CROP_POSITION_CLASSES
+        )
+    else:
+        result = run_parallel(
+            workers=4,
+            name='ikaplayer',
+            battle_movie_path=battle_movie_path,
+            model_path=ika_model_path,
+            start_frame=start_frame,
+            end_frame=end_frame,
+            frame_interval=frame_interval,
+            device=device,
+            batch_size=1,
+            iou_threshold=0.25,
+            conf_threshold=0.3,
+            max_detections=100,
+            make_frame_result_func=make_frame_result,
+            make_prediction_completed_func=make_detection_completed,
+            columnar=True,
+            tracingEnabled=True
+        )
     
     SharedIkaPlayerDetectionResult.set_id(process_id)
     SharedIkaPlayerDetectionResult.write(result)
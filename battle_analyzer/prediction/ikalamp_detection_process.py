@@ -1,7 +1,9 @@
 from dataclasses import dataclass
 from multiprocessing import Value
+import numpy as np
 from prediction.shared_memory import SharedMemory
-from prediction.prediction_process import PredictionResultBase, toCpu, run_prediction 
+from prediction.prediction_process import PredictionResultBase, to_items, run_prediction 
+from prediction.boundary_refinement import run_refined_prediction
 from prediction.frame import Frame
 from models.ikalamp import Ikalamp, IkalampTimer, BattleSide, IkalampState, IkalampTimerState
 
@@ -38,39 +40,28 @@ class IkalampDetectionResult(PredictionResultBase):
 class SharedIkalampDetectionResult(SharedMemory):
     SHM_NAME = 'shared_ikalamp'
 
+# lamps read by buki and ink color analysis. timers are not kept in the crop store
+CROP_LAMP_CLASSES = [state.value for state in IkalampState]
+
 def make_lamps(pred) -> list[Ikalamp]:
-    teams = []
-    enemies = []
-    timer = None
     team_member_count = 4
     enemy_member_count = 4
     total_objects = team_member_count + enemy_member_count + 1 # timer
-    pred = sorted(pred, key=lambda p: p[4], reverse=True)[0:total_objects] # sort with conf
-    if len(pred) != total_objects:
+    if len(pred) < total_objects:
         return None
-    pred = sorted(pred, key=lambda p: p[0]) # sort with x
-
-    cur_side = BattleSide.TEAM
-    team_ord = 0
-    enemy_ord = 0
-    for data in pred:
-        xyxy, conf, cls = toCpu(data)
-        if cls == 4: # timer:
-            timer = IkalampTimer(state=IkalampTimerState.INTERVAL, xyxy=xyxy, conf=conf, cls=cls)
-            cur_side = BattleSide.ENEMY
-        else:
-            if cur_side == BattleSide.TEAM:
-                ikalamp = Ikalamp(side=cur_side, state=IkalampState(int(cls)), xyxy=xyxy, ord=team_ord, conf=conf, cls=cls)
-                teams.append(ikalamp)
-                team_ord += 1
-            else:
-                ikalamp = Ikalamp(side=cur_side, state=IkalampState(int(cls)), xyxy=xyxy, ord=enemy_ord, conf=conf, cls=cls)
-                enemies.append(ikalamp)
-                enemy_ord += 1
+    pred = pred[np.argsort(-pred[:, 4], kind='stable')[:total_objects]] # sort with conf
+    pred = pred[np.argsort(pred[:, 0], kind='stable')] # sort with x
 
-    if len(teams) != team_member_count or len(enemies) != enemy_member_count or timer is None:
+    # lamps left of the timer are the team. exactly one timer between four lamps on each side
+    is_timer = pred[:, 5] == 4
+    if np.count_nonzero(is_timer) != 1 or not is_timer[team_member_count]:
         return None
 
+    items = to_items(pred)
+    xyxy, conf, cls = items[team_member_count]
+    timer = IkalampTimer(state=IkalampTimerState.INTERVAL, xyxy=xyxy, conf=conf, cls=cls)
+    teams = [Ikalamp(side=BattleSide.TEAM, state=IkalampState(cls), xyxy=xyxy, ord=ord, conf=conf, cls=cls) for ord, (xyxy, conf, cls) in enumerate(items[:team_member_count])]
+    enemies = [Ikalamp(side=BattleSide.ENEMY, state=IkalampState(cls), xyxy=xyxy, ord=ord, conf=conf, cls=cls) for ord, (xyxy, conf, cls) in enumerate(items[team_member_count + 1:])]
     return teams, enemies, timer
 
 def make_frame_result(pred, frame: int, img) -> IkalampDetectionFrame:
@@ -92,6 +83,11 @@ def make_frame_result(pred, frame: int, img) -> IkalampDetectionFrame:
             image=None
         )
     
+def frame_state(frame: IkalampDetectionFrame):
+    if frame.team is None or frame.enemy is None:
+        return None
+    return tuple(lamp.state for lamp in frame.team + frame.enemy)
+
 def make_detection_completed(
     width: int,
     height: int,
@@ -122,23 +118,55 @@ def run_ikalamp_detection(
     batch_size: int,
     start_frame: int=0,
     end_frame: int=None,
-    write_shared_memory: bool= True
+    write_shared_memory: bool= True,
+    frame_bus_id: int=None,
+    frame_bus_consumer: int=None,
+    crop_store_path: str=None,
+    coarse_frame_interval: int=None
 ):
-    result = run_prediction(
-        name='ikalamp',
-        battle_movie_path=battle_movie_path,
-        model_path=ikalamp_model_path,
-        start_frame=start_frame,
-        end_frame=end_frame,
-        frame_interval=frame_interval,
-        device=device,
-        batch_size=batch_size,
-        iou_threshold=0.25,
-        conf_threshold=0.3,
-        max_detections=100,
-        make_frame_result_func=make_frame_result,
-        make_prediction_completed_func=make_detection_completed
-    )
+    if coarse_frame_interval is not None:
+        # lamp states change rarely. sample coarsely and bisect around changes
+        result = run_refined_prediction(
+            name='ikalamp',
+            battle_movie_path=battle_movie_path,
+            model_path=ikalamp_model_path,
+            start_frame=start_frame,
+            end_frame=end_frame,
+            frame_interval=frame_interval,
+            device=device,
+            batch_size=batch_size,
+            iou_threshold=0.25,
+            conf_threshold=0.3,
+            max_detections=100,
+            make_frame_result_func=make_frame_result,
+            make_prediction_completed_func=make_detection_completed,
+            columnar=True,
+            coarse_frame_interval=coarse_frame_interval,
+            state_func=frame_state,
+            crop_store_path=crop_store_path,
+            crop_store_classes=CROP_LAMP_CLASSES
+        )
+    else:
+        result = run_prediction(
+            name='ikalamp',
+            battle_movie_path=battle_movie_path,
+            model_path=ikalamp_model_path,
+            start_frame=start_frame,
+            end_frame=end_frame,
+            frame_interval=frame_interval,
+            device=device,
+            batch_size=batch_size,
+            iou_threshold=0.25,
+            conf_threshold=0.3,
+            max_detections=100,
+            make_frame_result_func=make_frame_result,
+            make_prediction_completed_func=make_detection_completed,
+            columnar=True,
+            frame_bus_id=frame_bus_id,
+            frame_bus_consumer=frame_bus_consumer,
+            crop_store_path=crop_store_path,
+            crop_store_classes=CROP_LAMP_CLASSES
+        )
 
     if write_shared_memory:
         SharedIkalampDetectionResult.set_id(process_id)
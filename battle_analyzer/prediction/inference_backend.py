@@ -0,0 +1,174 @@
+import ast
+import copy
+import os
+from threading import Lock
+import torch
+from ultralytics import YOLO
+from ultralytics.utils.metrics import box_iou
+
+class InferenceBackend:
+    """
+    Runs one YOLO model. forward() returns the raw network output for postprocess,
+    predict() and track() return ultralytics Results like YOLO does.
+    """
+    task: str
+    names: dict[int, str]
+    imgsz: int
+    device: torch.device
+
+    def forward(self, batch: torch.Tensor):
+        raise NotImplementedError()
+
+    def predict(self, source, **kwargs):
+        raise NotImplementedError()
+
+    def track(self, source, **kwargs):
+        raise NotImplementedError()
+
+    def handle(self):
+        # instance handed to one caller. loaded weights are shared
+        return copy.copy(self)
+
+    def parameter_bytes(self) -> int:
+        raise NotImplementedError()
+
+class TorchBackend(InferenceBackend):
+    def __init__(self, model_path: str, device: str) -> None:
+        self.model = YOLO(model_path)
+        self.model.to(torch.device(device))
+        # predictors fuse conv and batch norm layers in place when they are set up. fused once here,
+        # so predictors of handles on other threads find the shared module already fused and leave it as is
+        self.model.model.fuse(verbose=False)
+        self.task = self.model.task
+        self.names = self.model.names
+        self.imgsz = self.model.overrides['imgsz']
+        self.device = self.model.device
+
+    def forward(self, batch: torch.Tensor):
+        with torch.inference_mode():
+            return self.model.model(batch)
+
+    def predict(self, source, **kwargs):
+        return self.model.predict(source, **kwargs)
+
+    def track(self, source, **kwargs):
+        return self.model.track(source, **kwargs)
+
+    def handle(self):
+        # predictor keeps per call state. each caller gets its own
+        backend = copy.copy(self)
+        backend.model = copy.copy(self.model)
+        backend.model.predictor = None
+        # track() registers tracker callbacks on the model. shared callbacks would run them once per past caller
+        backend.model.callbacks = copy.deepcopy(self.model.callbacks)
+        return backend
+
+    def parameter_bytes(self) -> int:
+        return sum(p.numel() * p.element_size() for p in self.model.model.parameters())
+
+class OnnxBackend(InferenceBackend):
+    """
+    Model exported by tools/export_onnx.py, run on ONNX Runtime.
+    Execution providers are read from ONNX_PROVIDERS, e.g. OpenVINOExecutionProvider,CPUExecutionProvider.
+    """
+    def __init__(self, model_path: str, device: str) -> None:
+        import onnxruntime as ort
+        self.model_path = model_path
+        providers = os.environ.get('ONNX_PROVIDERS')
+        if providers is not None:
+            providers = providers.split(',')
+        elif str(device).startswith('cuda'):
+            providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+        else:
+            providers = ['CPUExecutionProvider']
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = int(os.environ.get('ONNX_THREADS', 0))
+        self.session = ort.InferenceSession(model_path, options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+        # written by the ultralytics exporter
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.task = meta.get('task', 'detect')
+        self.names = ast.literal_eval(meta['names'])
+        imgsz = ast.literal_eval(meta['imgsz'])
+        self.imgsz = imgsz[0] if isinstance(imgsz, list) else imgsz
+        self.device = torch.device(device)
+        # the YOLO runs its own session of the model. created once for all handles of the registry entry
+        self.yolo = None
+        self.yolo_lock = Lock()
+        self.entry = self
+        self.tracking = False
+
+    def forward(self, batch: torch.Tensor):
+        output = self.session.run(None, {self.input_name: batch.cpu().numpy()})[0]
+        return torch.from_numpy(output).to(batch.device)
+
+    def predict(self, source, **kwargs):
+        # the predictor of the shared YOLO keeps per call state
+        with self.entry.yolo_lock:
+            return self._yolo().predict(source, **kwargs)
+
+    def track(self, source, **kwargs):
+        with self.entry.yolo_lock:
+            # trackers live in the shared predictor. the first call of a caller starts new tracks
+            if not self.tracking:
+                kwargs['persist'] = False
+                self.tracking = True
+            return self._yolo().track(source, **kwargs)
+
+    def handle(self):
+        backend = copy.copy(self)
+        backend.tracking = False
+        return backend
+
+    def parameter_bytes(self) -> int:
+        return os.path.getsize(self.model_path)
+
+    def _yolo(self) -> YOLO:
+        # classifier and tracker pre/postprocessing is left to ultralytics, which runs exported models as well
+        if self.entry.yolo is None:
+            self.entry.yolo = YOLO(self.model_path, task=self.task)
+        return self.entry.yolo
+
+backends = {
+    '.pt': TorchBackend,
+    '.onnx': OnnxBackend
+}
+
+def int8_model_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + '.int8.onnx'
+
+def load_backend(model_path: str, device: str) -> InferenceBackend:
+    """
+    The backend is chosen by the extension of the model path, so switching a model to ONNX Runtime
+    is a change of its *_MODEL_PATH.
+    With QUANTIZED_MODELS=1, int8 models accepted by tools/quantize_onnx.py are used where they exist.
+    """
+    if os.environ.get('QUANTIZED_MODELS', '0') == '1' and os.path.exists(int8_model_path(model_path)):
+        model_path = int8_model_path(model_path)
+    ext = os.path.splitext(model_path)[1].lower()
+    if ext not in backends:
+        raise Exception(f'unsupported model format: {model_path}')
+    return backends[ext](model_path, device)
+
+def match_detections(expected, actual, iou_threshold: float=0.9, conf_tolerance: float=0.05) -> bool:
+    """
+    Whether two postprocessed detections of one image agree box by box.
+    """
+    if len(expected) != len(actual):
+        return False
+    if len(expected) == 0:
+        return True
+    expected = torch.as_tensor(expected)
+    actual = torch.as_tensor(actual)
+    ious = box_iou(expected[:, :4], actual[:, :4])
+    for i in range(len(expected)):
+        j = int(ious[i].argmax())
+        if ious[i, j] < iou_threshold:
+            return False
+        if int(expected[i, 5]) != int(actual[j, 5]):
+            return False
+        if conf_tolerance < abs(float(expected[i, 4]) - float(actual[j, 4])):
+            return False
+    return True
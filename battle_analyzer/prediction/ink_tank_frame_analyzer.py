@@ -1,7 +1,5 @@
 from dataclasses import dataclass
 from threading import Thread
-from ultralytics import YOLO
-import torch
 import cv2
 import numpy as np
 from prediction.player_position_frame_analyzer import PlayerPositionAnalysisResult
@@ -9,8 +7,9 @@ from prediction.prediction_process import preprocess
 from utils import class_to_dict 
 from models.ika_player import IkaPlayerPosition, InkTank 
 from models.detected_item import SegmentItem
-from utils import bounding_box, MovieReader
+from utils import bounding_box, FrameRequestPlanner
 from error import InternalError
+from prediction.batch_broker import ModelBroker
 
 @dataclass
 class InkTankAnalysisFrame:
@@ -41,13 +40,13 @@ class InkTankFrameAnalyzer(Thread):
     def __init__(self,
             battle_movie_path: str,
             ink_tank_model_path: str,
-            device: str
+            device: str,
+            planner: FrameRequestPlanner
         ) -> None:
         super().__init__()
-        dev = torch.device(device) 
-        self.ink_tank_model = YOLO(ink_tank_model_path)
-        self.ink_tank_model.to(dev)
-        self.reader = MovieReader(battle_movie_path)
+        self.ink_tank_model = ModelBroker.get(ink_tank_model_path, device)
+        self.battle_movie_path = battle_movie_path
+        self.planner = planner
         self.player_position_result: PlayerPositionAnalysisResult = None
         self.result: InkTankAnalysisResult = None
 
@@ -58,21 +57,24 @@ class InkTankFrameAnalyzer(Thread):
     def run(self):
         if self.player_position_result is None:
             raise InternalError('run must be called via create')
-        ink_frames = []
+        requests = []
         for pos_frame in self.player_position_result.frames:
-            img = self.reader.read(pos_frame.frame)
             if pos_frame.main_player_position:
-                main_ink = self._predict_ink_tank(img, pos_frame.main_player_position)
-                if main_ink:
-                    ink_frames.append(InkTankAnalysisFrame(main_player_ink=main_ink, frame=pos_frame.frame))
+                requests.append((pos_frame, self.planner.request(pos_frame.frame, [pos_frame.main_player_position.xyxy])))
+        self.planner.run()
+
+        ink_frames = []
+        for pos_frame, crops in requests:
+            main_ink = self._predict_ink_tank(crops.result()[0], pos_frame.main_player_position)
+            if main_ink:
+                ink_frames.append(InkTankAnalysisFrame(main_player_ink=main_ink, frame=pos_frame.frame))
 
         self.result = InkTankAnalysisResult(frames=ink_frames)
     
-    def _predict_ink_tank(self, img: np.ndarray, position: IkaPlayerPosition) -> InkTank:
-        pos_img = img[position.xyxy[1]:position.xyxy[3],position.xyxy[0]:position.xyxy[2]] 
+    def _predict_ink_tank(self, pos_img: np.ndarray, position: IkaPlayerPosition) -> InkTank:
         #cv2.imshow('ee', pos_img)
         #cv2.waitKey(0)
-        input = preprocess(pos_img, self.ink_tank_model.overrides['imgsz'], self.ink_tank_model.device)
+        input = preprocess(pos_img, self.ink_tank_model.imgsz, self.ink_tank_model.device)
         pred = self.ink_tank_model.predict(input, verbose=False)[0]
         if len(pred.boxes.data) == 0:
             return None
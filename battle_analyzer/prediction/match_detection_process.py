@@ -2,7 +2,7 @@ from dataclasses import dataclass
 from multiprocessing import Value
 import numpy as np
 from prediction.shared_memory import SharedMemory
-from prediction.prediction_process import PredictionResultBase, run_prediction, toCpu
+from prediction.prediction_process import PredictionResultBase, run_prediction, to_items
 from prediction.frame import Frame
 from models.detected_item import DetectedItem
 from models.battle import MatchType
@@ -61,8 +61,7 @@ def parse(pred, frame) -> MatchDetectionFrame:
     match_rate_item_menu_x = None
     match_rate_item_update_x = None
 
-    for data in pred:
-        xyxy, conf, cls = toCpu(data)
+    for xyxy, conf, cls in to_items(pred):
         
         if cls == 0: # match_color_player
             match_color_items.append(DetectedItem(xyxy=xyxy, conf=conf, cls=cls))
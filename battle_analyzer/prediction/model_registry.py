@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+from threading import Lock
+import os
+import time
+from prediction.inference_backend import InferenceBackend, load_backend
+
+@dataclass
+class ModelLoadStats:
+    model_path: str
+    device: str
+    load_time: float
+    parameter_bytes: int
+    rss_bytes: int
+    handles: int = 0
+
+def _rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+class ModelRegistry:
+    """
+    Process-wide models keyed by (path, device), loaded on first use.
+    get() returns a handle of the loaded backend. Weights are shared read-only and each caller
+    gets its own predictor state, so callers on different threads do not step on each other.
+    """
+    models: dict[tuple[str, str], InferenceBackend] = {}
+    stats: dict[tuple[str, str], ModelLoadStats] = {}
+    lock = Lock()
+
+    @classmethod
+    def get(cls, model_path: str, device: str) -> InferenceBackend:
+        key = (os.path.abspath(model_path), str(device))
+        with cls.lock:
+            model = cls.models.get(key)
+            if model is None:
+                model = cls._load(key, model_path, device)
+            cls.stats[key].handles += 1
+        return model.handle()
+
+    @classmethod
+    def _load(cls, key: tuple[str, str], model_path: str, device: str) -> InferenceBackend:
+        load_time = time.time()
+        rss = _rss_bytes()
+        model = load_backend(model_path, device)
+        cls.models[key] = model
+        cls.stats[key] = ModelLoadStats(
+            model_path=model_path,
+            device=str(device),
+            load_time=time.time() - load_time,
+            parameter_bytes=model.parameter_bytes(),
+            rss_bytes=max(0, _rss_bytes() - rss)
+        )
+        return model
+
+    @classmethod
+    def report(cls) -> list[ModelLoadStats]:
+        with cls.lock:
+            return list(cls.stats.values())
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.models.clear()
+            cls.stats.clear()
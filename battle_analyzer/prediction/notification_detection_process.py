@@ -1,8 +1,11 @@
 from dataclasses import dataclass
 from multiprocessing import Value
+import numpy as np
 from prediction.shared_memory import SharedMemory
-from prediction.prediction_process import PredictionResultBase, toCpu, run_prediction 
+from prediction.prediction_process import PredictionResultBase, to_items, run_prediction, concat_results
+from prediction.boundary_refinement import run_refined_prediction
 from prediction.frame import Frame
+from prediction.columnar_frames import ColumnarFrames
 from models.notification import NotificationType, Notification
 
 @dataclass
@@ -17,10 +20,95 @@ class NotificationDetectionFrame(Frame):
             image=None
         )
 
+class NotificationIndex:
+    """
+    Frame numbers, boxes and confidences of the notifications of a result, grouped by type in frame order.
+    Scans for a type look up the frames that contain it instead of filtering the notifications of every frame.
+    """
+    def __init__(self, types: np.ndarray, frame_numbers: np.ndarray, boxes: np.ndarray, confs: np.ndarray) -> None:
+        order = np.lexsort((frame_numbers, types))
+        self.frame_numbers = frame_numbers[order]
+        self.boxes = boxes[order]
+        self.confs = confs[order]
+        # notifications of a type are at type_offsets[type]:type_offsets[type + 1]
+        self.type_offsets = np.searchsorted(types[order], np.arange(max(t.value for t in NotificationType) + 2))
+
+    @classmethod
+    def from_frames(cls, frames: list[NotificationDetectionFrame]) -> 'NotificationIndex':
+        if isinstance(frames, ColumnarFrames):
+            # rows are already in columns
+            detections = frames.detections[frames.offsets[frames.start]:frames.offsets[frames.stop]]
+            return cls(
+                detections['cls'].astype(np.int64),
+                detections['frame'].astype(np.int64),
+                detections['xyxy'].astype(np.int64),
+                detections['conf'].astype(np.float32)
+            )
+        types = []
+        frame_numbers = []
+        boxes = []
+        confs = []
+        for frame in frames:
+            if frame is None:
+                continue
+            for notif in frame.notifications:
+                types.append(notif.type.value)
+                frame_numbers.append(frame.frame)
+                boxes.append(notif.xyxy)
+                confs.append(notif.conf)
+        return cls(
+            np.array(types, dtype=np.int64),
+            np.array(frame_numbers, dtype=np.int64),
+            np.array(boxes, dtype=np.int64).reshape(-1, 4),
+            np.array(confs, dtype=np.float32)
+        )
+
+    def _span(self, type: NotificationType, start_frame: int=None, end_frame: int=None) -> (int, int):
+        lo = self.type_offsets[type.value]
+        hi = self.type_offsets[type.value + 1]
+        frame_numbers = self.frame_numbers[lo:hi]
+        start = np.searchsorted(frame_numbers, start_frame, side='left') if start_frame is not None else 0
+        end = np.searchsorted(frame_numbers, end_frame, side='right') if end_frame is not None else len(frame_numbers)
+        return lo + start, lo + max(start, end)
+
+    def frames_with(self, type: NotificationType, start_frame: int=None, end_frame: int=None) -> np.ndarray:
+        """
+        Frame numbers in [start_frame, end_frame] that contain a notification of the type.
+        """
+        lo, hi = self._span(type, start_frame, end_frame)
+        return np.unique(self.frame_numbers[lo:hi])
+
+    def notifications_of(self, type: NotificationType, start_frame: int=None, end_frame: int=None) -> (np.ndarray, np.ndarray, np.ndarray):
+        """
+        Frame numbers, boxes and confidences of the notifications of the type in [start_frame, end_frame].
+        """
+        lo, hi = self._span(type, start_frame, end_frame)
+        return self.frame_numbers[lo:hi], self.boxes[lo:hi], self.confs[lo:hi]
+
+    def counts(self, type: NotificationType, frame_numbers: np.ndarray) -> np.ndarray:
+        """
+        Number of notifications of the type in each frame.
+        """
+        lo, hi = self._span(type)
+        type_frame_numbers = self.frame_numbers[lo:hi]
+        return np.searchsorted(type_frame_numbers, frame_numbers, side='right') - np.searchsorted(type_frame_numbers, frame_numbers, side='left')
+
 @dataclass
 class NotificationDetectionResult(PredictionResultBase):
     frames: [NotificationDetectionFrame]
 
+    def notification_index(self) -> NotificationIndex:
+        # built on first use. detected frames do not change afterwards
+        if getattr(self, '_notification_index', None) is None:
+            self._notification_index = NotificationIndex.from_frames(self.frames)
+        return self._notification_index
+
+    def sliced_counts(self, type: NotificationType) -> np.ndarray:
+        """
+        Number of notifications of the type in each of get_sliced_frames().
+        """
+        return self.notification_index().counts(type, self.get_sliced_frame_numbers())
+
     @classmethod
     def from_json(cls, j):
         return cls(
@@ -32,19 +120,56 @@ class NotificationDetectionResult(PredictionResultBase):
             frame_interval=j['frame_interval'],
             frames=[NotificationDetectionFrame.from_json(i) if i is not None else None for i in j['frames']],
             processing_time=j['processing_time'],
+            skipped_frames=j.get('skipped_frames', [])
         )
 
 class SharedNotificationDetectionResult(SharedMemory):
     SHM_NAME = 'shared_notification'
 
-def make_notifications(pred) -> list[Notification]:
-    notifications = []
-    for data in pred:
-        xyxy, conf, cls = toCpu(data)
-        pos = Notification(xyxy=xyxy, type=NotificationType(cls), conf=conf, cls=cls)
-        notifications.append(pos)
+# largest block difference (0-255) of frames treated as unchanged. covers compression noise on still scenes
+DUPLICATE_FRAME_THRESHOLD = 3.0
 
-    return notifications
+# crops read by kill, death and plate analysis. other notifications are not kept in the crop store
+CROP_NOTIFICATION_TYPES = [
+    NotificationType.NOTIFICATION_KILL,
+    NotificationType.NOTIFICATION_DEATH_REASON,
+    NotificationType.NOTIFICATION_PLAYER_PLATE
+]
+
+# notifications shown around battles. frames are sampled at full rate near them
+ACTIVE_NOTIFICATION_TYPES = [
+    NotificationType.NOTIFICATION_KILL,
+    NotificationType.NOTIFICATION_DEATH_REASON,
+    NotificationType.NOTIFICATION_PLAYER_GEAR,
+    NotificationType.NOTIFICATION_PLAYER_PLATE,
+    NotificationType.NOTIFICATION_RULE_NAWABARI,
+    NotificationType.NOTIFICATION_RULE_HOKO,
+    NotificationType.NOTIFICATION_RULE_YAGURA,
+    NotificationType.NOTIFICATION_RULE_ASARI,
+    NotificationType.NOTIFICATION_RULE_AREA,
+    NotificationType.NOTIFICATION_RULE_TRICOLOR,
+    NotificationType.NOTIFICATION_BATTLE_START,
+    NotificationType.NOTIFICATION_BATTLE_END,
+    NotificationType.NOTIFICATION_SP_FULLCHARGE
+]
+
+def is_active_frame(frame: NotificationDetectionFrame) -> bool:
+    return any(n.type in ACTIVE_NOTIFICATION_TYPES for n in frame.notifications)
+
+# frames are sampled at full rate from battle start to battle end. main player matching needs every full charge timing
+def is_battle_start_frame(frame: NotificationDetectionFrame) -> bool:
+    return any(n.type == NotificationType.NOTIFICATION_BATTLE_START for n in frame.notifications)
+
+def is_battle_end_frame(frame: NotificationDetectionFrame) -> bool:
+    return any(n.type == NotificationType.NOTIFICATION_BATTLE_END for n in frame.notifications)
+
+def frame_state(frame: NotificationDetectionFrame):
+    # counts per type so a second notification of the same type is a change too
+    types = [n.type.value for n in frame.notifications]
+    return tuple(sorted((t, types.count(t)) for t in set(types)))
+
+def make_notifications(pred) -> list[Notification]:
+    return [Notification(xyxy=xyxy, type=NotificationType(cls), conf=conf, cls=cls) for xyxy, conf, cls in to_items(pred)]
 
 def make_frame_result(pred, frame: int, _) -> NotificationDetectionFrame:
     notifications = make_notifications(pred)
@@ -85,23 +210,67 @@ def run_notification_detection(
     process_id: int,
     batch_size: int,
     start_frame: int=0,
-    end_frame: int=None
+    end_frame: int=None,
+    crop_store_path: str=None,
+    streaming: bool=False,
+    idle_frame_interval: int=None,
+    active_window: int=None,
+    spans: list[tuple[int, int]]=None,
+    coarse_frame_interval: int=None
 ):
-    result = run_prediction(
-        name='notification',
-        battle_movie_path=battle_movie_path,
-        model_path=notification_model_path,
-        start_frame=start_frame,
-        end_frame=end_frame,
-        frame_interval=frame_interval,
-        device=device,
-        batch_size=batch_size,
-        iou_threshold=0.25,
-        conf_threshold=0.3,
-        max_detections=100,
-        make_frame_result_func=make_frame_result,
-        make_prediction_completed_func=make_detection_completed
-    )
+    # spans limit detection to the battles found by the scene classification pass
+    spans = spans or [(start_frame, end_frame)]
+    results = []
+    for span_start, span_end in spans:
+        if coarse_frame_interval is not None and not streaming:
+            # sample coarsely and bisect around notification changes instead of adaptive sampling
+            results.append(run_refined_prediction(
+                name='notification',
+                battle_movie_path=battle_movie_path,
+                model_path=notification_model_path,
+                start_frame=span_start,
+                end_frame=span_end,
+                frame_interval=frame_interval,
+                device=device,
+                batch_size=batch_size,
+                iou_threshold=0.25,
+                conf_threshold=0.3,
+                max_detections=100,
+                make_frame_result_func=make_frame_result,
+                make_prediction_completed_func=make_detection_completed,
+                columnar=True,
+                coarse_frame_interval=coarse_frame_interval,
+                state_func=frame_state,
+                crop_store_path=crop_store_path,
+                crop_store_classes=[t.value for t in CROP_NOTIFICATION_TYPES]
+            ))
+            continue
+        results.append(run_prediction(
+            name='notification',
+            battle_movie_path=battle_movie_path,
+            model_path=notification_model_path,
+            start_frame=span_start,
+            end_frame=span_end,
+            frame_interval=frame_interval,
+            device=device,
+            batch_size=batch_size,
+            iou_threshold=0.25,
+            conf_threshold=0.3,
+            max_detections=100,
+            make_frame_result_func=make_frame_result,
+            make_prediction_completed_func=make_detection_completed,
+            columnar=True,
+            crop_store_path=crop_store_path,
+            crop_store_classes=[t.value for t in CROP_NOTIFICATION_TYPES],
+            streaming=streaming,
+            duplicate_threshold=DUPLICATE_FRAME_THRESHOLD,
+            idle_frame_interval=idle_frame_interval,
+            active_window=active_window,
+            is_active_frame_func=is_active_frame,
+            is_span_start_func=is_battle_start_frame,
+            is_span_end_func=is_battle_end_frame
+        ))
+    result = concat_results(results) if None not in results else None
 
     SharedNotificationDetectionResult.set_id(process_id) 
     SharedNotificationDetectionResult.write(result)
@@ -1,13 +1,12 @@
 from dataclasses import dataclass
-import torch
-from ultralytics import YOLO
 from models.text import Text, Char
 from models.plate import Plate, Badge
 from models.notification import NotificationType
 from prediction.notification_detection_process import NotificationDetectionFrame
-from prediction.prediction_process import preprocess, postprocess
+from prediction.prediction_process import preprocess, postprocess, to_items, sort_by_x
 from prediction.splash_font_ocr import SplashFontOCR
-from utils import class_to_dict, MovieReader
+from utils import class_to_dict, FrameRequestPlanner
+from prediction.batch_broker import ModelBroker
 
 @dataclass
 class PlateAnalysisFrame:
@@ -39,13 +38,13 @@ class PlateFrameAnalyzer:
             plate_model_path: str,
             battle_movie_path: str,
             ocr: SplashFontOCR, 
-            device: str
+            device: str,
+            planner: FrameRequestPlanner
         ) -> None:
-        dev = torch.device(device)
-        self.plate_model = YOLO(plate_model_path)
-        self.plate_model.to(dev)
+        self.plate_model = ModelBroker.get(plate_model_path, device)
         self.ocr = ocr
-        self.reader = MovieReader(battle_movie_path)
+        self.battle_movie_path = battle_movie_path
+        self.planner = planner
 
     def analyze(self,
         frames: [NotificationDetectionFrame],
@@ -54,16 +53,28 @@ class PlateFrameAnalyzer:
         ignore_id: bool=False,
         ignore_badge: bool=False
     ) -> PlateAnalysisResult:
-        plate_frames = []
+        requests = []
         for frame in frames:
             plate_notifs = list(filter(lambda n: n.type == NotificationType.NOTIFICATION_PLAYER_PLATE, frame.notifications))
             if len(plate_notifs) == 0:
                 continue
-            img = self.reader.read(frame.frame)
+            requests.append((frame, plate_notifs, self.planner.request(frame.frame, [n.xyxy for n in plate_notifs])))
+        self.planner.run()
+
+        # text fields of all plates are read in one OCR batch
+        plate_items = []
+        for frame, plate_notifs, crops in requests:
+            items = []
+            for notif, plate_img in zip(plate_notifs, crops.result()):
+                items.append((notif, self._detect_fields(plate_img, notif.xyxy, ignore_name, ignore_nickname, ignore_id, ignore_badge)))
+            plate_items.append((frame, items))
+        self._read_fields([field for _, items in plate_items for _, fields in items if fields is not None for field in fields])
+
+        plate_frames = []
+        for frame, items in plate_items:
             plates = []
-            for notif in plate_notifs:
-                plate_img = img[notif.xyxy[1]:notif.xyxy[3], notif.xyxy[0]:notif.xyxy[2]]
-                plate = self.make_plate(plate_img, notif.xyxy, notif.conf, notif.cls, ignore_name, ignore_nickname, ignore_id, ignore_badge)
+            for notif, fields in items:
+                plate = self._make_plate_from_fields(fields, notif.xyxy, notif.conf, notif.cls)
                 if plate is not None:
                     plates.append(plate)
             plate_frames.append(PlateAnalysisFrame(plates=plates, frame=frame.frame))
@@ -83,48 +94,75 @@ class PlateFrameAnalyzer:
         ignore_id: bool,
         ignore_badge: bool
     ) -> Plate:
-        input = preprocess(plate_img, self.plate_model.overrides['imgsz'], self.plate_model.device)
-        preds = self.plate_model.model(input)
+        fields = self._detect_fields(plate_img, plate_xyxy, ignore_name, ignore_nickname, ignore_id, ignore_badge)
+        if fields is not None:
+            self._read_fields(fields)
+        return self._make_plate_from_fields(fields, plate_xyxy, plate_conf, plate_cls)
+
+    def _detect_fields(self,
+        plate_img,
+        plate_xyxy,
+        ignore_name: bool,
+        ignore_nickname: bool,
+        ignore_id: bool,
+        ignore_badge: bool
+    ) -> list[dict]:
+        input = preprocess(plate_img, self.plate_model.imgsz, self.plate_model.device)
+        preds = self.plate_model.forward(input)
         pred = postprocess(preds, input.shape[2:], plate_img.shape, 0.25, 0.2, 10)[0]
-        pred = sorted(pred, key=lambda p: p[0]) # sort with x
+        offset_x = plate_xyxy[0]
+        offset_y = plate_xyxy[1]
+        ignored = { 0: ignore_name, 1: ignore_id, 2: ignore_nickname, 3: ignore_badge }
+        fields = []
+        for (x1, y1, x2, y2), conf, cls in to_items(sort_by_x(pred)):
+            if cls not in ignored:
+                return None
+            fields.append({
+                'cls': cls,
+                'conf': conf,
+                'xyxy': [x1 + offset_x, y1 + offset_y, x2 + offset_x, y2 + offset_y], # to play image coordinate
+                # badges have no text
+                'img': plate_img[y1:y2,x1:x2] if cls != 3 and not ignored[cls] else None,
+                'ignored': ignored[cls],
+                'chars': None
+            })
+        return fields
+
+    def _read_fields(self, fields: list[dict]):
+        text_fields = [field for field in fields if field['img'] is not None]
+        texts = self.get_texts([field['img'] for field in text_fields], [field['xyxy'][:2] for field in text_fields])
+        for field, chars in zip(text_fields, texts):
+            field['chars'] = chars
+
+    def _make_plate_from_fields(self, fields: list[dict], plate_xyxy, plate_conf, plate_cls) -> Plate:
+        if fields is None:
+            return None
         player_id = None
         player_name = None
         nickname = None
         badges = []
-        offset_x = plate_xyxy[0]
-        offset_y = plate_xyxy[1]
-        for *xyxy, conf, cls in pred:
-            x1 = int(xyxy[0].cpu().numpy().astype('uint'))
-            y1 = int(xyxy[1].cpu().numpy().astype('uint'))
-            x2 = int(xyxy[2].cpu().numpy().astype('uint'))
-            y2 = int(xyxy[3].cpu().numpy().astype('uint'))
-            conf = float(conf.cpu().numpy().astype('float'))
-            cls = int(cls.cpu().numpy().astype('uint'))
-            box_abs = [x1 + offset_x, y1 + offset_y, x2 + offset_x, y2 + offset_y] # to play image coordinate
-            content_img = plate_img[y1:y2,x1:x2]
+        for field in fields:
+            cls = field['cls']
+            if cls == 3:
+                badge = Badge(xyxy=field['xyxy'], conf=field['conf'], cls=cls) if not field['ignored'] else None
+                badges.append(badge)
+                continue
+            text = Text(value=field['chars'], xyxy=field['xyxy'], conf=field['conf'], cls=cls) if not field['ignored'] else None
             if cls == 0:
-                text  = Text(value=self.get_text(content_img, offset_x + x1, offset_y + y1), xyxy=box_abs, conf=conf, cls=cls) if not ignore_name else None
                 if player_name is None:
                     player_name = text
                 else:
                     player_name.concat(text)
             elif cls == 1:
-                text = Text(value=self.get_text(content_img, offset_x + x1, offset_y + y1), xyxy=box_abs, conf=conf, cls=cls) if not ignore_id else None
                 if player_id is None:
                     player_id = text
                 else:
                     player_id.concat(text)
             elif cls == 2:
-                text = Text(value=self.get_text(content_img, offset_x + x1, offset_y + y1), xyxy=box_abs, conf=conf, cls=cls) if not ignore_nickname else None
                 if nickname is None:
                     nickname = text
                 else:
                     nickname.concat(text)
-            elif cls == 3:
-                badge = Badge(xyxy=box_abs, conf=conf, cls=cls) if not ignore_badge else None
-                badges.append(badge)
-            else:
-                return None
 
         return Plate(
             player_id=player_id,
@@ -137,10 +175,14 @@ class PlateFrameAnalyzer:
         )
     
     def get_text(self, img, offset_x, offset_y) -> list[Char]:
-        chars = self.ocr.get_text(img)
-        for c in chars:
-            c.xyxy[0] += offset_x
-            c.xyxy[1] += offset_y
-            c.xyxy[2] += offset_x
-            c.xyxy[3] += offset_y
-        return chars
+        return self.get_texts([img], [(offset_x, offset_y)])[0]
+
+    def get_texts(self, imgs, offsets: list[tuple[int, int]]) -> list[list[Char]]:
+        texts = self.ocr.get_texts(imgs)
+        for chars, (offset_x, offset_y) in zip(texts, offsets):
+            for c in chars or []:
+                c.xyxy[0] += offset_x
+                c.xyxy[1] += offset_y
+                c.xyxy[2] += offset_x
+                c.xyxy[3] += offset_y
+        return texts
@@ -100,12 +100,14 @@ class PlayerNameFrameAnalyzer:
     def _make_name_item(self, items: list[(TrackableItem, int)]) -> PlayerNameAnalysisFrame:
         texts = []
         char_imgs = []
+        name_imgs = []
         for item in items:
             name = item[0]
             frame= item[1]
             img = self.reader.read(frame)
-            name_img = img[name.xyxy[1]:name.xyxy[3],name.xyxy[0]:name.xyxy[2]]
-            chars = self.ocr.get_text(name_img)
+            name_imgs.append(img[name.xyxy[1]:name.xyxy[3],name.xyxy[0]:name.xyxy[2]].copy())
+        # all frames of the tracked name are read in one OCR batch
+        for name_img, chars in zip(name_imgs, self.ocr.get_texts(name_imgs)):
             if len(chars) > 0:
                 text = to_str(chars)
                 texts.append(text)
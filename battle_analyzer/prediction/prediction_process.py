@@ -1,15 +1,20 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 from itertools import chain
+from collections import deque
 import concurrent.futures
 import time
 import cv2
 from ultralytics.data.augment import LetterBox
 from ultralytics.utils import ops
-from ultralytics import YOLO
 import numpy as np
 import torch
 from utils import class_to_dict
 from prediction.frame import Frame
+from prediction.frame_bus import FrameBus, read_frames
+from prediction.crop_store import CropStore
+from movie_stream import MovieStream
+from prediction.model_registry import ModelRegistry
+from prediction.columnar_frames import ColumnarFrames, detection_rows
 
 @dataclass
 class PredictionResultBase:
@@ -21,47 +26,97 @@ class PredictionResultBase:
     end_frame: int 
     frame_interval: int
     processing_time: int
+    # frames whose detections were copied from the previous inferred frame
+    skipped_frames: list[int] = field(default_factory=list)
 
     def get_frame(self, frame_number: int) -> Frame:
         if frame_number < self.start_frame or self.end_frame < frame_number:
             return None
         idx = self._index(frame_number)
-        if len(self.frames) <= idx:
+        if idx < 0 or len(self.frames) <= idx:
+            return None
+        if not self._is_uniform() and self.frame_interval <= frame_number - self._frame_number(idx):
+            # skipped by adaptive sampling
             return None
         return self.frames[idx]
     
     def get_sliced_frames(self) ->list[Frame]:
         return self.frames[self._index(self.start_frame):self._index(self.end_frame) + 1]
+
+    def get_sliced_frame_numbers(self) -> np.ndarray:
+        # frame numbers of get_sliced_frames() without building the frames. -1 for missing frames
+        frames = self.get_sliced_frames()
+        if isinstance(frames, ColumnarFrames):
+            return frames.frame_numbers[frames.start:frames.stop].astype(np.int64)
+        return np.array([f.frame if f is not None else -1 for f in frames], dtype=np.int64)
     
     def slice(self, start_frame: int, end_frame: int=None):
         cp = self._copy()
         cp.start_frame = start_frame
         if len(self.frames) > 0:
-            end_frame = end_frame if end_frame is not None else self.frames[-1].frame
+            end_frame = end_frame if end_frame is not None else self._frame_number(len(self.frames) - 1)
         else:
             end_frame = start_frame
         cp.end_frame = end_frame
         return cp
     
     def _index(self, frame) -> int:
-        base_frame = self.frames[0].frame if len(self.frames) > 0 else 0
-        return int((frame - base_frame) / self.frame_interval)
+        base_frame = self._frame_number(0) if len(self.frames) > 0 else 0
+        if self._is_uniform():
+            return int((frame - base_frame) / self.frame_interval)
+        if frame < base_frame:
+            return int((frame - base_frame) / self.frame_interval)
+        # adaptive sampling leaves gaps. binary search the last frame at or before the frame
+        if isinstance(self.frames, ColumnarFrames):
+            return int(np.searchsorted(self.frames.frame_numbers[self.frames.start:self.frames.stop], frame, side='right')) - 1
+        lo, hi = 0, len(self.frames)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if frame < self.frames[mid].frame:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo - 1
+
+    def _frame_number(self, idx: int) -> int:
+        # columnar frames answer without building the frame
+        if isinstance(self.frames, ColumnarFrames):
+            return self.frames.frame_number(idx)
+        return self.frames[idx].frame
+
+    def _is_uniform(self) -> bool:
+        if len(self.frames) < 2:
+            return True
+        if not isinstance(self.frames, ColumnarFrames) and (self.frames[0] is None or self.frames[-1] is None):
+            return True
+        return self._frame_number(len(self.frames) - 1) - self._frame_number(0) == (len(self.frames) - 1) * self.frame_interval
     
     def _copy(self):
-        return PredictionResultBase(
-            frames=self.frames,
-            image_width=self.image_width,
-            image_height=self.image_height,
-            total_frames=self.total_frames,
-            start_frame=self.start_frame,
-            end_frame=self.end_frame,
-            frame_interval=self.frame_interval,
-            processing_time=self.processing_time
-        )
+        # keeps the result type. slices share the frames and so the caches built from them
+        cp = replace(self)
+        cp.__dict__.update((key, value) for key, value in self.__dict__.items() if key.startswith('_'))
+        return cp
     
     def to_dict(self):
         return class_to_dict(self)
 
+def concat_results(results: list[PredictionResultBase]) -> PredictionResultBase:
+    """
+    Join results of disjoint frame ranges in frame order into one result.
+    """
+    results = sorted(results, key=lambda r: r.start_frame)
+    if all(isinstance(r.frames, ColumnarFrames) for r in results):
+        frames = ColumnarFrames.concat([r.frames for r in results])
+    else:
+        frames = list(chain.from_iterable(r.frames for r in results))
+    return replace(
+        results[0],
+        frames=frames,
+        end_frame=results[-1].end_frame,
+        processing_time=sum(r.processing_time for r in results),
+        skipped_frames=list(chain.from_iterable(r.skipped_frames for r in results))
+    )
+
 def preprocess(img, size, device, to_4d=True):
     img = LetterBox((size, size))(image=img)
     img = img.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
@@ -72,6 +127,56 @@ def preprocess(img, size, device, to_4d=True):
     img = img.to(device)
     return img.unsqueeze(0) if to_4d else img
 
+def _letterbox_geometry(shape, size: int) -> (tuple[int, int], int, int):
+    # same rounding as ultralytics LetterBox with auto=False
+    r = min(size / shape[0], size / shape[1])
+    new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
+    dw = (size - new_unpad[0]) / 2
+    dh = (size - new_unpad[1]) / 2
+    return new_unpad, int(round(dh - 0.1)), int(round(dw - 0.1))
+
+class BatchPreprocessor:
+    """
+    Letterboxes images straight into a reused uint8 batch buffer and converts the whole batch
+    to a normalized RGB float tensor at once. Gives the same input as preprocess.
+    The returned tensor shares memory with the buffers and is valid until the next put().
+    """
+    def __init__(self, size: int, device, max_batch_size: int) -> None:
+        self.size = size
+        self.device = torch.device(device)
+        self.max_batch_size = max_batch_size
+        self.buffer = np.full((max_batch_size, size, size, 3), 114, dtype=np.uint8)
+        self.buffer_tensor = torch.from_numpy(self.buffer)
+        # pinned host memory makes the copy to the device asynchronous
+        pin = self.device.type == 'cuda' and torch.cuda.is_available()
+        self.host = torch.empty((max_batch_size, 3, size, size), dtype=torch.float32, pin_memory=pin)
+        self.slot_shapes = [None] * max_batch_size
+
+    def put(self, index: int, img: np.ndarray):
+        shape = img.shape[:2]
+        new_unpad, top, left = _letterbox_geometry(shape, self.size)
+        if self.slot_shapes[index] != shape:
+            # padding is rewritten only when the geometry of the slot changes
+            self.buffer[index] = 114
+            self.slot_shapes[index] = shape
+        if shape[::-1] != new_unpad:
+            img = cv2.resize(img, new_unpad, interpolation=cv2.INTER_LINEAR)
+        self.buffer[index, top:top + new_unpad[1], left:left + new_unpad[0]] = img
+
+    def tensor(self, batch_size: int) -> torch.Tensor:
+        host = self.host[:batch_size]
+        # BGR HWC uint8 to RGB CHW float
+        for c in range(3):
+            host[:, c].copy_(self.buffer_tensor[:batch_size, :, :, 2 - c])
+        host.mul_(1 / 255)
+        return host.to(self.device, non_blocking=True)
+
+def preprocess_batch(imgs: list[np.ndarray], size: int, device) -> torch.Tensor:
+    preprocessor = BatchPreprocessor(size, device, len(imgs))
+    for idx, img in enumerate(imgs):
+        preprocessor.put(idx, img)
+    return preprocessor.tensor(len(imgs))
+
 def postprocess(preds, model_shape, image_shape, iou_threshold, conf_threshold, max_detections, agnostic=True):
     preds = ops.non_max_suppression(
         preds,
@@ -80,20 +185,77 @@ def postprocess(preds, model_shape, image_shape, iou_threshold, conf_threshold,
         agnostic=agnostic,
         max_det=max_detections)
 
-    for pred in preds:
-        pred[:, :4] = ops.scale_boxes(model_shape, pred[:, :4], image_shape).round()
+    for idx, pred in enumerate(preds):
+        # a list gives the original shape of each image in the batch
+        shape = image_shape[idx] if isinstance(image_shape, list) else image_shape
+        pred[:, :4] = ops.scale_boxes(model_shape, pred[:, :4], shape).round()
+
+    return to_host(preds)
+
+def to_host(preds: list[torch.Tensor]) -> list[np.ndarray]:
+    """
+    NMS output of a batch as (N, 6) arrays of x1, y1, x2, y2, conf, cls, moved to host memory in one transfer.
+    """
+    counts = [len(pred) for pred in preds]
+    if sum(counts) == 0:
+        return [np.zeros((0, 6), dtype=np.float32) for _ in preds]
+    data = torch.cat(preds).cpu().numpy()
+    return np.split(data, np.cumsum(counts)[:-1])
+
+def to_items(pred: np.ndarray) -> list[tuple[list[int], float, int]]:
+    # (xyxy, conf, cls) of each detection row
+    boxes = pred[:, :4].astype('uint').tolist()
+    confs = pred[:, 4].tolist()
+    classes = pred[:, 5].astype('uint').tolist()
+    return list(zip(boxes, confs, classes))
+
+def sort_by_x(pred: np.ndarray) -> np.ndarray:
+    return pred[np.argsort(pred[:, 0], kind='stable')]
+
+def infer(model, batch, image_shape, iou_threshold, conf_threshold, max_detections, postprocesss_func=postprocess):
+    # batch is a list of preprocessed images or a tensor of BatchPreprocessor
+    if model.task == 'detect':
+        batch_tensor = batch if isinstance(batch, torch.Tensor) else torch.stack(batch)
+        preds = model.forward(batch_tensor)
+        return postprocesss_func(preds, batch_tensor.shape[2:], image_shape, iou_threshold, conf_threshold, max_detections)
+    elif model.task == 'classify':
+        return model.predict(batch if isinstance(batch, torch.Tensor) else torch.stack(batch), verbose=False)
+    else:
+        raise Exception('invalid task')
+
+class DuplicateFrameDetector:
+    """
+    Tells whether a frame is nearly identical to the last inferred frame.
+    Frames are compared on a downscaled grayscale image by the largest mean difference of blocks,
+    so a small overlay appearing on a still scene is still detected as a change.
+    """
+    THUMB_SIZE = (160, 90)
+    BLOCKS = (16, 9)
 
-    return preds
+    def __init__(self, threshold: float) -> None:
+        self.threshold = threshold
+        self.last_thumb = None
 
-def toCpu(data):
-    *xyxy, conf, cls = data 
-    x1 = int(xyxy[0].cpu().numpy().astype('uint'))
-    y1 = int(xyxy[1].cpu().numpy().astype('uint'))
-    x2 = int(xyxy[2].cpu().numpy().astype('uint'))
-    y2 = int(xyxy[3].cpu().numpy().astype('uint'))
-    conf = float(conf.cpu().numpy().astype('float'))
-    cls = int(cls.cpu().numpy().astype('uint'))
-    return [x1, y1, x2, y2], conf, cls
+    def is_duplicate(self, img: np.ndarray) -> bool:
+        thumb = cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), self.THUMB_SIZE, interpolation=cv2.INTER_AREA)
+        if self.last_thumb is not None:
+            diff = cv2.resize(cv2.absdiff(thumb, self.last_thumb), self.BLOCKS, interpolation=cv2.INTER_AREA)
+            if np.max(diff) < self.threshold:
+                return True
+        # compare with the last inferred frame, not the previous one, so slow changes accumulate
+        self.last_thumb = thumb
+        return False
+
+def pred_boxes(pred, classes: list[int]=None) -> list[list[int]]:
+    if hasattr(pred, 'boxes'):
+        if pred.boxes is None:
+            return []
+    elif isinstance(pred, torch.Tensor):
+        pred = pred.cpu().numpy()
+    rows = detection_rows(pred)
+    if classes is not None:
+        rows = rows[np.isin(rows[:, 5], classes)]
+    return rows[:, :4].astype('uint').tolist()
 
 def run_prediction(
     name: str,
@@ -111,90 +273,219 @@ def run_prediction(
     make_prediction_completed_func,
     preprocess_func=preprocess,
     postprocesss_func=postprocess,
-    tracingEnabled: bool=False
+    tracingEnabled: bool=False,
+    frame_bus_id: int=None,
+    frame_bus_consumer: int=None,
+    crop_store_path: str=None,
+    crop_store_classes: list[int]=None,
+    streaming: bool=False,
+    duplicate_threshold: float=None,
+    idle_frame_interval: int=None,
+    active_window: int=None,
+    is_active_frame_func=None,
+    is_span_start_func=None,
+    is_span_end_func=None,
+    columnar: bool=False
 ):
+    bus = FrameBus.attach(frame_bus_id, frame_bus_consumer) if frame_bus_id is not None else None
+    crop_store = CropStore.create(crop_store_path) if crop_store_path is not None else None
     try:
         dev = torch.device(device) 
-        model = YOLO(model_path)
-        model.to(dev)
-        cap = cv2.VideoCapture(battle_movie_path)
-
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        end_frame = end_frame or total_frames - 1
+        model = ModelRegistry.get(model_path, device)
+        stream = None
+        if bus is not None:
+            cap = None
+            total_frames = bus.total_frames
+        elif streaming:
+            # movie is still downloading. total frames are known after the stream ends
+            cap = None
+            stream = MovieStream(battle_movie_path)
+            total_frames = None
+        else:
+            cap = cv2.VideoCapture(battle_movie_path)
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if end_frame is None and total_frames is not None:
+            end_frame = total_frames - 1
         
-        frame_number = start_frame
         frame_results = []
+        # detection rows by frame number for columnar results
+        frame_rows = {}
 
-        progs = { int((end_frame - start_frame) * r) // frame_interval: str(int(r*100)) for r in [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1]}
+        progs = { int((end_frame - start_frame) * r) // frame_interval: str(int(r*100)) for r in [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1]} if end_frame is not None else {}
         
         print(f'[{name}] process started. total frames: {total_frames}, start: {start_frame}, end: {end_frame}, batch_size: {batch_size}')
-        
-        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
 
         processing_time = time.time()
 
-        def _predict_batch(batch, frame_numbers):
+        # detections of the last inferred frame reused for following duplicate frames
+        duplicate_detector = DuplicateFrameDetector(duplicate_threshold) if duplicate_threshold is not None and not tracingEnabled else None
+        skipped_frames = []
+        pending_duplicates = []
+        last_pred = None
+        last_crop_rows = []
+
+        # adaptive sampling. frames are sampled every idle_frame_interval until an active frame is found,
+        # then at frame_interval for active_window frames. frames skipped just before are inferred afterwards.
+        # frames from a span start frame to a span end frame are all sampled at frame_interval
+        adaptive = idle_frame_interval is not None and is_active_frame_func is not None
+        idle_frames = deque(maxlen=max(1, idle_frame_interval // frame_interval)) if adaptive else None
+        active_until = -1
+        in_span = False
+        last_sampled = None
+        activated = False
+
+        # default preprocessing letterboxes frames into reused batch buffers
+        batched_preprocess = preprocess_func is preprocess and not tracingEnabled and model.task in ['detect', 'classify']
+        batch_preprocessor = BatchPreprocessor(model.imgsz, dev, batch_size) if batched_preprocess else None
+        idle_preprocessor = BatchPreprocessor(model.imgsz, dev, batch_size) if batched_preprocess and adaptive else None
+
+        def _predict_batch(batch, frame_numbers, images, flush=False, preprocessor=None):
+            nonlocal last_pred, last_crop_rows, pending_duplicates, active_until, activated, in_span
+            if preprocessor is not None:
+                batch = preprocessor.tensor(len(batch))
             if tracingEnabled:
                 preds = model.track(batch, persist=True, conf=conf_threshold, iou=iou_threshold, verbose=False, tracker='bytetrack.yaml')
-            elif model.task == 'detect':
-                batch_tensor = torch.stack(batch)
-                preds = model.model(batch_tensor)
-                preds = postprocesss_func(preds, batch_tensor.shape[2:], img.shape, iou_threshold, conf_threshold, max_detections)
-            elif model.task == 'classify':
-                preds = model.predict(torch.stack(batch), verbose=False)
             else:
-                raise Exception('invalid task')
+                preds = infer(model, batch, img.shape, iou_threshold, conf_threshold, max_detections, postprocesss_func)
 
             for idx, pred in enumerate(preds):
                 frame = make_frame_result_func(pred, frame_numbers[idx], img)
                 frame_results.append(frame)
+                if columnar:
+                    frame_rows[frame.frame] = detection_rows(pred)
+                crop_rows = []
+                if crop_store is not None:
+                    # keep detected boxes so later stages slice them without decoding the movie
+                    for xyxy in pred_boxes(pred, crop_store_classes):
+                        row = crop_store.append(frame_numbers[idx], xyxy, images[idx])
+                        if row is not None:
+                            crop_rows.append(row)
+                if not flush:
+                    # duplicates of this frame follow it in frame order
+                    for dup_frame_number, slot in pending_duplicates:
+                        if slot == idx:
+                            frame_results.append(make_frame_result_func(pred, dup_frame_number, img))
+                            if columnar:
+                                frame_rows[dup_frame_number] = frame_rows[frame.frame]
+                            if crop_store is not None:
+                                crop_store.alias(dup_frame_number, crop_rows)
+                if adaptive and is_active_frame_func(frame):
+                    active_until = max(active_until, frame_numbers[idx] + active_window)
+                    activated = True
+                if adaptive and is_span_start_func is not None and is_span_start_func(frame):
+                    in_span = True
+                    activated = True
+                if adaptive and is_span_end_func is not None and is_span_end_func(frame):
+                    in_span = False
+            if flush:
+                return
+            last_pred = preds[-1]
+            last_crop_rows = crop_rows
+            pending_duplicates = []
+
+        def _to_input(img, index, preprocessor):
+            if tracingEnabled:
+                return img.copy() if bus is not None else img # bus slot is reused after this iteration
+            elif preprocessor is not None:
+                preprocessor.put(index, img)
+                return index
+            elif model.task in ['detect', 'classify']:
+                return preprocess_func(img, model.imgsz, dev, to_4d=False)
+            else:
+                raise Exception('invalid task')
+
+        def _flush_idle_frames():
+            nonlocal activated
+            activated = False
+            while len(idle_frames) > 0:
+                flush_frames = [idle_frames.popleft() for _ in range(min(batch_size, len(idle_frames)))]
+                _predict_batch(
+                    [_to_input(i, idx, idle_preprocessor) for idx, (_, i) in enumerate(flush_frames)],
+                    [f for f, _ in flush_frames],
+                    [i for _, i in flush_frames] if crop_store is not None else [],
+                    flush=True,
+                    preprocessor=idle_preprocessor
+                )
+
+        if bus is not None:
+            # frames are decoded once by the decoder process and shared with other detectors
+            frames = bus.frames(frame_bus_consumer, start_frame, end_frame)
+        elif stream is not None:
+            frames = stream.frames(start_frame, end_frame, frame_interval)
+        else:
+            frames = read_frames(cap, start_frame, end_frame, frame_interval)
 
         input_batch = []
         frame_numbers = []
-        while True:
-            ret = cap.grab()
-            if not ret or end_frame < frame_number:
-                break
-            
-            if frame_number % frame_interval != 0:
-                frame_number += 1
-                continue
+        batch_images = []
 
-            ret, img = cap.retrieve()
-            if not ret:
-                break
-
-            if tracingEnabled:
-                input_batch.append(img)
-                frame_numbers.append(frame_number)
-            elif model.task == 'detect':
-                input = preprocess_func(img, model.overrides['imgsz'], dev, to_4d=False)
-                input_batch.append(input)
-                frame_numbers.append(frame_number)
-            elif model.task == 'classify':
-                input = preprocess_func(img, model.overrides['imgsz'], dev, to_4d=False)
-                input_batch.append(input)
-                frame_numbers.append(frame_number)
+        def _predict_input_batch():
+            nonlocal input_batch, frame_numbers, batch_images
+            _predict_batch(input_batch, frame_numbers, batch_images, preprocessor=batch_preprocessor)
+            input_batch = []
+            frame_numbers = []
+            batch_images = []
+            if adaptive and activated:
+                _flush_idle_frames()
 
-            if len(input_batch) == batch_size:
-                _predict_batch(input_batch, frame_numbers)
-                input_batch = []
-                frame_numbers = []
+        def _is_idle(frame_number: int) -> bool:
+            return adaptive and not in_span and active_until < frame_number and last_sampled is not None and frame_number - last_sampled < idle_frame_interval
 
+        for frame_number, img in frames:
             if frame_number in progs:
                 print(f'progress ({name}): {progs[frame_number]}%')
 
-            frame_number += 1
+            if _is_idle(frame_number) and len(idle_frames) == idle_frames.maxlen and len(input_batch) > 0:
+                # samples waiting in the batch tell whether the oldest skipped frame is needed. infer them before it is evicted
+                _predict_input_batch()
+            if _is_idle(frame_number):
+                idle_frames.append((frame_number, img.copy() if bus is not None else img))
+                continue
+            last_sampled = frame_number
+
+            if duplicate_detector is not None and duplicate_detector.is_duplicate(img):
+                skipped_frames.append(frame_number)
+                if len(input_batch) > 0:
+                    # duplicate of the last frame put in the batch
+                    pending_duplicates.append((frame_number, len(input_batch) - 1))
+                else:
+                    frame_results.append(make_frame_result_func(last_pred, frame_number, img))
+                    if columnar and last_pred is not None:
+                        frame_rows[frame_number] = detection_rows(last_pred)
+                    if crop_store is not None:
+                        crop_store.alias(frame_number, last_crop_rows)
+                continue
+
+            if crop_store is not None:
+                batch_images.append(img.copy() if bus is not None else img)
+            input_batch.append(_to_input(img, len(input_batch), batch_preprocessor))
+            frame_numbers.append(frame_number)
+
+            if len(input_batch) == batch_size:
+                _predict_input_batch()
         
         if len(input_batch) > 0:
-            _predict_batch(input_batch, frame_numbers)
-            input_batch = []
-            frame_numbers = []
+            _predict_input_batch()
 
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        cap.release()
+        if adaptive:
+            frame_results.sort(key=lambda f: f.frame)
+
+        if bus is not None:
+            width = bus.width
+            height = bus.height
+        elif stream is not None:
+            width = stream.width
+            height = stream.height
+            total_frames = stream.frame_count
+            end_frame = end_frame if end_frame is not None else total_frames - 1
+        else:
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            cap.release()
         
+        if columnar:
+            frame_results = ColumnarFrames.from_rows([f.frame for f in frame_results], [frame_rows[f.frame] for f in frame_results], make_frame_result_func)
+
         det_result= make_prediction_completed_func(
             width,
             height,
@@ -205,6 +496,9 @@ def run_prediction(
             frame_results,
             round(time.time() - processing_time)
         )
+        det_result.skipped_frames = skipped_frames
+        if duplicate_detector is not None:
+            print(f'[{name}] skipped {len(skipped_frames)} duplicate frames of {len(frame_results)}')
         
         print(f'[{name}] process ended. start: {start_frame}, end: {end_frame}, batch_size: {batch_size}')
 
@@ -212,6 +506,12 @@ def run_prediction(
     except Exception as e:
         print(e)
         return None
+    finally:
+        if bus is not None:
+            bus.detach(frame_bus_consumer)
+            bus.release()
+        if crop_store is not None:
+            crop_store.close()
     
 def run_parallel(
     workers: int,
@@ -230,7 +530,8 @@ def run_parallel(
     make_prediction_completed_func,
     preprocess_func=preprocess,
     postprocesss_func=postprocess,
-    tracingEnabled: bool=False
+    tracingEnabled: bool=False,
+    columnar: bool=False
 ):
     cap = cv2.VideoCapture(battle_movie_path)
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
@@ -272,7 +573,8 @@ def run_parallel(
                 make_prediction_completed_func,
                 preprocess_func,
                 postprocesss_func,
-                tracingEnabled
+                tracingEnabled,
+                columnar=columnar
             ))
 
         worker_results = []
@@ -283,7 +585,10 @@ def run_parallel(
                 worker_results.append(result)
                 
     worker_results.sort(key=lambda r: r.start_frame)
-    total_result.frames = list(chain(*list(map(lambda r: r.frames, worker_results))))
+    if columnar:
+        total_result.frames = ColumnarFrames.concat([r.frames for r in worker_results])
+    else:
+        total_result.frames = list(chain(*list(map(lambda r: r.frames, worker_results))))
     total_result.image_width = worker_results[0].image_width
     total_result.image_height = worker_results[0].image_height
     total_result.start_frame = worker_results[0].start_frame
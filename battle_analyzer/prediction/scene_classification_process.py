@@ -0,0 +1,158 @@
+from dataclasses import dataclass
+from enum import Enum
+from prediction.shared_memory import SharedMemory
+from prediction.prediction_process import PredictionResultBase, run_prediction
+from prediction.frame import Frame
+
+class SceneType(Enum):
+    OTHER = 0
+    LOBBY = 1
+    BATTLE = 2
+    RESULT = 3
+    MENU = 4
+
+cls_scene_map = {
+    'other': SceneType.OTHER,
+    'lobby': SceneType.LOBBY,
+    'battle': SceneType.BATTLE,
+    'result': SceneType.RESULT,
+    'menu': SceneType.MENU
+}
+
+@dataclass
+class SceneClassificationFrame(Frame):
+    scene: SceneType
+    conf: float
+
+    @classmethod
+    def from_json(cls, j):
+        return cls(
+            scene=SceneType(j['scene']),
+            conf=j['conf'],
+            frame=j['frame'],
+            image=None
+        )
+
+@dataclass
+class SceneClassificationResult(PredictionResultBase):
+    frames: [SceneClassificationFrame]
+
+    @classmethod
+    def from_json(cls, j):
+        return cls(
+            image_width=j['image_width'],
+            image_height=j['image_height'],
+            total_frames=j['total_frames'],
+            start_frame=j['start_frame'],
+            end_frame=j['end_frame'],
+            frame_interval=j['frame_interval'],
+            frames=[SceneClassificationFrame.from_json(i) if i is not None else None for i in j['frames']],
+            processing_time=j['processing_time'],
+            skipped_frames=j.get('skipped_frames', [])
+        )
+
+class SharedSceneClassificationResult(SharedMemory):
+    SHM_NAME = 'shared_scene'
+
+def make_frame_result(pred, frame: int, _) -> SceneClassificationFrame:
+    cls = pred.names[pred.probs.top1]
+    return SceneClassificationFrame(
+        scene=cls_scene_map.get(cls, SceneType.OTHER),
+        conf=float(pred.probs.top1conf),
+        frame=frame,
+        image=None
+    )
+
+def make_detection_completed(
+    width: int,
+    height: int,
+    total_frames: int,
+    start_frame: int,
+    end_frame: int,
+    frame_interval: int,
+    frame_results: list[SceneClassificationFrame],
+    processing_time: int
+   ) -> SceneClassificationResult:
+    return SceneClassificationResult(
+        image_width=width,
+        image_height=height,
+        total_frames=total_frames,
+        start_frame=start_frame,
+        end_frame=end_frame,
+        frame_interval=frame_interval,
+        frames=frame_results,
+        processing_time=processing_time
+    )
+
+def find_battle_spans(result: SceneClassificationResult, padding: int, merge_gap: int, min_frames: int) -> list[tuple[int, int]]:
+    """
+    Frame ranges from the first battle frame to the last battle or result frame of each battle, with padding.
+    Battle runs separated by less than merge_gap frames are joined so a few misclassified frames do not split a battle.
+    """
+    runs = []
+    for frame in result.frames:
+        if frame is None or frame.scene not in [SceneType.BATTLE, SceneType.RESULT]:
+            continue
+        if len(runs) > 0 and frame.frame - runs[-1][1] <= merge_gap:
+            runs[-1][1] = frame.frame
+        elif frame.scene == SceneType.BATTLE:
+            # a result screen never starts a battle
+            runs.append([frame.frame, frame.frame])
+
+    spans = []
+    last_frame = result.total_frames - 1 if result.total_frames is not None else None
+    for start, end in runs:
+        if end - start < min_frames:
+            continue
+        span_start = max(0, start - padding)
+        span_end = end + padding if last_frame is None else min(last_frame, end + padding)
+        if len(spans) > 0 and span_start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], span_end)
+        else:
+            spans.append((span_start, span_end))
+    return spans
+
+def run_scene_classification(
+    battle_movie_path: str,
+    scene_model_path: str,
+    frame_interval: int,
+    device: str,
+    process_id: int,
+    batch_size: int,
+    start_frame: int=0,
+    end_frame: int=None
+):
+    result = run_prediction(
+        name='scene',
+        battle_movie_path=battle_movie_path,
+        model_path=scene_model_path,
+        start_frame=start_frame,
+        end_frame=end_frame,
+        frame_interval=frame_interval,
+        device=device,
+        batch_size=batch_size,
+        iou_threshold=0.25,
+        conf_threshold=0.3,
+        max_detections=1,
+        make_frame_result_func=make_frame_result,
+        make_prediction_completed_func=make_detection_completed
+    )
+
+    SharedSceneClassificationResult.set_id(process_id)
+    SharedSceneClassificationResult.write(result)
+
+    return result
+
+if __name__ == '__main__':
+    SharedSceneClassificationResult.reset()
+
+    battle_movie_path = './videos/test/2023070915221600-4CE9651EE88A979D41F24CE8D6EA1C23.mp4'
+    result = run_scene_classification(
+        battle_movie_path=battle_movie_path,
+        scene_model_path='./models/scene/best.pt',
+        frame_interval=60,
+        device='mps',
+        process_id=0,
+        batch_size=8
+    )
+    print(find_battle_spans(result, padding=1800, merge_gap=600, min_frames=1800))
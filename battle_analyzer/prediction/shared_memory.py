@@ -1,12 +1,17 @@
 from multiprocessing import shared_memory
 import pickle
-import numpy as np
 
 class SharedMemory:
+    """
+    Passes one result object between processes.
+    The segment is sized to the serialized result and recreated larger when a result does not fit.
+    [pickle size(8bytes)][buffer count(8bytes)][buffer sizes(8bytes each)][pickle data][out-of-band buffers]
+    """
     SHM_NAME = 'shared_memory'
-    SHM_SIZE = 1024 * 1024 * 1024
     SHM_ID = 0
     SHM_BUF = None
+    HEADER_SIZE = 16
+    INT_SIZE = 8
 
     @classmethod
     def set_id(cls, shm_id: int):
@@ -17,14 +22,16 @@ class SharedMemory:
         return f'{cls.SHM_NAME}_{cls.SHM_ID}'
 
     @classmethod
-    def create(cls):
-       cls.SHM_BUF = shared_memory.SharedMemory(create=True, size=cls.SHM_SIZE, name=cls.unique_shm_name())
-    
+    def create(cls, size: int=HEADER_SIZE):
+        cls.SHM_BUF = shared_memory.SharedMemory(create=True, size=size, name=cls.unique_shm_name())
+        # zero sizes read as no result
+        cls.SHM_BUF.buf[:cls.HEADER_SIZE] = bytes(cls.HEADER_SIZE)
+
     @classmethod
-    def clear(cls): 
+    def clear(cls):
         shared_memory.SharedMemory(name=cls.unique_shm_name()).unlink()
         cls.SHM_BUF = None
-    
+
     @classmethod
     def reset(cls):
         try:
@@ -32,35 +39,64 @@ class SharedMemory:
         except:
             pass
         cls.create()
-    
+
     @classmethod
     def write(cls, data: any):
-        serialized = cls.serialize(data)
-        arr = np.array([serialized])
-        shm = shared_memory.SharedMemory(name=cls.unique_shm_name())
-        narr = np.ndarray((1,), dtype=f'S{cls.SHM_SIZE}', buffer=shm.buf)
-        narr[:] = arr[:]
+        buffers = []
+        # protocol 5 leaves large buffers such as numpy arrays out of the pickle, so they are copied once
+        b = pickle.dumps(data, protocol=5, buffer_callback=buffers.append)
+        raws = [buf.raw() for buf in buffers]
+        header = [len(b), len(raws)] + [raw.nbytes for raw in raws]
+        total_size = cls.HEADER_SIZE + cls.INT_SIZE * len(raws) + len(b) + sum(raw.nbytes for raw in raws)
+
+        try:
+            shm = shared_memory.SharedMemory(name=cls.unique_shm_name())
+        except FileNotFoundError:
+            shm = None
+        if shm is None or shm.size < total_size:
+            # grow on demand. readers open the segment by name after the writer is done
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            shm = shared_memory.SharedMemory(create=True, size=total_size, name=cls.unique_shm_name())
+
+        pos = 0
+        for value in header:
+            shm.buf[pos:pos + cls.INT_SIZE] = value.to_bytes(cls.INT_SIZE, 'big')
+            pos += cls.INT_SIZE
+        shm.buf[pos:pos + len(b)] = b
+        pos += len(b)
+        for raw in raws:
+            shm.buf[pos:pos + raw.nbytes] = raw
+            pos += raw.nbytes
+        for raw in raws:
+            raw.release()
+        shm.close()
 
     @classmethod
     def read(cls):
         shm = shared_memory.SharedMemory(name=cls.unique_shm_name())
-        narr = np.ndarray((1,), dtype=f'S{cls.SHM_SIZE}', buffer=shm.buf)
-        b = bytes(narr)
-        obj_size = int.from_bytes(b[:4], 'big')
-        obj = pickle.loads(b[4:obj_size + 4]) if obj_size > 0 else None
-        return obj
-
-    @classmethod
-    def serialize(cls, data) -> bytes:
-        """
-        Serialize ikalamps to fixed size bytes.
-        [total_size(4bytes)][total_items(4bytes)][pkl_size(4bytes)][pkl_data]...[padding]
-        """
-
-        b = pickle.dumps(data)
-        obj_size = len(b).to_bytes(4, 'big')
-        b = obj_size + b
-        if len(b) > cls.SHM_SIZE:
-            raise Exception(f'size of serialized data exceeds max memory size: {len(b)}')
-        b = b.ljust(cls.SHM_SIZE, b'0')
-        return b
\ No newline at end of file
+        try:
+            buf = shm.buf
+            obj_size = int.from_bytes(buf[:cls.INT_SIZE], 'big')
+            if obj_size == 0:
+                return None
+            buffer_count = int.from_bytes(buf[cls.INT_SIZE:cls.HEADER_SIZE], 'big')
+            pos = cls.HEADER_SIZE
+            buffer_sizes = []
+            for _ in range(buffer_count):
+                buffer_sizes.append(int.from_bytes(buf[pos:pos + cls.INT_SIZE], 'big'))
+                pos += cls.INT_SIZE
+            data = buf[pos:pos + obj_size]
+            pos += obj_size
+            # only the payload is read. out-of-band buffers are copied since the segment is closed after reading
+            buffers = []
+            for size in buffer_sizes:
+                buffers.append(bytearray(buf[pos:pos + size]))
+                pos += size
+            obj = pickle.loads(data, buffers=buffers)
+            data.release()
+            buf.release()
+            return obj
+        finally:
+            shm.close()
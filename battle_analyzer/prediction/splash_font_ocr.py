@@ -1,12 +1,19 @@
-import torch
+import copy
+import os
 import numpy as np
-from ultralytics import YOLO
-from prediction.prediction_process import preprocess, postprocess
+from prediction.prediction_process import preprocess_batch, postprocess, to_items, sort_by_x
 from prediction.cls_to_char import hiragana_map, katakana_map, number_map, alphabet_map, symbol_map, greek_map, rusian_map, diacritical_map
 from models.text import Char, CharType
 from models.detected_item import DetectedItem
+from utils import OCRCache
+from prediction.batch_broker import ModelBroker
 
 class SplashFontOCR:
+    # crops detected in one forward pass of the char type model
+    DETECTION_BATCH_SIZE = 32
+    # tier shared by all battles analyzed in the process. disabled unless OCR_SHARED_CACHE_ENTRIES is set
+    shared_cache = OCRCache(int(os.environ['OCR_SHARED_CACHE_ENTRIES'])) if int(os.environ.get('OCR_SHARED_CACHE_ENTRIES', 0)) > 0 else None
+
     def __init__(self,
         char_type_model_path: str,
         hiragana_model_path: str,
@@ -15,75 +22,92 @@ class SplashFontOCR:
         alphabet_model_path: str,
         symbol_model_path: str,
         char_model_path: str,
-        device: str
+        device: str,
+        cache: OCRCache=None
         ) -> None:
-        dev = torch.device(device)
-        self.char_type_model = YOLO(char_type_model_path)
-        self.char_type_model.to(dev)
-        self.hiragana_model = YOLO(hiragana_model_path)
-        self.hiragana_model.to(dev)
-        self.katakana_model = YOLO(katakana_model_path)
-        self.katakana_model.to(dev)
-        self.number_model = YOLO(number_model_path)
-        self.number_model.to(dev)
-        self.alphabet_model = YOLO(alphabet_model_path)
-        self.alphabet_model.to(dev)
-        self.symbol_model = YOLO(symbol_model_path)
-        self.symbol_model.to(dev)
-        self.char_model = YOLO(char_model_path)
-        self.char_model.to(dev)
+        self.cache = cache
+        self.char_type_model = ModelBroker.get(char_type_model_path, device)
+        self.hiragana_model = ModelBroker.get(hiragana_model_path, device)
+        self.katakana_model = ModelBroker.get(katakana_model_path, device)
+        self.number_model = ModelBroker.get(number_model_path, device)
+        self.alphabet_model = ModelBroker.get(alphabet_model_path, device)
+        self.symbol_model = ModelBroker.get(symbol_model_path, device)
+        self.char_model = ModelBroker.get(char_model_path, device)
 
     def get_text(self, img: np.ndarray, line_break: bool=False) -> list[Char]:
-        char_items = self._detect_chars(img)
-        chars = self._classify(img, char_items)
-        return self._line_break(chars) if line_break else chars
+        return self.get_texts([img], line_break)[0]
+
+    def get_texts(self, imgs: list[np.ndarray], line_break: bool=False) -> list[list[Char]]:
+        """
+        get_text for many crops. chars of all crops are detected and classified in batches.
+        """
+        if len(imgs) == 0:
+            return []
+        chars_list = self._cached_read('text', imgs, self._read_texts)
+        return [self._line_break(chars) if line_break and chars is not None else chars for chars in chars_list]
     
     def get_hiragara_text(self, img: np.ndarray, line_break: bool=False) -> list[Char]:
-        char_items = self._detect_chars(img)
-        chars = self._classify_char(img, char_items, CharType.HIRAGANA, self.hiragana_model, hiragana_map)
+        chars = self._get_typed_text(img, CharType.HIRAGANA, self.hiragana_model, hiragana_map)
         return self._line_break(chars) if line_break else chars
     
     def get_katakana_text(self, img: np.ndarray, line_break: bool=False) -> list[Char]:
-        char_items = self._detect_chars(img)
-        chars = self._classify_char(img, char_items, CharType.KATAKANA, self.katakana_model, katakana_map)
+        chars = self._get_typed_text(img, CharType.KATAKANA, self.katakana_model, katakana_map)
         return self._line_break(chars) if line_break else chars
     
     def get_number_text(self, img: np.ndarray, line_break: bool=False) -> list[Char]:
-        char_items = self._detect_chars(img)
-        chars = self._classify_char(img, char_items, CharType.NUMBER, self.number_model, number_map)
+        chars = self._get_typed_text(img, CharType.NUMBER, self.number_model, number_map)
         return self._line_break(chars) if line_break else chars
     
     def get_alphabet_text(self, img: np.ndarray, line_break: bool=False) -> list[Char]:
-        char_items = self._detect_chars(img)
-        chars = self._classify_char(img, char_items, CharType.ALPHABET, self.alphabet_model, alphabet_map)
+        chars = self._get_typed_text(img, CharType.ALPHABET, self.alphabet_model, alphabet_map)
         return self._line_break(chars) if line_break else chars
 
     def get_symbol_text(self, img: np.ndarray, line_break: bool=False) -> list[Char]:
-        char_items = self._detect_chars(img)
-        chars = self._classify_char(img, char_items, CharType.SYMBOL, self.symbol_model, symbol_map)
+        chars = self._get_typed_text(img, CharType.SYMBOL, self.symbol_model, symbol_map)
         return self._line_break(chars) if line_break else chars
+
+    def _get_typed_text(self, img: np.ndarray, char_type: CharType, model: ModelBroker, cls_to_char: dict) -> list[Char]:
+        read = lambda imgs: [self._classify_char(i, self._detect_chars(i), char_type, model, cls_to_char) for i in imgs]
+        return self._cached_read(char_type.name, [img], read)[0]
+
+    def _read_texts(self, imgs: list[np.ndarray]) -> list[list[Char]]:
+        char_items_list = []
+        for i in range(0, len(imgs), self.DETECTION_BATCH_SIZE):
+            char_items_list.extend(self._detect_chars_batch(imgs[i:i + self.DETECTION_BATCH_SIZE]))
+        return self._classify_batch(imgs, char_items_list)
+
+    def _cached_read(self, kind: str, imgs: list[np.ndarray], read_func) -> list[list[Char]]:
+        if self.cache is None:
+            return read_func(imgs)
+        keys = [OCRCache.crop_key(kind, img) for img in imgs]
+        results = [self.cache.get(key) for key in keys]
+        # the same crop repeated in a batch is read once
+        missing = {}
+        for idx, (key, chars) in enumerate(zip(keys, results)):
+            if chars is None and key not in missing:
+                missing[key] = idx
+        if len(missing) > 0:
+            read = dict(zip(missing.keys(), read_func([imgs[idx] for idx in missing.values()])))
+            for key, chars in read.items():
+                if chars is not None:
+                    self.cache.put(key, chars)
+            results = [chars if chars is not None else read[key] for key, chars in zip(keys, results)]
+        # callers shift char boxes in place. never hand out the cached objects
+        return [copy.deepcopy(chars) for chars in results]
     
     def _detect_chars(self, img) -> list[DetectedItem]:
-        input = preprocess(img, self.char_type_model.overrides['imgsz'], self.char_type_model.device)
-        preds = self.char_type_model.model(input)
-        preds = postprocess(preds, input.shape[2:], img.shape, 0.25, 0.1, 1000)
-        chars = []
-        for *xyxy, conf, cls in preds[0]:
-            x1 = int(xyxy[0].cpu().numpy().astype('uint'))
-            y1 = int(xyxy[1].cpu().numpy().astype('uint'))
-            x2 = int(xyxy[2].cpu().numpy().astype('uint'))
-            y2 = int(xyxy[3].cpu().numpy().astype('uint'))
-            conf = float(conf.cpu().numpy().astype('float'))
-            cls = int(cls.cpu().numpy().astype('uint'))
-            chars.append(DetectedItem(
-                [x1, y1, x2, y2],
-                conf,
-                cls
-            ))
-        chars = sorted(chars, key=lambda c: c.xyxy[0])
-        return chars
+        return self._detect_chars_batch([img])[0]
+
+    def _detect_chars_batch(self, imgs: list[np.ndarray]) -> list[list[DetectedItem]]:
+        input = preprocess_batch(imgs, self.char_type_model.imgsz, self.char_type_model.device)
+        preds = self.char_type_model.forward(input)
+        preds = postprocess(preds, input.shape[2:], [img.shape for img in imgs], 0.25, 0.1, 1000)
+        return [self._to_char_items(pred) for pred in preds]
+
+    def _to_char_items(self, pred) -> list[DetectedItem]:
+        return [DetectedItem(xyxy, conf, cls) for xyxy, conf, cls in to_items(sort_by_x(pred))]
     
-    def _classify_char(self, img: np.ndarray, char_items: list[DetectedItem], char_type: CharType, model: YOLO, cls_to_char: dict) -> list[Char]:
+    def _classify_char(self, img: np.ndarray, char_items: list[DetectedItem], char_type: CharType, model: ModelBroker, cls_to_char: dict) -> list[Char]:
         if model is None:
             raise Exception('char model not loaded')
 
@@ -102,12 +126,24 @@ class SplashFontOCR:
         return chars
     
     def _classify(self, img: np.ndarray, char_items: list[DetectedItem]) -> list[Char]:
-        char_items = list(filter(lambda i: i.xyxy[0] < i.xyxy[2] and i.xyxy[1] < i.xyxy[3], char_items))
-        char_imgs =[img[item.xyxy[1]:item.xyxy[3],item.xyxy[0]:item.xyxy[2]] for item in char_items]
+        return self._classify_batch([img], [char_items])[0]
+
+    def _classify_batch(self, imgs: list[np.ndarray], char_items_list: list[list[DetectedItem]]) -> list[list[Char]]:
+        # chars of all crops go to the classifier at once and are split back per crop
+        char_items_list = [list(filter(lambda i: i.xyxy[0] < i.xyxy[2] and i.xyxy[1] < i.xyxy[3], char_items)) for char_items in char_items_list]
+        char_imgs = [img[item.xyxy[1]:item.xyxy[3],item.xyxy[0]:item.xyxy[2]] for img, char_items in zip(imgs, char_items_list) for item in char_items]
         if len(char_imgs) == 0:
-            return []
-        
+            return [[] for _ in imgs]
+
         preds = self.char_model.predict(char_imgs, verbose=False)
+        chars_list = []
+        pos = 0
+        for char_items in char_items_list:
+            chars_list.append(self._to_chars(preds[pos:pos + len(char_items)], char_items))
+            pos += len(char_items)
+        return chars_list
+
+    def _to_chars(self, preds, char_items: list[DetectedItem]) -> list[Char]:
         chars = []
         for idx, pred in enumerate(preds):
             char_cls = pred.names[pred.probs.top1]
@@ -1,37 +1,42 @@
-import torch
-from ultralytics import YOLO
+from concurrent.futures import Future
+from ultralytics.data.augment import LetterBox
 from models.battle import BattleStage
 from prediction.frame_classifier import FrameClassifier
 from prediction.frame import Frame
-from prediction.prediction_process import preprocess, postprocess
-from utils import MovieReader
+from prediction.prediction_process import preprocess_batch, postprocess
+from utils import FrameRequestPlanner
+from prediction.model_registry import ModelRegistry
 
 class StageFrameClassifier:
     def __init__(self,
         battle_movie_path: str,
         model_path: str,
-        device: str) -> None:
-        dev = torch.device(device)
-        self.model = YOLO(model_path)
-        self.model.to(dev)
+        device: str,
+        planner: FrameRequestPlanner) -> None:
+        self.model = ModelRegistry.get(model_path, device)
         self.battle_movie_path = battle_movie_path
+        self.planner = planner
 
-    def classify(self, frames: list[Frame]) -> dict[int,BattleStage]:
-        reader = MovieReader(self.battle_movie_path)
-        stage_object_count = {}
-        input_batch = []
-        for frame in frames:
-            img = reader.read(frame.frame)
-            input = preprocess(img , self.model.overrides['imgsz'], self.model.device, to_4d=False)
-            input_batch.append(input)
+    def request(self, frames: list[Frame]) -> list[Future]:
+        # letterboxed when read, so full frames are not kept until classification
+        letterbox = LetterBox((self.model.imgsz, self.model.imgsz))
+        return [self.planner.request(frame.frame, transform=lambda img: letterbox(image=img)) for frame in frames]
+
+    def classify(self, frames: list[Frame]) -> BattleStage:
+        requests = self.request(frames)
+        self.planner.run()
+        return self.classify_requested(requests)
 
-        batch_tensor = torch.stack(input_batch)
-        preds = self.model.model(batch_tensor)
+    def classify_requested(self, requests: list[Future]) -> BattleStage:
+        stage_object_count = {}
+        imgs = [request.result() for request in requests]
+        img = imgs[-1]
+        batch_tensor = preprocess_batch(imgs, self.model.imgsz, self.model.device)
+        preds = self.model.forward(batch_tensor)
         preds = postprocess(preds, batch_tensor.shape[2:], img.shape, 0.25, 0.2, 100)
         for pred in preds:
-            for *xyxy, conf, cls in pred:
+            for cls in pred[:, 5].astype('uint').tolist():
                 stage = BattleStage.UNKNOWN
-                cls = int(cls.cpu().numpy().astype('uint'))
                 if cls == 0: # 'stage_amabi_onion'
                     stage = BattleStage.AMABI
                 elif cls == 1: # 'stage_cyozame_drop'
@@ -101,7 +106,6 @@ class StageFrameClassifier:
                     else:
                         stage_object_count[stage] += 1
 
-        reader.release()
         if len(stage_object_count) == 0:
             return None
         else:
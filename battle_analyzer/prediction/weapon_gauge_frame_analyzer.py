@@ -1,13 +1,12 @@
 from dataclasses import dataclass
-import torch
 import numpy as np
-from ultralytics import YOLO
 from models.buki import SubWeapon, SpecialWeapon
 from prediction.frame import Frame
 from prediction.sub_weapon_frame_classifier import SubWeaponFrameClassifier
 from prediction.special_weapon_frame_classifier import SpecialWeaponFrameClassifier
-from prediction.prediction_process import preprocess, postprocess, toCpu
+from prediction.prediction_process import preprocess, postprocess, to_items
 from utils import MovieReader, are_overlapping
+from prediction.model_registry import ModelRegistry
 
 class WeaponGaugeFrameAnalyzer:
     def __init__(self,
@@ -17,8 +16,7 @@ class WeaponGaugeFrameAnalyzer:
         sp_weapon_classifier: SpecialWeaponFrameClassifier,
         device: str) -> None:
         self.battle_movie_path = battle_movie_path
-        self.gauge_model = YOLO(weapon_gauge_model_path)
-        self.gauge_model.to(torch.device(device))
+        self.gauge_model = ModelRegistry.get(weapon_gauge_model_path, device)
         self.sub_weapon_classifier = sub_weapon_classifier
         self.sp_weapon_classifier = sp_weapon_classifier
 
@@ -29,16 +27,15 @@ class WeaponGaugeFrameAnalyzer:
         reader = MovieReader(self.battle_movie_path)
         for frame in frames:
             img = reader.read(frame.frame)
-            input = preprocess(img, self.gauge_model.overrides['imgsz'], self.gauge_model.device)
-            preds = self.gauge_model.model(input)
+            input = preprocess(img, self.gauge_model.imgsz, self.gauge_model.device)
+            preds = self.gauge_model.forward(input)
             preds = postprocess(preds, input.shape[2:], img.shape, 0.25, 0.4, 100, agnostic=False)[0]
 
             is_dup = True
             gauge_xyxy = None 
             sub_xyxy = None
             sp_xyxy = None
-            for data in preds:
-                xyxy, conf, cls = toCpu(data)
+            for xyxy, conf, cls in to_items(preds):
                 if cls == 0:
                     if gauge_xyxy is not None:
                         is_dup = False
@@ -1,3 +1,4 @@
+import sys
 import unittest
 import multiprocessing
 from log import create_prod_logger
@@ -24,6 +25,16 @@ from tests.test_battle_stage_takaashi import add_tests as add_stage_takaashi
 from tests.test_battle_stage_sumeshi import add_tests as add_stage_sumeshi
 from tests.test_battle_stage_taraport import add_tests as add_stage_taraport
 from tests.test_battle_stage_yagara import add_tests as add_stage_yagara
+from tests.test_movie_stream import add_tests as add_movie_stream
+from tests.test_frame_bus import add_tests as add_frame_bus
+from tests.test_movie_reader import add_tests as add_movie_reader
+from tests.test_inference_backend import add_tests as add_inference_backend
+from tests.test_target_frames import add_tests as add_target_frames
+from tests.test_frame_request_planner import add_tests as add_frame_request_planner
+from tests.test_duplicate_frames import add_tests as add_duplicate_frames
+from tests.test_adaptive_sampling import add_tests as add_adaptive_sampling
+from tests.test_model_registry import add_tests as add_model_registry
+from tests.test_crop_store import add_tests as add_crop_store
 
 if __name__ == '__main__':
     init()
@@ -58,5 +69,22 @@ if __name__ == '__main__':
     add_stage_taraport(suite)
     add_stage_yagara(suite)
 
+    # ingestion
+    add_movie_stream(suite)
+    add_frame_bus(suite)
+    add_movie_reader(suite)
+
+    # inference
+    add_inference_backend(suite)
+    add_duplicate_frames(suite)
+    add_adaptive_sampling(suite)
+    add_model_registry(suite)
+    add_crop_store(suite)
+
+    # events
+    add_target_frames(suite)
+    add_frame_request_planner(suite)
+
     runner = unittest.TextTestRunner(failfast=False)
-    result = runner.run(suite)
\ No newline at end of file
+    result = runner.run(suite)
+    sys.exit(0 if result.wasSuccessful() else 1)
\ No newline at end of file
@@ -4,7 +4,9 @@ import json
 import hashlib
 import argparse
 import shutil
-from multiprocessing import Process, Value
+import subprocess
+from multiprocessing import Process, Value, Queue
+import queue
 from typing import Any
 from dataclasses import dataclass
 from dotenv import load_dotenv
@@ -22,7 +24,9 @@ from events.player_number_balance_event import PlayerNumberBalanceEvent
 from events.battle_countdown_event import BattleCountEvent
 from events.special_weapon_event import SpecialWeaponEvent, SpecialWeaponEventType
 from prediction.match_frame_analyzer import MatchAnalysisResult
-from tools.download_ytb import download 
+from tools.download_ytb import download, get_stream_url
+from movie_stream import StreamingDownload, is_cached_movie, probe_movie
+from prediction.detector_pool import DetectorPool
 from error import *
 from log import create_prod_logger
 
@@ -172,6 +176,63 @@ def download_youtube_movie_file(video_id: str, out_dir: str, local_dir: str=None
             raise e
     return file_path
     
+def stream_user_movie_file(s3_client: Any, s3_bucket: str, s3_key: str, out_dir: str) -> (str, StreamingDownload):
+    ext = os.path.splitext(os.path.basename(s3_key))[1]
+    key_hash = hashlib.sha256(s3_key.encode('utf-8')).hexdigest()
+    file_path = f'{out_dir}/{key_hash}{ext}'
+    if is_cached_movie(file_path):
+        print(f'use cached: {file_path}')
+        return file_path, None
+    url = s3_client.generate_presigned_url('get_object', Params={ 'Bucket': s3_bucket, 'Key': s3_key }, ExpiresIn=3600)
+    return file_path, StreamingDownload(url, file_path)
+
+def stream_youtube_movie_file(video_id: str, out_dir: str) -> (str, StreamingDownload):
+    file_path = f'{out_dir}/{video_id}.mp4'
+    if is_cached_movie(file_path):
+        print(f'use cached: {file_path}')
+        return file_path, None
+    return file_path, StreamingDownload(get_stream_url(video_id), file_path)
+
+def movie_cache_key(movie_path: str, source_key: str=None) -> str:
+    # the source key (S3 ETag, youtube video id) names the movie wherever it is copied.
+    # without it the file is identified by its path, size and mtime instead of hashing its content
+    if source_key is None:
+        stat = os.stat(movie_path)
+        source_key = f'{os.path.abspath(movie_path)}:{stat.st_size}:{stat.st_mtime_ns}'
+    return hashlib.sha256(source_key.encode('utf-8')).hexdigest()
+
+def normalize_movie_file(movie_path: str, out_dir: str, max_height: int=720, gop: int=None, source_key: str=None) -> str:
+    # constant frame rate and short GOP make seeks and frame numbers predictable.
+    # the source frame rate is kept (rounded like the analyzer does) and large movies are only downscaled
+    info = probe_movie(movie_path)
+    if info is None:
+        raise Exception('failed to probe movie')
+    fps = round(info[2])
+    gop = gop if gop is not None else fps
+    file_path = f'{out_dir}/{movie_cache_key(movie_path, source_key)}_max{max_height}p{fps}g{gop}.mp4'
+    if os.path.exists(file_path):
+        print(f'use cached normalized movie: {file_path}')
+        return file_path
+
+    tmp_path = f'{file_path}.tmp.mp4'
+    command = [
+        'ffmpeg', '-y', '-v', 'error',
+        '-i', movie_path,
+        '-vf', f"scale=-2:'min({max_height},ih)',fps={fps}",
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '20',
+        '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+        '-an',
+        tmp_path
+    ]
+    try:
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise e
+    os.replace(tmp_path, file_path)
+    return file_path
+
 def download_models(s3_client: Any, s3_bucket: str, s3_key: str, out_dir: str) -> ModelPaths:
     pass
 
@@ -195,7 +256,8 @@ def get_model_paths() -> ModelPaths:
         sub_weapon_model_path=os.environ.get('SUB_WEAPON_MODEL_PATH'),
         sp_weapon_model_path=os.environ.get('SPECIAL_WEAPON_MODEL_PATH'),
         weapon_gauge_model_path=os.environ.get('WEAPON_GAUGE_MODEL_PATH'),
-        ink_tank_model_path=os.environ.get('INK_TANK_MODEL_PATH')
+        ink_tank_model_path=os.environ.get('INK_TANK_MODEL_PATH'),
+        scene_model_path=os.environ.get('SCENE_MODEL_PATH')
     )
 
 def get_job_item(dynamodb_client: Any, job_id: str, user_id: str) -> dict:
@@ -415,54 +477,29 @@ def analyze(
     file_name: str,
     battle_date: int,
     analysis_per_secode: int,
-    err_code: Value):
+    err_code: Value,
+    streaming: bool=False):
+    analyzer = None
     try:
-        module_name = 'battle_analyzer'
-        create_prod_logger(module_name)
-        model_paths = get_model_paths()
-        analyzer = BattleAnalyzer(model_paths=model_paths, device=device, log_name=module_name)
-        preprocess_result = analyzer.preprocess(BattlePreprocessParams(
-            battle_movie_path=movie_path,
-            movie_date=battle_date,
-            analysis_per_second=analysis_per_secode,
-            process_id=process_id,
-            batch_size=batch_size
-        ))
-        analysis_result, e_code = analyzer.analyze(BattleAnalysisParams())
-        if analysis_result is None:
-            err_code.value = e_code.value
-            return
-    except AnalyzerError as e:
-        print(e.msg)
-        err_code.value = e.code.value
-        return
-    except Exception as e:
-        err_msg = f'failed to analyze: {str(e)}'
-        print(err_msg)
-        err_code.value = ErrorCode.INTERNAL_ERROR.value
-        return
-    
-    while analysis_result:
         try:
-            create_analzye_result(
-                user_id=user_id,
-                job_id=job_id,
-                file_name=file_name,
-                result=analysis_result,
-                pre_result=preprocess_result)
-        except Exception as e:
-            err_msg = f'failed to save analyze result: {str(e)}'
-            print(err_msg)
-            err_code.value = ErrorCode.INTERNAL_ERROR.value
-            return
-        
-        try:
-            analysis_result, _ = analyzer.analyze(BattleAnalysisParams(
-                start_frame=analysis_result.battle_info.battle_end_frame
+            module_name = 'battle_analyzer'
+            create_prod_logger(module_name)
+            model_paths = get_model_paths()
+            analyzer = BattleAnalyzer(model_paths=model_paths, device=device, log_name=module_name)
+            preprocess_result = analyzer.preprocess(BattlePreprocessParams(
+                battle_movie_path=movie_path,
+                movie_date=battle_date,
+                analysis_per_second=analysis_per_secode,
+                process_id=process_id,
+                batch_size=batch_size,
+                streaming=streaming
             ))
+            analysis_result, e_code = analyzer.analyze(BattleAnalysisParams())
+            if analysis_result is None:
+                err_code.value = e_code.value
+                return
         except AnalyzerError as e:
-            err_msg = e.msg
-            print(err_msg)
+            print(e.msg)
             err_code.value = e.code.value
             return
         except Exception as e:
@@ -470,6 +507,82 @@ def analyze(
             print(err_msg)
             err_code.value = ErrorCode.INTERNAL_ERROR.value
             return
+    
+        while analysis_result:
+            try:
+                create_analzye_result(
+                    user_id=user_id,
+                    job_id=job_id,
+                    file_name=file_name,
+                    result=analysis_result,
+                    pre_result=preprocess_result)
+            except Exception as e:
+                err_msg = f'failed to save analyze result: {str(e)}'
+                print(err_msg)
+                err_code.value = ErrorCode.INTERNAL_ERROR.value
+                return
+        
+            try:
+                analysis_result, _ = analyzer.analyze(BattleAnalysisParams(
+                    start_frame=analysis_result.battle_info.battle_end_frame
+                ))
+            except AnalyzerError as e:
+                err_msg = e.msg
+                print(err_msg)
+                err_code.value = e.code.value
+                return
+            except Exception as e:
+                err_msg = f'failed to analyze: {str(e)}'
+                print(err_msg)
+                err_code.value = ErrorCode.INTERNAL_ERROR.value
+                return
+    finally:
+        if analyzer is not None:
+            analyzer.release()
+
+def run_analysis_worker(jobs: Queue, results: Queue):
+    # detector workers and models loaded by a job stay warm for the next jobs
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        err_code = Value('i', -1)
+        analyze(**job, err_code=err_code)
+        results.put(err_code.value)
+    DetectorPool.close()
+
+class AnalysisWorker:
+    """
+    Long-lived process running analysis jobs one by one instead of a process per job.
+    """
+    POLL_INTERVAL = 1.0
+
+    def __init__(self) -> None:
+        self.process = None
+        self.jobs = None
+        self.results = None
+
+    def run(self, **job) -> int:
+        if self.process is None or not self.process.is_alive():
+            self.jobs = Queue()
+            self.results = Queue()
+            self.process = Process(target=run_analysis_worker, args=[self.jobs, self.results])
+            self.process.start()
+        self.jobs.put(job)
+        while True:
+            try:
+                return self.results.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    # restarted on the next job
+                    self.process = None
+                    return ErrorCode.INTERNAL_ERROR.value
+
+    def close(self):
+        if self.process is not None and self.process.is_alive():
+            self.jobs.put(None)
+            self.process.join()
+        self.process = None
 
 if __name__ == '__main__':
     sqs_client = boto3.client('sqs')
@@ -484,6 +597,9 @@ if __name__ == '__main__':
     work_dir = os.environ.get('WORK_DIR')
     local_work_dir = os.environ.get('LOCAL_WORK_DIR')
     device = os.environ.get('MODEL_DEVICE')
+    normalize_movie = os.environ.get('NORMALIZE_MOVIE', '0') == '1'
+    stream_movie = os.environ.get('STREAM_MOVIE', '0') == '1'
+    persistent_analyzer = os.environ.get('PERSISTENT_ANALYZER', '1') == '1'
     if args.device is not None:
         device = args.device
     logger.info(f'use device: {device}')
@@ -494,6 +610,7 @@ if __name__ == '__main__':
         exit()
 
     init()
+    analysis_worker = AnalysisWorker() if persistent_analyzer else None
 
     shutdown_requested = False
     while not shutdown_requested:
@@ -536,10 +653,26 @@ if __name__ == '__main__':
                 continue
 
             # download battle movie file
+            movie_download = None
             try:
                 out_dir = f'{work_dir}/movies/{req.user_id}'
                 local_out_dir = f'{local_work_dir}/movies/{req.user_id}' if local_work_dir else None
-                if req.movie_source == 'user':
+                if stream_movie:
+                    # analysis starts while the movie is downloading
+                    os.makedirs(local_out_dir or out_dir, exist_ok=True)
+                    if req.movie_source == 'user':
+                        mov_path, movie_download = stream_user_movie_file(
+                            s3_client=s3_client,
+                            s3_bucket=req.s3_bucket,
+                            s3_key=req.s3_key,
+                            out_dir=local_out_dir or out_dir)
+                    elif req.movie_source == 'youtube':
+                        mov_path, movie_download = stream_youtube_movie_file(video_id=req.video_id, out_dir=local_out_dir or out_dir)
+                    else:
+                        raise Exception('invalid source type')
+                    if movie_download is not None:
+                        movie_download.start()
+                elif req.movie_source == 'user':
                     mov_path = download_user_movie_file(
                         s3_client=s3_client,
                         s3_bucket=req.s3_bucket,
@@ -555,6 +688,18 @@ if __name__ == '__main__':
                 logger.info(msg)
                 set_fail_state(dynamodb_client, req.job_id, req.user_id, msg, 201)
                 continue
+
+            # normalize movie for cheap random access. the original movie is analyzed if it fails
+            if normalize_movie and movie_download is None:
+                try:
+                    if req.movie_source == 'user':
+                        etag = s3_client.head_object(Bucket=req.s3_bucket, Key=req.s3_key)['ETag']
+                        source_key = f'{req.s3_bucket}/{req.s3_key}:{etag}'
+                    else:
+                        source_key = f'youtube:{req.video_id}'
+                    mov_path = normalize_movie_file(mov_path, os.path.dirname(mov_path), source_key=source_key)
+                except Exception as e:
+                    logger.info(f'failed to normalize movie file: {str(e)}')
             
             # set job state processing
             try:
@@ -563,6 +708,8 @@ if __name__ == '__main__':
                 msg = f'failed to set processing state: {str(e)}'
                 logger.info(msg)
                 set_fail_state(dynamodb_client, req.job_id, req.user_id, msg, 201)
+                if movie_download is not None:
+                    movie_download.join()
                 continue
 
             # run analysis on dedicated process
@@ -570,20 +717,40 @@ if __name__ == '__main__':
             batch_size = int(os.environ.get('ANALYSIS_PREPROCESS_BATCH_SIZE'))
             err_code = Value('i', -1)
             if req.movie_source == 'user':
-                process = Process(
-                    target=analyze,
-                    args=[mov_path, args.process, device, batch_size, req.user_id, req.job_id, req.file_name, battle_date, 5, err_code]
-                )
+                file_name = req.file_name
             elif req.movie_source == 'youtube':
-                process = Process(
-                    target=analyze,
-                    args=[mov_path, args.process, device, batch_size, req.user_id, req.job_id, req.video_id, battle_date, 5, err_code]
-                )
+                file_name = req.video_id
             else:
                 continue
             
-            process.start()
-            process.join()
+            if analysis_worker is not None:
+                err_code.value = analysis_worker.run(
+                    movie_path=mov_path,
+                    process_id=args.process,
+                    device=device,
+                    batch_size=batch_size,
+                    user_id=req.user_id,
+                    job_id=req.job_id,
+                    file_name=file_name,
+                    battle_date=battle_date,
+                    analysis_per_secode=5,
+                    streaming=movie_download is not None
+                )
+            else:
+                process = Process(
+                    target=analyze,
+                    args=[mov_path, args.process, device, batch_size, req.user_id, req.job_id, file_name, battle_date, 5, err_code, movie_download is not None]
+                )
+                process.start()
+                process.join()
+
+            if movie_download is not None:
+                movie_download.join()
+                if movie_download.error is not None:
+                    msg = f'failed to download movie file: {str(movie_download.error)}'
+                    logger.info(msg)
+                    set_fail_state(dynamodb_client, req.job_id, req.user_id, msg, 201)
+                    continue
 
             if err_code.value != -1:
                 set_fail_state(dynamodb_client, req.job_id, req.user_id, 'analysis failed', err_code.value)
@@ -603,4 +770,6 @@ if __name__ == '__main__':
             logger.info(f'invalid request type: {req.type }')
             continue
 
+    if analysis_worker is not None:
+        analysis_worker.close()
     logger.info('battle analyzer exited.') 
\ No newline at end of file
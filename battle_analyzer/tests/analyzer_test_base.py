@@ -46,7 +46,8 @@ def get_model_paths() -> ModelPaths:
         sub_weapon_model_path=os.environ.get('SUB_WEAPON_MODEL_PATH'),
         sp_weapon_model_path=os.environ.get('SPECIAL_WEAPON_MODEL_PATH'),
         weapon_gauge_model_path=os.environ.get('WEAPON_GAUGE_MODEL_PATH'),
-        ink_tank_model_path=os.environ.get('INK_TANK_MODEL_PATH')
+        ink_tank_model_path=os.environ.get('INK_TANK_MODEL_PATH'),
+        scene_model_path=os.environ.get('SCENE_MODEL_PATH')
     )
     
 def _analyze(movie_file):
@@ -0,0 +1,35 @@
+from dataclasses import dataclass
+import cv2
+import numpy as np
+import torch
+from prediction.frame import Frame
+
+# stand-in model for run_prediction tests. each frame's result is the mean brightness of the inferred image
+
+@dataclass
+class BrightnessFrame(Frame):
+    brightness: float
+
+class IdentityModel:
+    # returns its input so each frame's prediction tells which frame was inferred
+    task = 'detect'
+    imgsz = 8
+    device = torch.device('cpu')
+
+    def forward(self, batch: torch.Tensor):
+        return batch
+
+def preprocess_brightness(img, size, device, to_4d=True):
+    return torch.full((1, size, size), float(img.mean()))
+
+def postprocess_brightness(preds, input_shape, image_shape, iou_threshold, conf_threshold, max_detections):
+    return [np.array([[0, 0, 1, 1, float(p.mean()), 0]], dtype=np.float32) for p in preds]
+
+def make_frame_result(pred, frame: int, _) -> BrightnessFrame:
+    return BrightnessFrame(frame=frame, image=None, brightness=float(pred[0, 4]))
+
+def write_brightness_movie(movie_path: str, brightness: list[int]):
+    writer = cv2.VideoWriter(movie_path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (160, 90))
+    for value in brightness:
+        writer.write(np.full((90, 160, 3), value, dtype=np.uint8))
+    writer.release()
@@ -0,0 +1,109 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+from prediction.prediction_process import run_prediction, PredictionResultBase
+from tests.brightness_model import BrightnessFrame, IdentityModel, preprocess_brightness, postprocess_brightness, make_frame_result, write_brightness_movie
+
+def make_prediction_completed(width, height, total_frames, start_frame, end_frame, frame_interval, frame_results, processing_time):
+    return PredictionResultBase(
+        frames=frame_results,
+        image_width=width,
+        image_height=height,
+        total_frames=total_frames,
+        start_frame=start_frame,
+        end_frame=end_frame,
+        frame_interval=frame_interval,
+        processing_time=processing_time
+    )
+
+def is_active_frame(frame: BrightnessFrame) -> bool:
+    return 100 <= frame.brightness < 150
+
+def is_span_start_frame(frame: BrightnessFrame) -> bool:
+    return 225 <= frame.brightness
+
+def is_span_end_frame(frame: BrightnessFrame) -> bool:
+    return 175 <= frame.brightness < 225
+
+class TestAdaptiveSampling(unittest.TestCase):
+    FRAMES = 80
+    IDLE_FRAME_INTERVAL = 10
+    ACTIVE_WINDOW = 5
+    # notifications shown for an idle interval. span from frame 10 to 30, longer than the active window,
+    # and active frames from 60 to 69
+    BRIGHTNESS = { **{ i: 250 for i in range(10, 20) }, **{ i: 200 for i in range(30, 40) }, **{ i: 128 for i in range(60, 70) } }
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.movie_path = os.path.join(cls.work_dir, 'adaptive.avi')
+        write_brightness_movie(cls.movie_path, [cls.BRIGHTNESS.get(i, 0) for i in range(cls.FRAMES)])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def _run(self, batch_size: int):
+        with mock.patch('prediction.prediction_process.ModelRegistry.get', return_value=IdentityModel()):
+            return run_prediction(
+                name='adaptive',
+                battle_movie_path=self.movie_path,
+                model_path='identity',
+                start_frame=0,
+                end_frame=None,
+                frame_interval=1,
+                device='cpu',
+                batch_size=batch_size,
+                iou_threshold=0.45,
+                conf_threshold=0.25,
+                max_detections=100,
+                make_frame_result_func=make_frame_result,
+                make_prediction_completed_func=make_prediction_completed,
+                preprocess_func=preprocess_brightness,
+                postprocesss_func=postprocess_brightness,
+                idle_frame_interval=self.IDLE_FRAME_INTERVAL,
+                active_window=self.ACTIVE_WINDOW,
+                is_active_frame_func=is_active_frame,
+                is_span_start_func=is_span_start_frame,
+                is_span_end_func=is_span_end_frame
+            )
+
+    def test_full_rate_in_span(self):
+        result = self._run(batch_size=1)
+        self.assertIsNotNone(result)
+        inferred = [f.frame for f in result.frames]
+        # idle frames of the last idle interval before the span start and the active frame are inferred afterwards
+        expected = list(range(0, 31)) + [40] + list(range(49, 70 + self.ACTIVE_WINDOW))
+        self.assertEqual(expected, inferred)
+
+    def test_full_rate_in_batches(self):
+        for batch_size in [2, 3, 4, 8]:
+            with self.subTest(batch_size=batch_size):
+                result = self._run(batch_size=batch_size)
+                self.assertIsNotNone(result)
+                inferred = [f.frame for f in result.frames]
+                self.assertEqual(sorted(set(inferred)), inferred)
+                # idle samples wait in the batch. frames skipped before the trigger must still be there to infer
+                for frame in list(range(1, 31)) + list(range(60, 70 + self.ACTIVE_WINDOW)):
+                    self.assertIn(frame, inferred)
+                # mostly skipped between the span and the active frames
+                self.assertLess(len([f for f in inferred if 40 <= f <= 50]), 5)
+
+    def test_get_frame_in_gap(self):
+        result = self._run(batch_size=1)
+        self.assertEqual(30, result.get_frame(30).frame)
+        self.assertEqual(40, result.get_frame(40).frame)
+        # frames skipped while idle were not inferred
+        self.assertIsNone(result.get_frame(35))
+        self.assertIsNone(result.get_frame(77))
+
+def add_tests(suite: unittest.TestSuite):
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(TestAdaptiveSampling))
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    add_tests(suite)
+    runner = unittest.TextTestRunner(failfast=False)
+    result = runner.run(suite)
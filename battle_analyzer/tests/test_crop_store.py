@@ -0,0 +1,132 @@
+import unittest
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+import numpy as np
+from prediction.crop_store import CropStore
+from prediction.prediction_process import run_prediction
+from prediction.boundary_refinement import run_refined_prediction
+from tests.brightness_model import IdentityModel, preprocess_brightness, postprocess_brightness, make_frame_result, write_brightness_movie
+
+def make_prediction_completed(width, height, total_frames, start_frame, end_frame, frame_interval, frame_results, processing_time):
+    return SimpleNamespace(frames=frame_results)
+
+class TestCropStore(unittest.TestCase):
+    # equal neighbours are duplicates of the frame before them
+    BRIGHTNESS = [0, 0, 255, 128, 128, 128, 64, 200, 200]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.movie_path = os.path.join(cls.work_dir, 'crops.avi')
+        write_brightness_movie(cls.movie_path, cls.BRIGHTNESS)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def setUp(self):
+        self.store_path = os.path.join(self.work_dir, 'crops')
+
+    def tearDown(self):
+        CropStore.detach_all(self.movie_path)
+        CropStore.remove(self.store_path)
+
+    def _run(self, batch_size: int, classes: list[int]):
+        with mock.patch('prediction.prediction_process.ModelRegistry.get', return_value=IdentityModel()):
+            return run_prediction(
+                name='crops',
+                battle_movie_path=self.movie_path,
+                model_path='identity',
+                start_frame=0,
+                end_frame=None,
+                frame_interval=1,
+                device='cpu',
+                batch_size=batch_size,
+                iou_threshold=0.45,
+                conf_threshold=0.25,
+                max_detections=100,
+                make_frame_result_func=make_frame_result,
+                make_prediction_completed_func=make_prediction_completed,
+                preprocess_func=preprocess_brightness,
+                postprocesss_func=postprocess_brightness,
+                crop_store_path=self.store_path,
+                crop_store_classes=classes,
+                duplicate_threshold=3.0
+            )
+
+    def test_duplicate_frames(self):
+        for batch_size in [1, 3]:
+            with self.subTest(batch_size=batch_size):
+                CropStore.remove(self.store_path)
+                result = self._run(batch_size, [0])
+                self.assertGreater(len(result.skipped_frames), 0)
+                store = CropStore.attach(self.movie_path, self.store_path)
+                self.assertIsInstance(store.rows, np.memmap)
+                # every frame has the crop of its box. duplicates share the pixels of the frame they duplicate
+                for frame in range(len(self.BRIGHTNESS)):
+                    crop = CropStore.lookup(self.movie_path, frame, [0, 0, 1, 1])
+                    self.assertIsNotNone(crop, frame)
+                    self.assertAlmostEqual(self.BRIGHTNESS[frame], float(crop.mean()), delta=3)
+                self.assertEqual(int(os.path.getsize(self.store_path)), (len(self.BRIGHTNESS) - len(result.skipped_frames)) * 3)
+                CropStore.detach(self.movie_path, store)
+
+    def test_copied_frames(self):
+        with mock.patch('prediction.boundary_refinement.ModelRegistry.get', return_value=IdentityModel()):
+            result = run_refined_prediction(
+                name='crops',
+                battle_movie_path=self.movie_path,
+                model_path='identity',
+                start_frame=0,
+                end_frame=None,
+                frame_interval=1,
+                coarse_frame_interval=4,
+                device='cpu',
+                batch_size=2,
+                iou_threshold=0.45,
+                conf_threshold=0.25,
+                max_detections=100,
+                make_frame_result_func=make_frame_result,
+                make_prediction_completed_func=make_prediction_completed,
+                state_func=lambda frame: 100 < frame.brightness,
+                preprocess_func=preprocess_brightness,
+                postprocesss_func=postprocess_brightness,
+                crop_store_path=self.store_path,
+                crop_store_classes=[0]
+            )
+        self.assertGreater(len(result.skipped_frames), 0)
+        CropStore.attach(self.movie_path, self.store_path)
+        # frames between samples of the same state have the crops of the sample before them
+        for frame in range(len(self.BRIGHTNESS)):
+            self.assertIsNotNone(CropStore.lookup(self.movie_path, frame, [0, 0, 1, 1]), frame)
+
+    def test_classes(self):
+        self._run(1, [1])
+        self.assertIsNone(CropStore.attach(self.movie_path, self.store_path).get(0, [0, 0, 1, 1]))
+
+    def test_out_of_order(self):
+        store = CropStore.create(self.store_path)
+        img = np.arange(4 * 4 * 3, dtype=np.uint8).reshape(4, 4, 3)
+        later = store.append(7, [0, 0, 2, 2], img)
+        store.append(3, [1, 1, 3, 4], img)
+        store.alias(8, [later])
+        store.append(3, [2, 2, 4, 4], img)
+        store.close()
+        store = CropStore.open(self.store_path)
+        self.assertIsNotNone(store.order)
+        np.testing.assert_array_equal(img[1:4,1:3], store.get(3, [1, 1, 3, 4]))
+        np.testing.assert_array_equal(img[2:4,2:4], store.get(3, [2, 2, 4, 4]))
+        np.testing.assert_array_equal(img[0:2,0:2], store.get(8, [0, 0, 2, 2]))
+        self.assertIsNone(store.get(5, [0, 0, 2, 2]))
+        store.close()
+
+def add_tests(suite: unittest.TestSuite):
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(TestCropStore))
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    add_tests(suite)
+    runner = unittest.TextTestRunner(failfast=False)
+    result = runner.run(suite)
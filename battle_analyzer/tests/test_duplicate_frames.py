@@ -0,0 +1,69 @@
+import unittest
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+from prediction.prediction_process import run_prediction
+from tests.brightness_model import IdentityModel, preprocess_brightness, postprocess_brightness, make_frame_result, write_brightness_movie
+
+def make_prediction_completed(width, height, total_frames, start_frame, end_frame, frame_interval, frame_results, processing_time):
+    return SimpleNamespace(frames=frame_results)
+
+class TestDuplicateFrames(unittest.TestCase):
+    # brightness of each frame. equal neighbours are duplicates of the frame before them
+    BRIGHTNESS = [0, 0, 255, 128, 128, 128, 64, 200, 200]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.movie_path = os.path.join(cls.work_dir, 'duplicates.avi')
+        write_brightness_movie(cls.movie_path, cls.BRIGHTNESS)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def _run(self, batch_size: int, columnar: bool):
+        with mock.patch('prediction.prediction_process.ModelRegistry.get', return_value=IdentityModel()):
+            return run_prediction(
+                name='duplicates',
+                battle_movie_path=self.movie_path,
+                model_path='identity',
+                start_frame=0,
+                end_frame=None,
+                frame_interval=1,
+                device='cpu',
+                batch_size=batch_size,
+                iou_threshold=0.45,
+                conf_threshold=0.25,
+                max_detections=100,
+                make_frame_result_func=make_frame_result,
+                make_prediction_completed_func=make_prediction_completed,
+                preprocess_func=preprocess_brightness,
+                postprocesss_func=postprocess_brightness,
+                duplicate_threshold=3.0,
+                columnar=columnar
+            )
+
+    def test_duplicates_in_batch(self):
+        for batch_size in [1, 2, 3, 4]:
+            for columnar in [False, True]:
+                with self.subTest(batch_size=batch_size, columnar=columnar):
+                    result = self._run(batch_size, columnar)
+                    self.assertIsNotNone(result)
+                    frames = [result.frames[i] for i in range(len(result.frames))]
+                    self.assertEqual(list(range(len(self.BRIGHTNESS))), [f.frame for f in frames])
+                    # a duplicate gets the detections of the frame it duplicates, not of the last frame of its batch
+                    for frame, brightness in zip(frames, self.BRIGHTNESS):
+                        self.assertAlmostEqual(brightness, frame.brightness, delta=3)
+                    self.assertEqual([1, 4, 5, 8], result.skipped_frames)
+
+def add_tests(suite: unittest.TestSuite):
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(TestDuplicateFrames))
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    add_tests(suite)
+    runner = unittest.TextTestRunner(failfast=False)
+    result = runner.run(suite)
@@ -0,0 +1,71 @@
+import unittest
+import multiprocessing
+import os
+import threading
+from unittest import mock
+import numpy as np
+from prediction.frame_bus import FrameBus
+
+def exit_without_detach(bus_id: int, consumer_id: int):
+    # a detector killed in the middle of a job never reaches its finally
+    FrameBus.attach(bus_id, consumer_id)
+    os._exit(1)
+
+class TestFrameBus(unittest.TestCase):
+    FRAMES = 20
+    CAPACITY = 4
+
+    def setUp(self):
+        self.bus_id = os.getpid()
+        self.bus = FrameBus.create(self.bus_id, 8, 8, self.FRAMES, consumers=2, capacity=self.CAPACITY)
+
+    def tearDown(self):
+        self.bus.unlink()
+
+    def _read(self, consumer_id: int, frames: list):
+        bus = FrameBus.attach(self.bus_id, consumer_id)
+        for frame_number, _ in bus.frames(consumer_id):
+            frames.append(frame_number)
+        bus.release()
+
+    def _publish(self):
+        img = np.zeros((8, 8, 3), dtype=np.uint8)
+        for i in range(self.FRAMES):
+            self.bus.publish(i, img)
+        self.bus.close()
+
+    def test_dead_consumer_detached(self):
+        process = multiprocessing.get_context('spawn').Process(target=exit_without_detach, args=(self.bus_id, 1))
+        process.start()
+        frames = []
+        reader = threading.Thread(target=self._read, args=(0, frames))
+        reader.start()
+        # the exited consumer is not joined yet, so it stays a zombie while the decoder waits for it
+        with mock.patch.object(FrameBus, 'LIVENESS_INTERVAL', 0.1), mock.patch.object(FrameBus, 'STALL_TIMEOUT', 30):
+            self._publish()
+        reader.join()
+        process.join()
+        self.assertEqual(list(range(self.FRAMES)), frames)
+        self.assertEqual(FrameBus.DETACHED, self.bus.read_seqs[1])
+
+    def test_stalled_consumer(self):
+        # consumer 1 is alive but never reads
+        self.bus.pids[1] = os.getpid()
+        frames = []
+        reader = threading.Thread(target=self._read, args=(0, frames))
+        reader.start()
+        with mock.patch.object(FrameBus, 'STALL_TIMEOUT', 0.5):
+            with self.assertRaises(Exception):
+                self._publish()
+        self.bus.close()
+        reader.join()
+        self.assertEqual(list(range(self.CAPACITY)), frames)
+
+def add_tests(suite: unittest.TestSuite):
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(TestFrameBus))
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    add_tests(suite)
+    runner = unittest.TextTestRunner(failfast=False)
+    result = runner.run(suite)
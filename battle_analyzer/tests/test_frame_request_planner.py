@@ -0,0 +1,67 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+import cv2
+import numpy as np
+from utils import FrameRequestPlanner, MovieReader
+
+class TestFrameRequestPlanner(unittest.TestCase):
+    FRAMES = 30
+    WIDTH = 160
+    HEIGHT = 90
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.movie_path = os.path.join(cls.work_dir, 'planner.avi')
+        writer = cv2.VideoWriter(cls.movie_path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (cls.WIDTH, cls.HEIGHT))
+        for i in range(cls.FRAMES):
+            writer.write(np.full((cls.HEIGHT, cls.WIDTH, 3), i * 8, dtype=np.uint8))
+        writer.release()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def setUp(self):
+        MovieReader.cache.clear()
+
+    def test_one_pass_for_stages(self):
+        planner = FrameRequestPlanner(self.movie_path)
+        # two stages declare their frames before the run
+        stage_a = [planner.request(frame_number) for frame_number in [20, 3, 11]]
+        stage_b = [planner.request(frame_number, [[0, 0, 10, 10], [10, 10, 30, 20]]) for frame_number in [11, 25, 7]]
+        read = []
+        original_read = MovieReader.read
+        def _read(reader, frame_number):
+            read.append(frame_number)
+            return original_read(reader, frame_number)
+        with mock.patch.object(MovieReader, 'read', _read):
+            planner.run()
+        self.assertEqual([3, 7, 11, 20, 25], read)
+        self.assertEqual((self.HEIGHT, self.WIDTH, 3), stage_a[0].result().shape)
+        self.assertEqual([(10, 10, 3), (10, 20, 3)], [crop.shape for crop in stage_b[1].result()])
+        # the next run reads only what was requested after the last one
+        later = planner.request(5)
+        planner.run()
+        self.assertEqual((self.HEIGHT, self.WIDTH, 3), later.result().shape)
+
+    def test_transform(self):
+        planner = FrameRequestPlanner(self.movie_path)
+        small = planner.request(10, transform=lambda img: cv2.resize(img, (16, 9)))
+        failed = planner.request(12, transform=lambda img: img[0, 0, 5])
+        planner.run()
+        # only the transformed image is kept
+        self.assertEqual((9, 16, 3), small.result().shape)
+        self.assertIsInstance(failed.exception(), IndexError)
+
+def add_tests(suite: unittest.TestSuite):
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(TestFrameRequestPlanner))
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    add_tests(suite)
+    runner = unittest.TextTestRunner(failfast=False)
+    result = runner.run(suite)
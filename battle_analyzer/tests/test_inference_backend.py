@@ -0,0 +1,99 @@
+import unittest
+import importlib.util
+import os
+import shutil
+import tempfile
+import cv2
+import torch
+from dotenv import load_dotenv
+from prediction.inference_backend import TorchBackend, OnnxBackend, match_detections
+from prediction.prediction_process import preprocess, infer
+from tools.export_onnx import export
+from tests.config import config
+
+load_dotenv()
+
+# detectors compared between the torch and the onnx backend
+DETECTOR_MODEL_ENVS = [
+    'IKALAMP_MODEL_PATH',
+    'IKA_PLAYER_MODEL_PATH',
+    'NOTIFICATION_MODEL_PATH',
+    'BATTLE_INDICATOR_MODEL_PATH'
+]
+
+@unittest.skipUnless(importlib.util.find_spec('onnxruntime'), 'onnxruntime is required')
+class TestInferenceBackendParity(unittest.TestCase):
+    FRAMES = 32
+    FRAME_INTERVAL = 150
+    BATCH_SIZE = 8
+    # ratio of frames whose detections must agree
+    MIN_AGREEMENT = 0.97
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cap = cv2.VideoCapture(config['rules']['nawabari'])
+        cls.images = []
+        for i in range(cls.FRAMES):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, i * cls.FRAME_INTERVAL)
+            ret, img = cap.read()
+            if not ret:
+                break
+            cls.images.append(img)
+        cap.release()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def _detect(self, backend, images):
+        preds = []
+        for i in range(0, len(images), self.BATCH_SIZE):
+            batch = [preprocess(img, backend.imgsz, backend.device, to_4d=False) for img in images[i:i + self.BATCH_SIZE]]
+            preds.extend(infer(backend, batch, images[0].shape, 0.45, 0.25, 100))
+        return preds
+
+    def test_detection_parity(self):
+        if len(self.images) == 0:
+            self.skipTest('test movie is not available')
+        model_paths = { env: os.environ.get(env) for env in DETECTOR_MODEL_ENVS }
+        model_paths = { env: path for env, path in model_paths.items() if path is not None and path.endswith('.pt') }
+        if len(model_paths) == 0:
+            self.skipTest('no *_MODEL_PATH is a .pt model')
+        for env, model_path in model_paths.items():
+            with self.subTest(model=env):
+                # exported next to a copy so the model directory is left as is
+                pt_path = os.path.join(self.work_dir, f'{env}.pt')
+                shutil.copy(model_path, pt_path)
+                onnx_path = export(pt_path)
+
+                torch_backend = TorchBackend(pt_path, 'cpu')
+                onnx_backend = OnnxBackend(onnx_path, 'cpu')
+                self.assertEqual(torch_backend.task, onnx_backend.task)
+                self.assertEqual(torch_backend.names, onnx_backend.names)
+                self.assertEqual(torch_backend.imgsz, onnx_backend.imgsz)
+
+                torch_preds = self._detect(torch_backend, self.images)
+                onnx_preds = self._detect(onnx_backend, self.images)
+                self.assertEqual(len(torch_preds), len(onnx_preds))
+                agreed = sum(match_detections(t, o) for t, o in zip(torch_preds, onnx_preds))
+                self.assertGreaterEqual(agreed / len(torch_preds), self.MIN_AGREEMENT)
+
+    def test_inference_mode(self):
+        model_path = os.environ.get('IKALAMP_MODEL_PATH')
+        if model_path is None or not model_path.endswith('.pt'):
+            self.skipTest('IKALAMP_MODEL_PATH is not set')
+        backend = TorchBackend(model_path, 'cpu')
+        batch = torch.zeros((1, 3, backend.imgsz, backend.imgsz))
+        preds = backend.forward(batch)
+        preds = preds[0] if isinstance(preds, (list, tuple)) else preds
+        self.assertFalse(preds.requires_grad)
+
+def add_tests(suite: unittest.TestSuite):
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(TestInferenceBackendParity))
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    add_tests(suite)
+    runner = unittest.TextTestRunner(failfast=False)
+    result = runner.run(suite)
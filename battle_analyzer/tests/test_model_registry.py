@@ -0,0 +1,76 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from ultralytics.nn.tasks import DetectionModel
+from prediction.model_registry import ModelRegistry
+from prediction.detector_pool import DetectorPool
+
+def make_model(model_path: str):
+    # untrained yolov8n. detections do not matter, only how handles share the model
+    model = DetectionModel('yolov8n.yaml', nc=1, verbose=False)
+    torch.save({ 'model': model, 'train_args': { 'imgsz': 64, 'task': 'detect' } }, model_path)
+
+def track_job(model_path: str, out_path: str):
+    # one detection job on a pooled worker. the registry keeps the model loaded for the next job
+    handle = ModelRegistry.get(model_path, 'cpu')
+    img = np.zeros((64, 64, 3), dtype=np.uint8)
+    for _ in range(2):
+        handle.track(img, persist=True, verbose=False, tracker='bytetrack.yaml')
+    entry = ModelRegistry.models[(os.path.abspath(model_path), 'cpu')]
+    with open(out_path, 'w') as f:
+        json.dump({
+            'handle': len(handle.model.callbacks['on_predict_postprocess_end']),
+            'entry': len(entry.model.callbacks['on_predict_postprocess_end'])
+        }, f)
+
+class TestModelRegistry(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.model_path = os.path.join(cls.work_dir, 'detector.pt')
+        make_model(cls.model_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        DetectorPool.close()
+        ModelRegistry.clear()
+        shutil.rmtree(cls.work_dir)
+
+    def test_tracker_callbacks_per_job(self):
+        counts = []
+        for i in range(2):
+            out_path = os.path.join(self.work_dir, f'job{i}.json')
+            job = DetectorPool.job('registry_test', track_job, [self.model_path, out_path])
+            job.start()
+            job.join()
+            with open(out_path) as f:
+                counts.append(json.load(f))
+        # each job registers the tracker once on its own handle, never on the loaded model
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(counts[0]['entry'] + 1, counts[0]['handle'])
+
+    def test_predict_on_threads(self):
+        handles = [ModelRegistry.get(self.model_path, 'cpu') for _ in range(4)]
+        module = ModelRegistry.models[(os.path.abspath(self.model_path), 'cpu')].model.model
+        self.assertTrue(module.is_fused())
+        modules = list(module.modules())
+        img = np.zeros((64, 64, 3), dtype=np.uint8)
+        with ThreadPoolExecutor(len(handles)) as executor:
+            results = list(executor.map(lambda handle: handle.predict(img, verbose=False), handles))
+        self.assertEqual(len(handles), len(results))
+        # predictors of the handles did not edit the shared module
+        self.assertEqual(modules, list(module.modules()))
+
+def add_tests(suite: unittest.TestSuite):
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(TestModelRegistry))
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    add_tests(suite)
+    runner = unittest.TextTestRunner(failfast=False)
+    result = runner.run(suite)
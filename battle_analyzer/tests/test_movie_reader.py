@@ -0,0 +1,73 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+import cv2
+import numpy as np
+from movie_stream import PART_SUFFIX
+from utils import MovieIndex, MovieReader
+
+class TestMovieReader(unittest.TestCase):
+    FRAMES = 10
+
+    def setUp(self):
+        self.movie_dir = tempfile.mkdtemp()
+        self.index_dir = tempfile.mkdtemp()
+        self.movie_path = os.path.join(self.movie_dir, 'movie.avi')
+        writer = cv2.VideoWriter(self.movie_path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (64, 36))
+        for i in range(self.FRAMES):
+            writer.write(np.full((36, 64, 3), i * 20, dtype=np.uint8))
+        writer.release()
+        MovieReader.cache.clear()
+        MovieIndex.loaded = {}
+        self.env = mock.patch.dict(os.environ, {'MOVIE_INDEX_DIR': self.index_dir})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        MovieIndex.loaded = {}
+        shutil.rmtree(self.movie_dir)
+        shutil.rmtree(self.index_dir)
+
+    def test_index_in_index_dir(self):
+        built = MovieIndex(frame_count=self.FRAMES, keyframes=[0], size=os.path.getsize(self.movie_path))
+        with mock.patch.object(MovieIndex, 'build', return_value=built) as build:
+            self.assertEqual(built, MovieIndex.load(self.movie_path))
+            self.assertEqual(built, MovieIndex.load(self.movie_path))
+            # another process finds the stored index
+            MovieIndex.loaded = {}
+            self.assertEqual(built, MovieIndex.load(self.movie_path))
+        self.assertEqual(1, build.call_count)
+        self.assertEqual(['movie.avi'], os.listdir(self.movie_dir))
+        self.assertTrue(os.path.exists(MovieIndex.index_path(self.movie_path)))
+
+    def test_downloading(self):
+        open(self.movie_path + PART_SUFFIX, 'w').close()
+        with mock.patch.object(MovieIndex, 'build') as build:
+            self.assertIsNone(MovieIndex.load(self.movie_path))
+        build.assert_not_called()
+        reader = MovieReader(self.movie_path)
+        reader.read(5)
+        reader.release()
+        # frames of a growing file are not cached
+        self.assertEqual(0, MovieReader.cache.stats()['frames'])
+
+        os.remove(self.movie_path + PART_SUFFIX)
+        hits = MovieReader.cache.stats()['hits']
+        with mock.patch.object(MovieIndex, 'build', return_value=None):
+            for _ in range(2):
+                reader = MovieReader(self.movie_path)
+                reader.read(5)
+                reader.release()
+        # the second reader of the complete movie hits the frames of the first
+        self.assertEqual(hits + 1, MovieReader.cache.stats()['hits'])
+
+def add_tests(suite: unittest.TestSuite):
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(TestMovieReader))
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    add_tests(suite)
+    runner = unittest.TextTestRunner(failfast=False)
+    result = runner.run(suite)
@@ -0,0 +1,200 @@
+import unittest
+import os
+import shutil
+import tempfile
+import subprocess
+import threading
+import time
+import io
+from functools import partial
+from unittest import mock
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import cv2
+import numpy as np
+from movie_stream import StreamingDownload, MovieStream, is_downloading, is_moov_at_end, PART_SUFFIX
+
+class ThrottledHandler(SimpleHTTPRequestHandler):
+    # stands in for S3 / YouTube. sends the movie slowly so it is read while bytes are arriving
+    def copyfile(self, source, outputfile):
+        while True:
+            buf = source.read(64 * 1024)
+            if not buf:
+                break
+            outputfile.write(buf)
+            time.sleep(0.02)
+
+    def log_message(self, format, *args):
+        pass
+
+@unittest.skipUnless(shutil.which('ffmpeg') and shutil.which('ffprobe'), 'ffmpeg and ffprobe are required')
+class TestMovieStream(unittest.TestCase):
+    FRAMES = 90
+    WIDTH = 320
+    HEIGHT = 180
+
+    def setUp(self):
+        self.serve_dir = tempfile.mkdtemp()
+        self.work_dir = tempfile.mkdtemp()
+        writer = cv2.VideoWriter(os.path.join(self.serve_dir, 'movie.avi'), cv2.VideoWriter_fourcc(*'MJPG'), 30, (self.WIDTH, self.HEIGHT))
+        rng = np.random.default_rng(0)
+        for i in range(self.FRAMES):
+            # noise keeps the movie large enough to arrive in many chunks
+            img = rng.integers(0, 256, (self.HEIGHT, self.WIDTH, 3), dtype=np.uint8)
+            cv2.rectangle(img, (i * 3, 40), (i * 3 + 30, 70), (0, 0, 255), -1)
+            writer.write(img)
+        writer.release()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), partial(ThrottledHandler, directory=self.serve_dir))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.serve_dir)
+        shutil.rmtree(self.work_dir)
+
+    def test_read_while_downloading(self):
+        file_path = os.path.join(self.work_dir, 'movie.avi')
+        download = StreamingDownload(f'{self.url}/movie.avi', file_path)
+        download.start()
+
+        stream = MovieStream(file_path)
+        started_while_downloading = None
+        frames = []
+        for frame_number, img in stream.frames(frame_interval=3):
+            if started_while_downloading is None:
+                started_while_downloading = is_downloading(file_path)
+            frames.append((frame_number, img.copy()))
+        download.join()
+
+        self.assertIsNone(download.error)
+        self.assertTrue(started_while_downloading)
+        self.assertEqual(stream.frame_count, self.FRAMES)
+        self.assertEqual([f for f, _ in frames], list(range(0, self.FRAMES, 3)))
+
+        # frame numbers match VideoCapture on the completed file
+        cap = cv2.VideoCapture(file_path)
+        for frame_number, img in frames[:5]:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+            ret, expected = cap.read()
+            self.assertTrue(ret)
+            self.assertLess(np.mean(np.abs(img.astype(int) - expected.astype(int))), 2)
+        cap.release()
+
+    def test_mp4_moov_at_end(self):
+        # mp4 muxer writes the moov atom after the media data unless faststart is given, as in most uploads
+        mp4_path = os.path.join(self.serve_dir, 'movie.mp4')
+        subprocess.run(
+            ['ffmpeg', '-y', '-v', 'error', '-i', os.path.join(self.serve_dir, 'movie.avi'), '-c:v', 'mpeg4', '-q:v', '5', '-vsync', '0', mp4_path],
+            check=True
+        )
+        self.assertTrue(is_moov_at_end(mp4_path))
+
+        file_path = os.path.join(self.work_dir, 'movie.mp4')
+        download = StreamingDownload(f'{self.url}/movie.mp4', file_path)
+        download.start()
+
+        stream = MovieStream(file_path)
+        frames = [frame_number for frame_number, _ in stream.frames(frame_interval=3)]
+        download.join()
+
+        self.assertIsNone(download.error)
+        self.assertEqual(stream.frame_count, self.FRAMES)
+        self.assertEqual(frames, list(range(0, self.FRAMES, 3)))
+
+    def test_download_failure(self):
+        file_path = os.path.join(self.work_dir, 'missing.avi')
+        download = StreamingDownload(f'{self.url}/missing.avi', file_path)
+        download.start()
+        download.join()
+
+        self.assertIsNotNone(download.error)
+        self.assertFalse(is_downloading(file_path))
+        with self.assertRaises(Exception):
+            MovieStream(file_path)
+
+def atom(kind: bytes, payload: bytes=b'') -> bytes:
+    return (8 + len(payload)).to_bytes(4, 'big') + kind + payload
+
+class FakeDecoder:
+    # stands in for the ffmpeg process. records how it was started and returns blank frames
+    def __init__(self, movie_path: str, frames: int, frame_size: int) -> None:
+        self.movie_path = movie_path
+        self.frames = frames
+        self.frame_size = frame_size
+        self.calls = []
+
+    def __call__(self, args, stdin=None, stdout=None, stderr=None):
+        self.calls.append((args, is_downloading(self.movie_path)))
+        return mock.Mock(stdin=io.BytesIO(), stdout=io.BytesIO(bytes(self.frames * self.frame_size)))
+
+class TestMovieStreamInput(unittest.TestCase):
+    # decoder input chosen by the container layout. runs without ffmpeg
+    WIDTH = 4
+    HEIGHT = 2
+    FRAMES = 5
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.movie_path = os.path.join(self.work_dir, 'movie.mp4')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _read_while_downloading(self, content: bytes) -> (list[int], FakeDecoder):
+        with open(self.movie_path, 'wb') as f:
+            f.write(content)
+        open(self.movie_path + PART_SUFFIX, 'w').close()
+        # download completes while the stream is being read
+        completion = threading.Timer(0.2, os.remove, [self.movie_path + PART_SUFFIX])
+        decoder = FakeDecoder(self.movie_path, self.FRAMES, self.WIDTH * self.HEIGHT * 3)
+        with mock.patch('movie_stream.probe_movie', return_value=(self.WIDTH, self.HEIGHT, 30.0)), \
+             mock.patch('movie_stream.subprocess.Popen', decoder), \
+             mock.patch.object(MovieStream, 'WAIT_INTERVAL', 0.01):
+            completion.start()
+            stream = MovieStream(self.movie_path)
+            frames = [frame_number for frame_number, _ in stream.frames()]
+        completion.join()
+        return frames, decoder
+
+    def test_moov_at_end(self):
+        frames, decoder = self._read_while_downloading(atom(b'ftyp', b'isom') + atom(b'mdat', bytes(64)) + atom(b'moov'))
+        args, downloading = decoder.calls[0]
+        # known limitation: decoded by path only after the download completes
+        self.assertIn(self.movie_path, args)
+        self.assertNotIn('pipe:0', args)
+        self.assertFalse(downloading)
+        self.assertEqual(list(range(self.FRAMES)), frames)
+
+    def test_moov_first(self):
+        frames, decoder = self._read_while_downloading(atom(b'ftyp', b'isom') + atom(b'moov') + atom(b'mdat', bytes(64)))
+        args, downloading = decoder.calls[0]
+        self.assertIn('pipe:0', args)
+        self.assertTrue(downloading)
+        self.assertEqual(list(range(self.FRAMES)), frames)
+
+    def test_is_moov_at_end(self):
+        large_mdat = (1).to_bytes(4, 'big') + b'mdat' + (16 + 8).to_bytes(8, 'big') + bytes(8)
+        cases = [
+            (atom(b'ftyp') + atom(b'free', bytes(4)) + atom(b'mdat') + atom(b'moov'), True),
+            (atom(b'ftyp') + atom(b'moov') + atom(b'mdat'), False),
+            (atom(b'ftyp') + large_mdat + atom(b'moov'), True),
+            # moov not arrived yet
+            (atom(b'ftyp') + atom(b'free', bytes(4))[:6], False),
+            (b'RIFF\x00\x00\x00\x00AVI LIST', False)
+        ]
+        for content, expected in cases:
+            with self.subTest(content=content):
+                with open(self.movie_path, 'wb') as f:
+                    f.write(content)
+                self.assertEqual(expected, is_moov_at_end(self.movie_path))
+
+def add_tests(suite: unittest.TestSuite):
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(TestMovieStream))
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(TestMovieStreamInput))
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    add_tests(suite)
+    runner = unittest.TextTestRunner(failfast=False)
+    result = runner.run(suite)
@@ -0,0 +1,81 @@
+import unittest
+import random
+from dataclasses import dataclass
+from prediction.frame import Frame
+from events.util import TestResult, find_target_frames, target_ranges_generator, find_target_ranges
+
+@dataclass
+class TimelineFrame(Frame):
+    result: TestResult
+
+def make_timeline(frame_count: int, seed: int) -> list[TimelineFrame]:
+    # short target runs broken by non target and pending frames, like notifications over a battle
+    rnd = random.Random(seed)
+    results = [TestResult.TARGET, TestResult.NOT_TARGET, TestResult.NOT_TARGET, TestResult.NOT_TARGET, TestResult.PENDING]
+    return [TimelineFrame(frame=i, image=None, result=rnd.choice(results)) for i in range(frame_count)]
+
+def is_target_frame(frame: TimelineFrame, in_target_frame: bool) -> TestResult:
+    return frame.result
+
+def sliced_ranges(frames: list[Frame], is_target_frame, exit_test_frame_count: int, interval: int=1) -> list[(int, int)]:
+    # previous generator. the remaining frames were copied for each search
+    ranges = []
+    cur_pos = 0
+    while cur_pos < len(frames):
+        start_idx, end_idx = find_target_frames(frames[cur_pos:], is_target_frame, exit_test_frame_count, interval)
+        if start_idx is None:
+            break
+        ranges.append((start_idx + cur_pos, end_idx + cur_pos))
+        cur_pos = end_idx + cur_pos + 1
+    return ranges
+
+class CountingFrames(list):
+    # counts the frames read by index or copied by slice
+    def __init__(self, frames: list) -> None:
+        super().__init__(frames)
+        self.visited = 0
+
+    def __getitem__(self, key):
+        item = super().__getitem__(key)
+        self.visited += len(item) if isinstance(key, slice) else 1
+        return item
+
+class TestTargetFrames(unittest.TestCase):
+    FRAMES = 20000
+    # frames visited per frame. the previous generator copied the remaining frames for each range
+    MAX_VISITS_PER_FRAME = 2
+
+    def test_same_ranges(self):
+        for seed in range(20):
+            frames = make_timeline(2000, seed)
+            for exit_test_frame_count in [1, 2, 5, 30]:
+                for interval in [1, 3]:
+                    with self.subTest(seed=seed, exit_test_frame_count=exit_test_frame_count, interval=interval):
+                        expected = sliced_ranges(frames, is_target_frame, exit_test_frame_count, interval)
+                        actual = list(target_ranges_generator(frames, is_target_frame, exit_test_frame_count, interval))
+                        self.assertEqual(expected, actual)
+
+    def test_one_pass_ranges(self):
+        frames = make_timeline(5000, 0)
+        exit_counts = [1, 2, 5, 30]
+        ranges = find_target_ranges(frames, { count: (is_target_frame, count) for count in exit_counts })
+        for count in exit_counts:
+            self.assertEqual(list(target_ranges_generator(frames, is_target_frame, count)), ranges[count])
+
+    def test_linear_scaling(self):
+        frames = CountingFrames(make_timeline(self.FRAMES, 0))
+        list(target_ranges_generator(frames, is_target_frame, 2))
+        self.assertLessEqual(frames.visited, self.FRAMES * self.MAX_VISITS_PER_FRAME)
+        # the count tells the quadratic search apart
+        frames = CountingFrames(make_timeline(self.FRAMES, 0))
+        sliced_ranges(frames, is_target_frame, 2)
+        self.assertLess(self.FRAMES * self.MAX_VISITS_PER_FRAME, frames.visited)
+
+def add_tests(suite: unittest.TestSuite):
+    suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(TestTargetFrames))
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    add_tests(suite)
+    runner = unittest.TextTestRunner(failfast=False)
+    result = runner.run(suite)
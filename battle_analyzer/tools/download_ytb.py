@@ -45,6 +45,14 @@ def download(video_id: str, dst_dir: str, file_name: str=None, live_only: bool=F
         print(f'Downloading...: {file_name}')
         stream.download(output_path=dst_dir, filename=file_name, max_retries=3)
 
+def get_stream_url(video_id: str) -> str:
+    video_url = f'https://www.youtube.com/watch?v={video_id}'
+    yt = YouTube(video_url)
+    stream = yt.streams.filter(res='720p', progressive=True).first() or yt.streams.filter(res='720p').first()
+    if stream is None:
+        raise Exception('available stream not found')
+    return stream.url
+
 def _to_video_info(item):
     return {
         'id': item['id']['videoId'],
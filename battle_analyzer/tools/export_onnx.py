@@ -0,0 +1,54 @@
+import os
+import sys
+import argparse
+from ultralytics import YOLO
+from dotenv import load_dotenv
+load_dotenv()
+
+# env variables of the models run by the analyzer
+MODEL_PATH_ENVS = [
+    'IKALAMP_MODEL_PATH',
+    'IKA_PLAYER_MODEL_PATH',
+    'NOTIFICATION_MODEL_PATH',
+    'PLATE_MODEL_PATH',
+    'BATTLE_INDICATOR_MODEL_PATH',
+    'MATCH_MODEL_PATH',
+    'CHAR_TYPE_MODEL_PATH',
+    'HIRAGANA_MODEL_PATH',
+    'KATAKANA_MODEL_PATH',
+    'NUMBER_MODEL_PATH',
+    'ALPHABET_MODEL_PATH',
+    'SYMBOL_MODEL_PATH',
+    'CHAR_MODEL_PATH',
+    'STAGE_MODEL_PATH',
+    'BUKI_MODEL_PATH',
+    'SUB_WEAPON_MODEL_PATH',
+    'SPECIAL_WEAPON_MODEL_PATH',
+    'WEAPON_GAUGE_MODEL_PATH',
+    'INK_TANK_MODEL_PATH',
+    'SCENE_MODEL_PATH'
+]
+
+def export(model_path: str, opset: int=None) -> str:
+    """
+    Export a .pt model to .onnx next to it with a dynamic batch axis, so batched inference works on ONNX Runtime.
+    The exporter stores task, names and imgsz in the model metadata, which OnnxBackend reads.
+    """
+    model = YOLO(model_path)
+    return model.export(format='onnx', imgsz=model.overrides['imgsz'], dynamic=True, simplify=True, opset=opset)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='export models to onnx. point *_MODEL_PATH at the .onnx files to run them on ONNX Runtime')
+    parser.add_argument('model_paths', nargs='*', help='.pt files. models of the *_MODEL_PATH env variables when omitted')
+    parser.add_argument('--opset', type=int, default=None)
+    args = parser.parse_args()
+
+    model_paths = args.model_paths
+    if len(model_paths) == 0:
+        model_paths = [os.environ[env] for env in MODEL_PATH_ENVS if os.environ.get(env, '').endswith('.pt')]
+    if len(model_paths) == 0:
+        print('no model to export')
+        sys.exit(1)
+
+    for model_path in model_paths:
+        print(f'{model_path} -> {export(model_path, args.opset)}')
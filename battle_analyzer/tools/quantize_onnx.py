@@ -0,0 +1,174 @@
+import os
+import sys
+import argparse
+import subprocess
+import random
+import cv2
+import numpy as np
+import onnx
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+from ultralytics.data.augment import classify_transforms
+from dotenv import load_dotenv
+# run from the repository root like run_test.py
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from prediction.inference_backend import OnnxBackend, int8_model_path
+from prediction.prediction_process import preprocess, infer, pred_boxes
+from tools.export_onnx import export
+from tests.config import config
+load_dotenv()
+
+# models quantized and the model whose detections give their calibration crops. None calibrates on frames
+CALIBRATION_SOURCES = {
+    'IKALAMP_MODEL_PATH': None,
+    'NOTIFICATION_MODEL_PATH': None,
+    'BATTLE_INDICATOR_MODEL_PATH': None,
+    'BUKI_MODEL_PATH': 'IKALAMP_MODEL_PATH',
+    'PLATE_MODEL_PATH': 'NOTIFICATION_MODEL_PATH',
+    'CHAR_TYPE_MODEL_PATH': 'PLATE_MODEL_PATH',
+    'CHAR_MODEL_PATH': 'CHAR_TYPE_MODEL_PATH'
+}
+FRAMES_PER_MOVIE = 8
+MAX_CALIBRATION_IMAGES = 256
+
+class ImageCalibrationReader(CalibrationDataReader):
+    def __init__(self, backend: OnnxBackend, images: list[np.ndarray]) -> None:
+        self.backend = backend
+        self.images = iter(images)
+        self.transform = classify_transforms(backend.imgsz) if backend.task == 'classify' else None
+
+    def get_next(self) -> dict:
+        img = next(self.images, None)
+        if img is None:
+            return None
+        # same input as the analyzer gives the model
+        if self.transform is not None:
+            input = self.transform(img).unsqueeze(0)
+        else:
+            input = preprocess(img, self.backend.imgsz, 'cpu')
+        return { self.backend.input_name: input.numpy() }
+
+def test_movies() -> list[str]:
+    movies = []
+    def _collect(item):
+        if isinstance(item, dict):
+            for v in item.values():
+                _collect(v)
+        elif isinstance(item, str) and item.endswith('.mp4'):
+            movies.append(item)
+    _collect(config['rules'])
+    _collect(config['stages'])
+    return [m for m in movies if os.path.exists(m)]
+
+def sample_frames(movie_paths: list[str], frames_per_movie: int) -> list[np.ndarray]:
+    frames = []
+    for movie_path in movie_paths:
+        cap = cv2.VideoCapture(movie_path)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        for frame_number in np.linspace(0, total_frames - 1, frames_per_movie, dtype=int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+            ret, img = cap.read()
+            if ret:
+                frames.append(img)
+        cap.release()
+    return frames
+
+def calibration_images(env: str, onnx_paths: dict[str, str], frames: list[np.ndarray], cache: dict) -> list[np.ndarray]:
+    if env in cache:
+        return cache[env]
+    source = CALIBRATION_SOURCES[env]
+    if source is None:
+        images = frames
+    else:
+        # crops of what the upstream detector finds, as the analyzer feeds them
+        backend = OnnxBackend(onnx_paths[source], 'cpu')
+        images = []
+        for img in calibration_images(source, onnx_paths, frames, cache):
+            pred = infer(backend, [preprocess(img, backend.imgsz, 'cpu', to_4d=False)], img.shape, 0.45, 0.25, 100)[0]
+            images.extend(img[y1:y2,x1:x2] for x1, y1, x2, y2 in pred_boxes(pred) if x1 < x2 and y1 < y2)
+    if MAX_CALIBRATION_IMAGES < len(images):
+        images = random.Random(0).sample(images, MAX_CALIBRATION_IMAGES)
+    cache[env] = images
+    return images
+
+def _head_nodes(model: onnx.ModelProto) -> list[str]:
+    # box regression of the last module loses too much in int8
+    indices = [int(n.name.split('/')[1].split('.')[1]) for n in model.graph.node if n.name.startswith('/model.')]
+    if len(indices) == 0:
+        return []
+    prefix = f'/model.{max(indices)}/'
+    return [n.name for n in model.graph.node if n.name.startswith(prefix)]
+
+def quantize(onnx_path: str, dst_path: str, images: list[np.ndarray]) -> str:
+    backend = OnnxBackend(onnx_path, 'cpu')
+    model = onnx.load(onnx_path)
+    quantize_static(
+        onnx_path,
+        dst_path,
+        ImageCalibrationReader(backend, images),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        nodes_to_exclude=_head_nodes(model) if backend.task == 'detect' else []
+    )
+    # task, names and imgsz for OnnxBackend
+    quantized = onnx.load(dst_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(model.metadata_props)
+    onnx.save(quantized, dst_path)
+    return dst_path
+
+def run_gate(model_paths: dict[str, str]) -> bool:
+    """
+    Run the analyzer tests with the quantized models. They are accepted only if the tests pass within their tolerances.
+    """
+    env = dict(os.environ, **model_paths)
+    env.pop('QUANTIZED_MODELS', None)
+    result = subprocess.run([sys.executable, 'battle_analyzer/run_test.py'], env=env)
+    return result.returncode == 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='quantize models to int8. set QUANTIZED_MODELS=1 to run the accepted models')
+    parser.add_argument('--envs', nargs='*', default=list(CALIBRATION_SOURCES.keys()), help='*_MODEL_PATH env variables of the models to quantize')
+    parser.add_argument('--frames-per-movie', type=int, default=FRAMES_PER_MOVIE)
+    parser.add_argument('--skip-gate', action='store_true', help='accept without running the tests')
+    args = parser.parse_args()
+
+    movies = test_movies()
+    if len(movies) == 0:
+        print('no test movie for calibration')
+        sys.exit(1)
+    frames = sample_frames(movies, args.frames_per_movie)
+    print(f'calibration frames: {len(frames)} from {len(movies)} movies')
+
+    # upstream models of the calibration crops are needed in onnx as well
+    onnx_paths = {}
+    envs = set(args.envs)
+    for env in args.envs:
+        source = CALIBRATION_SOURCES[env]
+        while source is not None:
+            envs.add(source)
+            source = CALIBRATION_SOURCES[source]
+    for env in envs:
+        model_path = os.environ[env]
+        onnx_paths[env] = export(model_path) if model_path.endswith('.pt') else model_path
+
+    cache = {}
+    candidates = {}
+    for env in args.envs:
+        images = calibration_images(env, onnx_paths, frames, cache)
+        if len(images) == 0:
+            print(f'[{env}] no calibration image. skipped')
+            continue
+        dst_path = int8_model_path(onnx_paths[env]).replace('.int8.onnx', '.int8.candidate.onnx')
+        candidates[env] = quantize(onnx_paths[env], dst_path, images)
+        print(f'[{env}] quantized with {len(images)} images: {candidates[env]}')
+
+    if not args.skip_gate and not run_gate(candidates):
+        print('analyzer tests failed with the quantized models. rejected')
+        sys.exit(1)
+
+    for env, candidate_path in candidates.items():
+        accepted_path = candidate_path.replace('.int8.candidate.onnx', '.int8.onnx')
+        os.replace(candidate_path, accepted_path)
+        print(f'[{env}] accepted: {accepted_path}')
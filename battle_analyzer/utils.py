@@ -1,4 +1,16 @@
 from enum import Enum
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import Future
+from threading import Lock
+from dataclasses import dataclass, asdict
+import bisect
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import time
 import numpy as np
 import cv2
 import Levenshtein
@@ -6,6 +18,8 @@ from typing import Any
 from models.detected_item import DetectedItem
 from models.ika_player import IkaPlayer
 from prediction.frame import Frame
+from prediction.crop_store import CropStore
+from movie_stream import is_downloading
 
 def class_to_dict(obj):
     # オブジェクトが辞書に変換可能な場合
@@ -14,11 +28,13 @@ def class_to_dict(obj):
     elif hasattr(obj, "__dict__"):
         result = {}
         for key, value in obj.__dict__.items():
+            if key.startswith('_'):
+                continue # caches built on demand
             # 再帰的に変換
             result[key] = class_to_dict(value)
         return result
     # オブジェクトがリストまたはタプルの場合
-    elif isinstance(obj, (list, tuple)):
+    elif isinstance(obj, (list, tuple)) or (isinstance(obj, Sequence) and not isinstance(obj, (str, bytes))):
         return [class_to_dict(item) for item in obj]
     elif isinstance(obj, dict):
         result = {}
@@ -50,42 +66,374 @@ def bounding_box(mask: np.ndarray):
     max_x, max_y = np.max(non_zero_points, axis=0)
     return [min_x, min_y, max_x, max_y]
 
+class FrameCache:
+    """
+    LRU cache of decoded frames keyed by (movie, frame number), bounded by total image bytes.
+    Least recently read frames are evicted first when the limit is exceeded.
+    Cached frames are made read-only since every reader of the movie gets the same array.
+    """
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def get(self, movie: tuple, frame_number: int) -> np.ndarray:
+        key = (movie, frame_number)
+        with self.lock:
+            img = self.frames.get(key)
+            if img is None:
+                self.misses += 1
+                return None
+            self.frames.move_to_end(key)
+            self.hits += 1
+            return img
+
+    def put(self, movie: tuple, frame_number: int, img: np.ndarray):
+        if img.nbytes > self.max_bytes:
+            return
+        key = (movie, frame_number)
+        # a caller drawing on a frame would change it for all later readers
+        img.flags.writeable = False
+        with self.lock:
+            if key in self.frames:
+                self.total_bytes -= self.frames.pop(key).nbytes
+            self.frames[key] = img
+            self.total_bytes += img.nbytes
+            while self.max_bytes < self.total_bytes:
+                _, evicted = self.frames.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self, movie: tuple=None):
+        with self.lock:
+            if movie is None:
+                self.frames.clear()
+                self.total_bytes = 0
+                return
+            for key in [k for k in self.frames if k[0] == movie]:
+                self.total_bytes -= self.frames.pop(key).nbytes
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0,
+                'evictions': self.evictions,
+                'frames': len(self.frames),
+                'bytes': self.total_bytes
+            }
+
+class OCRCache:
+    """
+    LRU cache of OCR results keyed by (kind, crop hash), bounded by entry count.
+    The crop hash is exact on a grayscale image quantized to 32 levels, so the same overlay read on
+    many frames hits while any visible change of the text misses.
+    A parent cache is looked up on a miss and receives every put, as a tier shared across battles.
+    """
+    QUANTIZE_SHIFT = 3
+
+    def __init__(self, max_entries: int, parent=None) -> None:
+        self.max_entries = max_entries
+        self.parent: OCRCache = parent
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    @classmethod
+    def crop_key(cls, kind: str, img: np.ndarray) -> tuple:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        quantized = np.ascontiguousarray(gray) >> cls.QUANTIZE_SHIFT
+        return (kind, gray.shape, hashlib.blake2b(quantized.tobytes(), digest_size=16).digest())
+
+    def get(self, key: tuple) -> Any:
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            self.misses += 1
+        value = self.parent.get(key) if self.parent is not None else None
+        if value is not None:
+            self._put(key, value)
+        return value
+
+    def put(self, key: tuple, value: Any):
+        self._put(key, value)
+        if self.parent is not None:
+            self.parent.put(key, value)
+
+    def _put(self, key: tuple, value: Any):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while self.max_entries < len(self.items):
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0,
+                'evictions': self.evictions,
+                'entries': len(self.items)
+            }
+
+@dataclass
+class MovieIndex:
+    """
+    Keyframe positions and exact frame count of a movie, built once with ffprobe.
+    Stored in MOVIE_INDEX_DIR (the temp dir by default) under a name derived from the movie path, not next to the movie,
+    and used while the movie keeps its size. Not built while the movie is still downloading.
+    """
+    frame_count: int
+    keyframes: list[int]
+    size: int
+
+    INDEX_SUFFIX = '.kfindex.json'
+    # indexes used in this process by (path, size)
+    loaded = {}
+
+    @classmethod
+    def index_path(cls, movie_path: str) -> str:
+        index_dir = os.environ.get('MOVIE_INDEX_DIR', tempfile.gettempdir())
+        return os.path.join(index_dir, hashlib.sha1(os.path.abspath(movie_path).encode()).hexdigest() + cls.INDEX_SUFFIX)
+
+    @classmethod
+    def load(cls, movie_path: str):
+        if is_downloading(movie_path):
+            # frame count and keyframes are not final yet
+            return None
+        key = (os.path.abspath(movie_path), os.path.getsize(movie_path))
+        if key in cls.loaded:
+            return cls.loaded[key]
+        index = None
+        try:
+            with open(cls.index_path(movie_path)) as f:
+                index = cls(**json.load(f))
+            if index.size != key[1]:
+                index = None
+        except Exception:
+            pass
+        if index is None:
+            index = cls.build(movie_path)
+            if index is None:
+                return None
+            try:
+                os.makedirs(os.path.dirname(cls.index_path(movie_path)), exist_ok=True)
+                with open(cls.index_path(movie_path), 'w') as f:
+                    json.dump(asdict(index), f)
+            except OSError:
+                pass # read only location. rebuilt by the next process
+        cls.loaded[key] = index
+        return index
+
+    @classmethod
+    def build(cls, movie_path: str):
+        size = os.path.getsize(movie_path)
+        try:
+            # packets are listed in decode order. frame numbers follow presentation order
+            out = subprocess.run(
+                ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts,flags', '-of', 'csv=p=0', movie_path],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True
+            ).stdout.decode()
+        except Exception:
+            return None
+        packets = []
+        for line in out.splitlines():
+            pts, flags = (line.split(',') + [''])[:2]
+            if pts == 'N/A' or pts == '':
+                continue
+            packets.append((int(pts), 'K' in flags))
+        if len(packets) == 0:
+            return None
+        packets.sort(key=lambda p: p[0])
+        return cls(
+            frame_count=len(packets),
+            keyframes=[i for i, (_, key) in enumerate(packets) if key],
+            size=size
+        )
+
+    def keyframe_before(self, frame_number: int) -> int:
+        pos = bisect.bisect_right(self.keyframes, frame_number) - 1
+        return self.keyframes[pos] if pos >= 0 else 0
+
 class MovieReader:
+    # shared by all readers in the process so frames decoded by a previous stage are not decoded again
+    cache = FrameCache(int(os.environ.get('FRAME_CACHE_BYTES', 1024 * 1024 * 1024)))
+
+    # initial decode cost estimates in seconds. updated with measured values
+    GRAB_TIME = 0.002
+    SEEK_OVERHEAD = 0.02
+
     def __init__(self, movie_path: str) -> None:
         self.movie_path = movie_path
+        # frames of a movie still downloading are not cached. a complete movie is keyed by path and size,
+        # so a file replaced on the same path does not hit frames of the old one
+        self.movie_key = None if is_downloading(movie_path) else (os.path.abspath(movie_path), os.path.getsize(movie_path))
+        self.index = MovieIndex.load(movie_path)
+        self.grab_time = self.GRAB_TIME
+        self.seek_overhead = self.SEEK_OVERHEAD
         self.cap = cv2.VideoCapture(movie_path)
         self.cur_frame = 0
         ret, self.cur_img = self.cap.read()
         if not ret:
             raise Exception('failed to read frame')
+        if self.movie_key is not None:
+            self.cache.put(self.movie_key, 0, self.cur_img)
+
+    @property
+    def frame_count(self) -> int:
+        if self.index is not None:
+            return self.index.frame_count
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
     def read(self, frame_number: int) -> np.ndarray:
         if frame_number == self.cur_frame:
             return self.cur_img
 
-        if frame_number < self.cur_frame or (frame_number - self.cur_frame > 100):
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-            self.cur_frame = frame_number
-            ret, self.cur_img = self.cap.read()
+        img = self.cache.get(self.movie_key, frame_number) if self.movie_key is not None else None
+        if img is not None:
+            return img
+
+        if self._should_seek(frame_number):
+            self._seek(frame_number)
+        else:
+            self._grab_forward(frame_number)
+        if self.movie_key is not None:
+            self.cache.put(self.movie_key, frame_number, self.cur_img)
+        return self.cur_img
+
+    def read_crop(self, frame_number: int, xyxy: list[int]) -> np.ndarray:
+        crop = CropStore.lookup(self.movie_path, frame_number, xyxy)
+        if crop is not None:
+            return crop
+        img = self.read(frame_number)
+        return img[xyxy[1]:xyxy[3],xyxy[0]:xyxy[2]]
+
+    def _should_seek(self, frame_number: int) -> bool:
+        if frame_number < self.cur_frame:
+            return True
+        if self.index is None:
+            return frame_number - self.cur_frame > 100
+        # seeking decodes from the keyframe before the target
+        keyframe = self.index.keyframe_before(frame_number)
+        if keyframe <= self.cur_frame:
+            return False
+        forward_cost = (frame_number - self.cur_frame) * self.grab_time
+        seek_cost = self.seek_overhead + (frame_number - keyframe + 1) * self.grab_time
+        return seek_cost < forward_cost
+
+    def _seek(self, frame_number: int):
+        start = time.time()
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        self.cur_frame = frame_number
+        ret, self.cur_img = self.cap.read()
+        if not ret:
+            raise Exception('failed to read frame')
+        if self.index is not None:
+            decoded = frame_number - self.index.keyframe_before(frame_number) + 1
+            overhead = max(0, time.time() - start - decoded * self.grab_time)
+            self.seek_overhead = 0.8 * self.seek_overhead + 0.2 * overhead
+
+    def _grab_forward(self, frame_number: int):
+        start = time.time()
+        frames = frame_number - self.cur_frame
+        while self.cur_frame < frame_number:
+            self.cur_frame += 1
+            ret = self.cap.grab()
             if not ret:
                 raise Exception('failed to read frame')
-            #print('MOVIE UNWIND!!!!!!!!!!!!!!!!!')
-            return self.cur_img
-        else:
-            while self.cur_frame < frame_number:
-                self.cur_frame += 1
-                ret = self.cap.grab()
+            if self.cur_frame == frame_number:
+                ret, self.cur_img = self.cap.retrieve()
                 if not ret:
                     raise Exception('failed to read frame')
-                if self.cur_frame == frame_number:
-                    ret, self.cur_img = self.cap.retrieve()
-                    if not ret:
-                        raise Exception('failed to read frame')
-            return self.cur_img
+        self.grab_time = 0.8 * self.grab_time + 0.2 * (time.time() - start) / frames
     
     def release(self):
         self.cap.release()
 
+class FrameRequestPlanner:
+    """
+    Collects frames and ROIs that stages need and reads them in one sorted forward pass.
+    One planner is shared by the stages of an analysis, so requests of several stages made before run() are read together.
+    Each request resolves to the full image (rois=None) or the list of crops in request order.
+    With transform, the request resolves to transform(image or crops) applied when the frame is read,
+    so a stage can keep a resized image instead of the full frame until it uses it.
+    Crops already archived by the detection pass are served from the crop store without decoding.
+    """
+    def __init__(self, movie_path: str) -> None:
+        self.movie_path = movie_path
+        self.requests: dict[int, list] = {}
+        # stages on other threads may request while a pass is running
+        self.lock = Lock()
+
+    def request(self, frame_number: int, rois: list[list[int]]=None, callback=None, transform=None) -> Future:
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(lambda f: callback(frame_number, f.result()))
+        with self.lock:
+            self.requests.setdefault(frame_number, []).append((rois, transform, future))
+        return future
+
+    def run(self):
+        with self.lock:
+            requests, self.requests = self.requests, {}
+        pending_requests = {}
+        for frame_number, frame_requests in requests.items():
+            pending = []
+            for rois, transform, future in frame_requests:
+                crops = None
+                if rois is not None:
+                    crops = [CropStore.lookup(self.movie_path, frame_number, xyxy) for xyxy in rois]
+                if crops is not None and all(crop is not None for crop in crops):
+                    self._resolve(future, transform, crops)
+                else:
+                    pending.append((rois, transform, future))
+            if len(pending) > 0:
+                pending_requests[frame_number] = pending
+        if len(pending_requests) == 0:
+            return
+        reader = MovieReader(self.movie_path)
+        try:
+            for frame_number in sorted(pending_requests):
+                try:
+                    img = reader.read(frame_number)
+                except Exception as e:
+                    for _, _, future in pending_requests[frame_number]:
+                        future.set_exception(e)
+                    continue
+                for rois, transform, future in pending_requests[frame_number]:
+                    if rois is None:
+                        self._resolve(future, transform, img)
+                    else:
+                        # copy crops so the full frame is not kept alive by them
+                        self._resolve(future, transform, [img[xyxy[1]:xyxy[3],xyxy[0]:xyxy[2]].copy() for xyxy in rois])
+        finally:
+            reader.release()
+
+    def _resolve(self, future: Future, transform, value):
+        try:
+            future.set_result(transform(value) if transform is not None else value)
+        except Exception as e:
+            future.set_exception(e)
+
 def is_likely_equal(test_str: str, target_str: str) -> bool:
     return Levenshtein.ratio(test_str, target_str) > 0.5
 